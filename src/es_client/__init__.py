@@ -1,4 +1,4 @@
-from src.es_client.query import search
+from src.es_client.query import close_cursor_async, count, count_async, msearch, msearch_async, search, search_async
 
 # Explicit exports
-__all__ = ['search']
+__all__ = ['close_cursor_async', 'count', 'count_async', 'msearch', 'msearch_async', 'search', 'search_async']
@@ -0,0 +1,190 @@
+"""
+Access filters that reference workspace ID sets stored in Elasticsearch.
+
+With ACCESS_FILTER_MODE=lookup, the public workspace set and each user's
+private set are stored as documents in the ACL index, and searches refer to
+them with a terms lookup instead of listing every workspace ID in the request
+body. Elasticsearch fetches the documents itself, and can reuse the filter for
+the public set across all users.
+
+Documents are named as in `ws_auth_parts` and are re-written whenever the set
+for a name changes: either when a search finds a set that differs from the one
+this process last stored, or right away when the ws_auth background refresher
+fetches a new set. Terms lookups read documents with a realtime GET, so a
+write is visible to the next search without an index refresh.
+
+Each write is versioned with the time that the workspace listed the set, so a
+worker holding an older set cannot overwrite a newer one stored by another
+worker. Documents that no worker has written for ACL_DOC_MAX_AGE seconds,
+such as those of tokens that are no longer used, are deleted by a periodic
+sweep.
+"""
+import hashlib
+import json
+import time
+
+from src.utils import metrics
+from src.utils.cache import MISSING, TTLCache
+from src.utils.config import config
+from src.utils.http_client import get_async_client, get_session
+from src.utils.logger import logger
+from src.utils.refresher import BackgroundRefresher
+from src.utils.workspace import add_refresh_listener
+from src.utils.ws_id_set import WorkspaceIdSet
+from src.es_client import nodes
+from src.exceptions import ElasticsearchError
+
+_HEADERS = {'Content-Type': 'application/json'}
+
+# A single shard that is copied to every node, so lookups never leave the node
+_INDEX_BODY = {
+    'settings': {
+        'number_of_shards': 1,
+        'auto_expand_replicas': '0-all',
+    },
+    'mappings': {
+        # The IDs are only read from the source by terms lookups
+        'dynamic': False,
+        'properties': {
+            'stored_at': {'type': 'double'},
+        },
+    },
+}
+
+# Digest of the set last stored by this process, by document name. Entries
+# expire along with the ws_auth cache, so documents in use are re-written (and
+# their `stored_at` updated) at least that often.
+_stored = TTLCache(
+    'acl_docs',
+    max_entries=config['ws_auth_cache_size'],
+    ttl=config['ws_auth_cache_ttl'] + config['ws_auth_cache_stale_ttl'],
+)
+metrics.register('acl_docs', _stored.stats)
+
+_sweeper = BackgroundRefresher(
+    'acl_sweep',
+    needs_refresh=lambda key: True,
+    interval=config['acl_sweep_interval'],
+    active_window=float('inf'),
+    max_workers=1,
+)
+_SWEEP_KEY = 'acl_docs'
+
+
+def lookup_filter(parts: list) -> str:
+    """
+    Serialized filter clause for the (name, WorkspaceIdSet) pairs from
+    `ws_auth_parts`, storing any set that has changed.
+    """
+    _sweeper.track(_SWEEP_KEY, sweep)
+    parts = [(name, ws_ids, _digest(ws_ids)) for (name, ws_ids) in parts if ws_ids]
+    for (name, ws_ids, digest) in parts:
+        if _stored.get(name) != digest:
+            _store(name, ws_ids, digest)
+    return _lookup_clause([name for (name, _, _) in parts])
+
+
+async def lookup_filter_async(parts: list) -> str:
+    """Non-blocking version of `lookup_filter`."""
+    _sweeper.track(_SWEEP_KEY, sweep)
+    parts = [(name, ws_ids, _digest(ws_ids)) for (name, ws_ids) in parts if ws_ids]
+    for (name, ws_ids, digest) in parts:
+        if _stored.get(name) != digest:
+            await _store_async(name, ws_ids, digest)
+    return _lookup_clause([name for (name, _, _) in parts])
+
+
+def ensure_index():
+    """Create the ACL index if it does not exist yet."""
+    with nodes.node() as base:
+        resp = get_session().put(base + '/' + config['acl_index'], data=json.dumps(_INDEX_BODY), headers=_HEADERS)
+    if resp.ok:
+        logger.info(f"Created the ACL index {config['acl_index']}")
+    elif 'resource_already_exists_exception' not in resp.text:
+        raise ElasticsearchError(resp.text)
+
+
+def sweep():
+    """Delete the documents that have not been written for ACL_DOC_MAX_AGE seconds."""
+    # Documents in use are re-written at least as often as `_stored` entries
+    # expire, so they are never old enough
+    max_age = max(config['acl_doc_max_age'], 2 * _stored.ttl)
+    body = {'query': {'range': {'stored_at': {'lt': time.time() - max_age}}}}
+    with nodes.node() as base:
+        # Documents re-written while the sweep runs are left alone
+        resp = get_session().post(base + '/' + config['acl_index'] + '/_delete_by_query',
+                                  params={'conflicts': 'proceed'}, data=json.dumps(body), headers=_HEADERS)
+    if not resp.ok:
+        raise ElasticsearchError(resp.text)
+    deleted = resp.json().get('deleted', 0)
+    if deleted:
+        logger.info(f"Deleted {deleted} unused ACL documents")
+
+
+def _on_refresh(name: str, ws_ids: WorkspaceIdSet):
+    """Re-write a document in use by this process as soon as its set is refreshed."""
+    stored = _stored.peek(name)
+    if stored is MISSING or not ws_ids:
+        return
+    digest = _digest(ws_ids)
+    if stored != digest:
+        _store(name, ws_ids, digest)
+
+
+add_refresh_listener(_on_refresh)
+
+
+def _lookup_clause(names: list) -> str:
+    clauses = [
+        {'terms': {'access_group': {'index': config['acl_index'], 'id': name, 'path': 'ws_ids'}}}
+        for name in names
+    ]
+    if not clauses:
+        # No readable workspaces
+        return json.dumps({'terms': {'access_group': []}})
+    if len(clauses) == 1:
+        return json.dumps(clauses[0])
+    return json.dumps({'bool': {'should': clauses, 'minimum_should_match': 1}})
+
+
+def _digest(ws_ids: WorkspaceIdSet) -> str:
+    return hashlib.blake2b(ws_ids.encode().encode('ascii'), digest_size=16).hexdigest()
+
+
+def _doc_path(name: str) -> str:
+    return '/' + config['acl_index'] + '/_doc/' + name
+
+
+def _doc(ws_ids: WorkspaceIdSet) -> str:
+    return json.dumps({'ws_ids': ws_ids.to_list(), 'stored_at': time.time()})
+
+
+def _version_params(ws_ids: WorkspaceIdSet) -> dict:
+    """
+    Write only if the stored set was not fetched later than `ws_ids`; "gte"
+    lets a set be re-written to update `stored_at`.
+    """
+    if ws_ids.fetched_at is None:
+        return {}
+    return {'version': int(ws_ids.fetched_at * 1000), 'version_type': 'external_gte'}
+
+
+def _store(name: str, ws_ids: WorkspaceIdSet, digest: str):
+    with nodes.node() as base:
+        resp = get_session().put(base + _doc_path(name), params=_version_params(ws_ids), data=_doc(ws_ids),
+                                 headers=_HEADERS)
+    _handle_store(name, digest, resp.status_code, resp.text)
+
+
+async def _store_async(name: str, ws_ids: WorkspaceIdSet, digest: str):
+    with nodes.node() as base:
+        resp = await get_async_client().put(base + _doc_path(name), params=_version_params(ws_ids),
+                                            content=_doc(ws_ids), headers=_HEADERS)
+    _handle_store(name, digest, resp.status_code, resp.text)
+
+
+def _handle_store(name: str, digest: str, status: int, resp_text: str):
+    # A conflict means another worker stored a newer set, which searches can use
+    if status >= 400 and status != 409:
+        raise ElasticsearchError(resp_text)
+    _stored.set(name, digest)
@@ -0,0 +1,219 @@
+"""
+Client-side load balancing across Elasticsearch nodes.
+
+ELASTICSEARCH_URL may list several nodes, separated by commas. Each request
+takes a node with `node()`, either round robin or the node with the fewest
+requests in flight from this worker (ES_NODE_SELECTION=least_outstanding).
+
+A node that cannot be connected to, or does not accept the connection in
+time, is taken out of rotation, and is probed every ES_NODE_PROBE_INTERVAL seconds until it answers again. If every
+node is out, requests go to the one that failed first rather than failing
+outright.
+
+With ES_SNIFF_INTERVAL set, the HTTP addresses of the cluster's nodes are
+fetched from `_nodes/http` that often, and replace the configured nodes, which
+are only used to find the cluster. Only sniff when the nodes can be reached
+directly at their published addresses.
+"""
+import functools
+import httpx
+import requests
+import threading
+import time
+import urllib3
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from src.utils import http_compression, metrics
+from src.utils.config import config
+from src.utils.http_client import get_session
+from src.utils.logger import logger
+from src.utils.refresher import BackgroundRefresher
+from src.exceptions import ElasticsearchError
+
+_SELECTIONS = ('round_robin', 'least_outstanding')
+
+
+class NodePool:
+
+    def __init__(self, urls: list, selection: str = 'round_robin'):
+        if selection not in _SELECTIONS:
+            raise RuntimeError(f"Invalid Elasticsearch node selection: {selection}")
+        self.selection = selection
+        self._lock = threading.Lock()
+        self._nodes = {}  # type: dict
+        self._order = []  # type: list
+        self._next = 0
+        self.set_urls(urls)
+
+    def set_urls(self, urls: list):
+        """Replace the nodes, keeping the state of those that remain."""
+        with self._lock:
+            self._nodes = {url: self._nodes.get(url) or _new_node() for url in urls}
+            self._order = list(self._nodes)
+
+    def urls(self) -> list:
+        with self._lock:
+            return list(self._order)
+
+    def acquire(self) -> str:
+        """Pick a node for a request, which must then be released."""
+        with self._lock:
+            usable = [url for url in self._order if self._nodes[url]['ejected_at'] is None]
+            if not usable:
+                usable = [min(self._order, key=lambda url: self._nodes[url]['ejected_at'])]
+            start = self._next % len(usable)
+            self._next += 1
+            # Starting from the next node in turn also spreads ties in load
+            usable = usable[start:] + usable[:start]
+            if self.selection == 'least_outstanding':
+                url = min(usable, key=lambda url: self._nodes[url]['in_flight'])
+            else:
+                url = usable[0]
+            state = self._nodes[url]
+            state['in_flight'] += 1
+            state['requests'] += 1
+            return url
+
+    def release(self, url: str, failed: bool = False) -> bool:
+        """
+        Finish a request on a node, ejecting the node if the request could
+        not reach it. Returns whether the node was ejected by this call.
+        """
+        with self._lock:
+            state = self._nodes.get(url)
+            if state is None:
+                # Dropped by sniffing while the request was in flight
+                return False
+            state['in_flight'] -= 1
+            if not failed:
+                return False
+            state['failures'] += 1
+            if state['ejected_at'] is not None:
+                return False
+            state['ejected_at'] = time.monotonic()
+            state['ejections'] += 1
+            return True
+
+    def readmit(self, url: str):
+        with self._lock:
+            state = self._nodes.get(url)
+            if state is not None:
+                state['ejected_at'] = None
+
+    def is_ejected(self, url: str) -> bool:
+        with self._lock:
+            state = self._nodes.get(url)
+            return state is not None and state['ejected_at'] is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                url: {
+                    'in_flight': state['in_flight'],
+                    'requests': state['requests'],
+                    'failures': state['failures'],
+                    'ejections': state['ejections'],
+                    'ejected': state['ejected_at'] is not None,
+                }
+                for (url, state) in self._nodes.items()
+            }
+
+
+def _new_node() -> dict:
+    return {'in_flight': 0, 'requests': 0, 'failures': 0, 'ejections': 0, 'ejected_at': None}
+
+
+_pool = NodePool(config['elasticsearch_urls'], config['es_node_selection'])
+metrics.register('es_nodes', _pool.stats)
+
+# Probes ejected nodes until they answer; a failed probe is retried on the next round
+_prober = BackgroundRefresher(
+    'es_node_probe',
+    needs_refresh=_pool.is_ejected,
+    interval=config['es_node_probe_interval'],
+    active_window=float('inf'),
+    max_workers=1,
+)
+
+_sniffer = BackgroundRefresher(
+    'es_sniff',
+    needs_refresh=lambda key: True,
+    interval=config['es_sniff_interval'],
+    active_window=float('inf'),
+    max_workers=1,
+)
+_SNIFF_KEY = 'nodes'
+
+
+@contextmanager
+def node():
+    """
+    Take a node for one request, as its base URL. A connection error raised
+    from the block takes the node out of rotation.
+    """
+    if config['es_sniff_interval'] > 0:
+        _sniffer.track(_SNIFF_KEY, sniff)
+    url = _pool.acquire()
+    failed = False
+    try:
+        yield url
+    except Exception as err:
+        failed = _connect_failed(err)
+        raise
+    finally:
+        if _pool.release(url, failed):
+            logger.warning(f"Could not reach Elasticsearch node {url}; taking it out of rotation")
+            _prober.track(url, functools.partial(_probe, url))
+
+
+def _connect_failed(err: Exception) -> bool:
+    """
+    Whether a request could not connect to its node. Read timeouts and
+    dropped connections are not counted, since a slow search can cause them
+    on a healthy node.
+    """
+    if isinstance(err, (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    if isinstance(err, requests.exceptions.ConnectionError):
+        # A failed connection attempt comes wrapped in a MaxRetryError; a
+        # connection that drops once open does not
+        cause = err.args[0] if err.args else None
+        return isinstance(getattr(cause, 'reason', None), urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def urls() -> list:
+    """The nodes currently in use."""
+    return _pool.urls()
+
+
+def _probe(url: str):
+    resp = get_session().get(url, timeout=5)
+    if resp.status_code >= 500:
+        raise ElasticsearchError(f"Node {url} is not ready: {resp.status_code}")
+    _pool.readmit(url)
+    _prober.untrack(url)
+    logger.info(f"Elasticsearch node {url} is back in rotation")
+
+
+def sniff():
+    """Replace the nodes with the HTTP addresses of the cluster's nodes."""
+    with node() as base:
+        resp = get_session().get(base + '/_nodes/http', params={'filter_path': 'nodes.*.http.publish_address'},
+                                 timeout=config['http_timeout'])
+    if not resp.ok:
+        raise ElasticsearchError(resp.text)
+    scheme = urlsplit(base).scheme
+    sniffed = []
+    for info in resp.json().get('nodes', {}).values():
+        address = info['http']['publish_address']
+        if '/' in address:
+            # "hostname/ip:port"; the hostname is what certificates are issued for
+            (hostname, ip_port) = address.split('/', 1)
+            address = hostname + ':' + ip_port.rsplit(':', 1)[1] if hostname else ip_port
+        sniffed.append(scheme + '://' + address)
+    if sniffed:
+        sniffed = sorted(set(sniffed))
+        http_compression.register_urls('elasticsearch', sniffed)
+        _pool.set_urls(sniffed)
@@ -1,15 +1,71 @@
 """
 Search objects on elasticsearch
 """
+import asyncio
+import base64
+import hashlib
 import re
 import json
-import requests
+import secrets
+import time
 
+from src.utils import metrics
+from src.utils.cache import MISSING
+from src.utils.cache_backends import run_io
+from src.utils.dataloader import get_loader, load_once_async
 from src.utils.logger import logger
-from src.utils.workspace import ws_auth
+from src.utils.http_client import get_async_client, get_session
+from src.utils.workspace import (
+    merge_ws_auth_parts,
+    select_ws_auth_parts,
+    ws_auth,
+    ws_auth_async,
+    ws_auth_parts,
+    ws_auth_parts_async,
+)
+from src.utils.ws_id_set import WorkspaceIdSet
 from src.utils.config import config
 from src.utils.obj_utils import get_path
-from src.exceptions import UnknownIndex, ElasticsearchError
+from src.utils.single_flight import SingleFlight
+from src.es_client import acl, nodes, result_cache, retry
+from src.exceptions import InvalidCursor, ResponseError, UnknownIndex, ElasticsearchError
+
+_HEADERS = {'Content-Type': 'application/json'}
+_MSEARCH_HEADERS = {'Content-Type': 'application/x-ndjson'}
+
+# The `cursor` param that starts paging through a point in time
+_FIRST_PAGE = '*'
+
+# The parts of a search response that are read (see `_handle_response`,
+# `_next_cursor` and `_es_error`), so that Elasticsearch leaves out the rest,
+# such as shard stats, scores and types
+_FILTER_PATH = [
+    'took',
+    'hits.total.value',
+    'hits.hits._index',
+    'hits.hits._id',
+    'hits.hits._source',
+    'hits.hits.highlight',
+    'hits.hits.sort',
+    'aggregations',
+    'pit_id',
+    'error',
+]
+_SEARCH_FILTER_PATH = ','.join(_FILTER_PATH)
+_MSEARCH_FILTER_PATH = ','.join('responses.' + path for path in _FILTER_PATH)
+_MSEARCH_PATH = '/_msearch?filter_path=' + _MSEARCH_FILTER_PATH
+
+# Stands in for the access filter when serializing a query, and is then
+# replaced by the filter clause that is cached on the WorkspaceIdSet. The
+# random part keeps it from matching anything in a user-supplied query.
+_ACCESS_FILTER_PLACEHOLDER = 'access_filter_' + secrets.token_hex(16)
+
+# Identical searches that are in flight at the same time share one request to
+# Elasticsearch. They are keyed on the path and serialized body, which includes
+# the access filter, so only searches over the same workspaces are shared.
+# Public searches are also cached (see `result_cache`).
+_in_flight = SingleFlight()
+metrics.register('search_coalescing', _in_flight.stats)
 
 
 def search(params, meta):
@@ -21,21 +77,388 @@ def search(params, meta):
     ES 7 search query documentation:
     https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
     """
+    if _count_only(params):
+        return _count_result(count(params, meta))
+    cursor = _parse_cursor(params)
+    (parts, access_filter) = _access(params, meta)
 
-    # The query object, which we build up in steps below
-    query = {'bool': {}}  # type: dict
+    if cursor is not None and cursor['pit'] is None:
+        cursor['pit'] = _open_pit(params)
+    (path, body) = _build_search(params, access_filter, cursor)
+
+    key = _search_key(path, body, parts)
+    cache_key = result_cache.cache_key(key) if result_cache.cacheable(params, meta) else None
+    resp_text = result_cache.get(cache_key)
+    if resp_text is MISSING:
+        resp_text = _post_once(path, body, key, lambda text: result_cache.put(cache_key, text))
+
+    # Each caller parses the response, so that none shares mutable results
+    resp_json = json.loads(resp_text)
+    result = _handle_response(resp_json)
+    if cursor is not None:
+        result['cursor'] = _next_cursor(params, cursor, resp_json)
+        if result['cursor'] is None:
+            _close_pit(resp_json.get('pit_id', cursor['pit']))
+    return result
+
+
+async def search_async(params, meta):
+    """
+    Non-blocking version of `search`, using the pooled async HTTP client.
+    """
+    if _count_only(params):
+        return _count_result(await count_async(params, meta))
+    cursor = _parse_cursor(params)
+    (parts, access_filter) = await _access_async(params, meta)
+
+    if cursor is not None and cursor['pit'] is None:
+        cursor['pit'] = await _open_pit_async(params)
+    (path, body) = _build_search(params, access_filter, cursor)
+
+    key = _search_key(path, body, parts)
+    cache_key = result_cache.cache_key(key) if result_cache.cacheable(params, meta) else None
+    resp_text = await run_io(result_cache.get, cache_key)
+    if resp_text is MISSING:
+        resp_text = await _post_once_async(path, body, key, lambda text: result_cache.put(cache_key, text))
 
+    resp_json = json.loads(resp_text)
+    result = _handle_response(resp_json)
+    if cursor is not None:
+        result['cursor'] = _next_cursor(params, cursor, resp_json)
+        if result['cursor'] is None:
+            await _close_pit_async(resp_json.get('pit_id', cursor['pit']))
+    return result
+
+
+async def close_cursor_async(cursor: str):
+    """
+    Close the point in time of a `cursor` from a search result, for paging
+    that stops before the last page (which closes it itself).
+    """
+    state = _parse_cursor({'cursor': cursor})
+    if state['pit'] is not None:
+        await _close_pit_async(state['pit'])
+
+
+def count(params, meta) -> dict:
+    """
+    Count the documents that match a search with the Elasticsearch `_count`
+    API, which skips everything but the query: only the `query`, `indexes`
+    and access params are used. Returns {'count': ..., 'search_time': ...}.
+    Recent counts are cached for callers who see the same workspaces (see
+    `result_cache`).
+    """
+    (parts, access_filter) = _access(params, meta)
+    (path, body) = _build_count(params, access_filter)
+    key = _search_key(path, body, parts)
+    cached = result_cache.get_count(key)
+    if cached is not MISSING:
+        return {'count': cached, 'search_time': 0}
+    start = time.monotonic()
+    resp_text = _post_once(path, body, key)
+    return _handle_count_response(key, resp_text, start)
+
+
+async def count_async(params, meta) -> dict:
+    """Non-blocking version of `count`."""
+    (parts, access_filter) = await _access_async(params, meta)
+    (path, body) = _build_count(params, access_filter)
+    key = _search_key(path, body, parts)
+    cached = await run_io(result_cache.get_count, key)
+    if cached is not MISSING:
+        return {'count': cached, 'search_time': 0}
+    start = time.monotonic()
+    resp_text = await _post_once_async(path, body, key)
+    return await run_io(_handle_count_response, key, resp_text, start)
+
+
+def msearch(params_list: list, meta) -> list:
+    """
+    Make several searches in a single Elasticsearch `_msearch` request, each
+    with the params of `search`. The workspaces that the user can read are
+    looked up once for all of them. Returns a list with the result of each
+    search, as from `search`, or the ResponseError that it failed with.
+    """
+    (need_public, need_private) = _msearch_access(params_list)
+    parts = []
+    if need_public or need_private:
+        parts = _request_ws_auth_parts(meta, not need_private, not need_public)
+    access_filters = []  # type: list
+    for params in params_list:
+        if _both_access_flags(params):
+            access_filters.append(None)
+            continue
+        selected = select_ws_auth_parts(parts, params.get('only_public', False), params.get('only_private', False))
+        if _use_lookup(params):
+            access_filters.append(acl.lookup_filter(selected))
+        else:
+            access_filters.append(_inline_filter(params, merge_ws_auth_parts(selected)))
+    (body, results) = _build_msearch(params_list, access_filters)
+    if body:
+        resp = retry.send(lambda base: get_session().post(base + _MSEARCH_PATH, data=body, headers=_MSEARCH_HEADERS))
+        if not resp.ok:
+            _handle_es_err(resp)
+        _handle_msearch_response(resp.json(), results)
+    return results
+
+
+async def msearch_async(params_list: list, meta) -> list:
+    """Non-blocking version of `msearch`."""
+    (need_public, need_private) = _msearch_access(params_list)
+    parts = []
+    if need_public or need_private:
+        parts = await _request_ws_auth_parts_async(meta, not need_private, not need_public)
+    access_filters = []  # type: list
+    for params in params_list:
+        if _both_access_flags(params):
+            access_filters.append(None)
+            continue
+        selected = select_ws_auth_parts(parts, params.get('only_public', False), params.get('only_private', False))
+        if _use_lookup(params):
+            access_filters.append(await acl.lookup_filter_async(selected))
+        else:
+            access_filters.append(_inline_filter(params, merge_ws_auth_parts(selected)))
+    (body, results) = _build_msearch(params_list, access_filters)
+    if body:
+        client = get_async_client()
+        resp = await retry.send_async(
+            lambda base: client.post(base + _MSEARCH_PATH, content=body, headers=_MSEARCH_HEADERS))
+        if resp.is_error:
+            _handle_es_err(resp)
+        _handle_msearch_response(resp.json(), results)
+    return results
+
+
+def _request_ws_auth(meta, only_public, only_private):
+    """
+    `ws_auth` for the caller, looked up once per request for each pair of
+    flags, so that the entries of a batch request share it.
+    """
+    loader = get_loader(meta, 'ws_auth', lambda keys: [ws_auth(meta['auth'], *key) for key in keys])
+    return loader.load((only_public, only_private))
+
+
+def _request_ws_auth_parts(meta, only_public, only_private) -> list:
+    """`ws_auth_parts` for the caller, looked up once per request for each pair of flags."""
+    loader = get_loader(meta, 'ws_auth_parts', lambda keys: [ws_auth_parts(meta['auth'], *key) for key in keys])
+    return loader.load((only_public, only_private))
+
+
+async def _request_ws_auth_async(meta, only_public, only_private):
+    def fetch():
+        return ws_auth_async(meta['auth'], only_public, only_private)
+    return await load_once_async(meta, 'ws_auth', (only_public, only_private), fetch)
+
+
+async def _request_ws_auth_parts_async(meta, only_public, only_private) -> list:
+    def fetch():
+        return ws_auth_parts_async(meta['auth'], only_public, only_private)
+    return await load_once_async(meta, 'ws_auth_parts', (only_public, only_private), fetch)
+
+
+def _access(params, meta) -> tuple:
+    """
+    The access filter for a search, as a pair of the stored workspace ID sets
+    that it references (see `_search_key`) and the serialized filter clause.
+    """
     # Fetch the workspace IDs that the user can read.
     # Used for access control and also to ensure that workspaces which are
     # inaccessible, but have not yet been updated in search, are still filtered out.
-    authorized_ws_ids = ws_auth(
-        meta['auth'],
-        params.get('only_public', False),
-        params.get('only_private', False))
+    only_public = params.get('only_public', False)
+    only_private = params.get('only_private', False)
+    if _use_lookup(params):
+        parts = _request_ws_auth_parts(meta, only_public, only_private)
+        return (parts, acl.lookup_filter(parts))
+    authorized_ws_ids = _request_ws_auth(meta, only_public, only_private)
+    return ([], _inline_filter(params, authorized_ws_ids))
+
+
+async def _access_async(params, meta) -> tuple:
+    only_public = params.get('only_public', False)
+    only_private = params.get('only_private', False)
+    if _use_lookup(params):
+        parts = await _request_ws_auth_parts_async(meta, only_public, only_private)
+        return (parts, await acl.lookup_filter_async(parts))
+    authorized_ws_ids = await _request_ws_auth_async(meta, only_public, only_private)
+    return ([], _inline_filter(params, authorized_ws_ids))
+
+
+def _post_once(path: str, body: str, key: str, store=None) -> str:
+    """
+    POST a request body to `path` on an Elasticsearch node, retrying
+    transient errors (see `retry`), and return the response text. An
+    identical request that is already in flight is waited on instead of
+    being sent again. The caller that sends the request passes the response
+    text to `store`, if given, before handing it to the waiting callers.
+    """
+    (owned, waiting) = _in_flight.claim([key])
+    if waiting:
+        return waiting[key].result(timeout=config['http_timeout'])
+    try:
+        resp = retry.send(lambda base: get_session().post(base + path, data=body, headers=_HEADERS))
+        if not resp.ok:
+            _handle_es_err(resp)
+    except BaseException as err:
+        _in_flight.fail(owned, err)
+        raise
+    _share(key, resp.text, store)
+    return resp.text
 
-    query['bool']['filter'] = [
-        {'terms': {'access_group': authorized_ws_ids}}
-    ]
+
+async def _post_once_async(path: str, body: str, key: str, store=None) -> str:
+    """Non-blocking version of `_post_once`."""
+    (owned, waiting) = _in_flight.claim([key])
+    if waiting:
+        # Shielded, so that a waiter that gives up does not cancel the shared future
+        shared = asyncio.shield(asyncio.wrap_future(waiting[key]))
+        return await asyncio.wait_for(shared, timeout=config['http_timeout'])
+    # The request runs in its own task, so that cancelling this caller does
+    # not fail the callers waiting on it
+    task = asyncio.ensure_future(_post_shared_async(path, body, key, store))
+    return await asyncio.shield(task)
+
+
+async def _post_shared_async(path: str, body: str, key: str, store) -> str:
+    try:
+        client = get_async_client()
+        resp = await retry.send_async(lambda base: client.post(base + path, content=body, headers=_HEADERS))
+        if resp.is_error:
+            _handle_es_err(resp)
+    except BaseException as err:
+        _in_flight.fail([key], err)
+        raise
+    await run_io(_share, key, resp.text, store)
+    return resp.text
+
+
+def _share(key: str, resp_text: str, store):
+    """
+    Pass the response text to `store`, if given, and then to the callers
+    waiting for `key`. A failure to store is logged rather than passed on.
+    """
+    try:
+        if store is not None:
+            store(resp_text)
+    except Exception:
+        logger.exception("Could not store an Elasticsearch response")
+    finally:
+        _in_flight.resolve(key, resp_text)
+
+
+def _count_only(params) -> bool:
+    """Whether a search only needs a count, which `_count` can answer."""
+    return bool(params.get('count')) and not params.get('aggs') and params.get('cursor') is None
+
+
+def _count_result(counted: dict) -> dict:
+    """A `count` result in the form of a `search` result."""
+    return {
+        'count': counted['count'],
+        'hits': [],
+        'search_time': counted['search_time'],
+        'aggregations': {},
+    }
+
+
+def _build_count(params, access_filter: str) -> tuple:
+    """Construct the Elasticsearch path and serialized request body for a count."""
+    query = {'bool': {'filter': [_ACCESS_FILTER_PLACEHOLDER]}}  # type: dict
+    if params.get('query'):
+        query['bool']['must'] = params['query']
+    path = '/' + _construct_index_name(params) + '/_count?allow_no_indices=true'
+    body = json.dumps({'query': query}, sort_keys=True).replace(
+        json.dumps(_ACCESS_FILTER_PLACEHOLDER),
+        access_filter,
+        1)
+    return (path, body)
+
+
+def _handle_count_response(key: str, resp_text: str, start: float) -> dict:
+    counted = json.loads(resp_text)['count']
+    result_cache.put_count(key, counted)
+    # `_count` does not report its own time
+    return {'count': counted, 'search_time': int((time.monotonic() - start) * 1000)}
+
+
+def _msearch_access(params_list: list) -> tuple:
+    """Whether any of the searches can see public, and private, workspaces."""
+    params_list = [params for params in params_list if not _both_access_flags(params)]
+    need_public = any(not params.get('only_private') for params in params_list)
+    need_private = any(not params.get('only_public') for params in params_list)
+    return (need_public, need_private)
+
+
+def _both_access_flags(params) -> bool:
+    """Whether a search sets both flags, which `ws_auth` rejects."""
+    return bool(params.get('only_public')) and bool(params.get('only_private'))
+
+
+def _build_msearch(params_list: list, access_filters: list) -> tuple:
+    """
+    Construct the `_msearch` request body. Returns a pair of the body and a
+    list of results to fill in, which holds None for each search that was
+    included and an error for each one that was not. The access filter of a
+    search that sets both access flags is None.
+    """
+    lines = []
+    results = []  # type: list
+    for (params, access_filter) in zip(params_list, access_filters):
+        if access_filter is None:
+            results.append(ResponseError(message='Only one of "only_public" or "only_private" may be set'))
+            continue
+        if params.get('cursor') is not None:
+            results.append(InvalidCursor('Cursor paging is not available in multi-searches'))
+            continue
+        header = {'index': _construct_index_name(params), 'allow_no_indices': True}
+        (_, body) = _build_search(params, access_filter)
+        lines.append(json.dumps(header))
+        lines.append(body)
+        results.append(None)
+    # The body must end with a newline
+    body = ''.join(line + '\n' for line in lines)
+    return (body, results)
+
+
+def _handle_msearch_response(resp_json: dict, results: list):
+    """Fill in the results from `_build_msearch` from the `_msearch` responses, in order."""
+    responses = iter(resp_json['responses'])
+    for (idx, result) in enumerate(results):
+        if result is not None:
+            continue
+        item = next(responses)
+        if 'error' in item:
+            logger.error(f"Elasticsearch response error in a multi-search:\n{item}")
+            results[idx] = _es_error(item, json.dumps(item))
+        else:
+            results[idx] = _handle_response(item)
+
+
+def _use_lookup(params) -> bool:
+    """Whether to reference the stored workspace ID sets rather than list the IDs."""
+    # A query restricted to a few workspaces is cheaper to filter inline
+    return config['access_filter_mode'] == 'lookup' and params.get('filter_ws_ids') is None
+
+
+def _inline_filter(params, authorized_ws_ids) -> str:
+    """Serialized filter clause that lists the authorized workspace IDs."""
+    authorized_ws_ids = WorkspaceIdSet.of(authorized_ws_ids)
+    if params.get('filter_ws_ids') is not None:
+        # Only the workspaces that the query is restricted to need to be listed
+        authorized_ws_ids = authorized_ws_ids.intersection(params['filter_ws_ids'])
+    return authorized_ws_ids.terms_json('access_group')
+
+
+def _build_search(params, access_filter: str, cursor=None):
+    """
+    Construct the Elasticsearch path and serialized request body for a
+    search, given the serialized access filter clause and the parsed cursor,
+    if paging through a point in time. Returns a pair of (path, body).
+    The path is sent to any node (see `nodes`).
+    """
+    # The query object, which we build up in steps below
+    query = {'bool': {}}  # type: dict
+
+    query['bool']['filter'] = [_ACCESS_FILTER_PLACEHOLDER]
 
     # We insert the user's query as a "must" entry
     user_query = params.get('query')
@@ -46,7 +469,12 @@ def search(params, meta):
     index_name_str = _construct_index_name(params)
 
     # Make a query request to elasticsearch
-    url = config['elasticsearch_url'] + '/' + index_name_str + '/_search'
+    if cursor is None:
+        # Allows index exclusion; otherwise there is an error
+        path = '/' + index_name_str + '/_search?allow_no_indices=true&filter_path=' + _SEARCH_FILTER_PATH
+    else:
+        # The point in time determines the indexes
+        path = '/_search?filter_path=' + _SEARCH_FILTER_PATH
 
     # TODO: address the performance settings below:
     # - 3m for timeout is seems excessive, and many other elements of the
@@ -62,7 +490,8 @@ def search(params, meta):
         # 'search': {'allow_expensive_queries': False},
     }
 
-    if not params.get('count') and params.get('size', 10) > 0 and not params.get('track_total_hits'):
+    if (not params.get('count') and params.get('size', 10) > 0 and not params.get('track_total_hits')
+            and cursor is None):
         options['terminate_after'] = 10000
 
     # User-supplied aggregations
@@ -84,18 +513,117 @@ def search(params, meta):
     if params.get('track_total_hits'):
         options['track_total_hits'] = params.get('track_total_hits')
 
-    headers = {'Content-Type': 'application/json'}
+    if cursor is not None:
+        # Each page continues after the sort values of the previous page's
+        # last hit, so it costs the same at any depth
+        del options['from']
+        options['pit'] = {'id': cursor['pit'], 'keep_alive': config['search_cursor_keep_alive']}
+        options['sort'] = _cursor_sort(params.get('sort') or [{'_score': {'order': 'desc'}}])
+        if cursor['after'] is not None:
+            options['search_after'] = cursor['after']
+
+    # Keys are sorted, so that equivalent searches have the same body (see
+    # `_search_key`)
+    body = json.dumps(options, sort_keys=True).replace(
+        json.dumps(_ACCESS_FILTER_PLACEHOLDER),
+        access_filter,
+        1)
+    return (path, body)
+
+
+def _cursor_sort(sort: list) -> list:
+    """
+    `sort`, ending with the `_shard_doc` tiebreaker (Elasticsearch 7.12+),
+    which is unique within a point in time. Without it, `search_after` would
+    skip the hits whose sort values equal those of the last hit on a page,
+    such as every other hit of a filter-only query, whose scores are equal.
+    """
+    fields = [each if isinstance(each, str) else next(iter(each), None) for each in sort]
+    if '_shard_doc' in fields:
+        return sort
+    return list(sort) + [{'_shard_doc': 'asc'}]
+
+
+def _parse_cursor(params):
+    """
+    The state encoded in the `cursor` param, as {'pit': ..., 'after': ...}
+    (with no point in time yet for the first page), or None if not paging
+    with a cursor.
+    """
+    cursor = params.get('cursor')
+    if cursor is None:
+        return None
+    if cursor == _FIRST_PAGE:
+        return {'pit': None, 'after': None}
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return {'pit': str(state['pit']), 'after': list(state['after'])}
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def _next_cursor(params, cursor: dict, resp_json: dict):
+    """The cursor for the page after this one, or None if this is the last page."""
+    # Filtered responses have no "hits" array when there are none
+    hits = resp_json['hits'].get('hits', [])
+    if not hits or len(hits) < params.get('size', 10):
+        return None
+    # Elasticsearch may return a new ID for the point in time
+    state = {'pit': resp_json.get('pit_id', cursor['pit']), 'after': hits[-1]['sort']}
+    return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
 
-    # Allows index exclusion; otherwise there is an error
-    params = {'allow_no_indices': 'true'}
 
-    resp = requests.post(url, data=json.dumps(options), params=params, headers=headers)
+def _pit_path(params) -> str:
+    return '/' + _construct_index_name(params) + '/_pit'
 
+
+def _open_pit(params) -> str:
+    path = _pit_path(params)
+    keep_alive = {'keep_alive': config['search_cursor_keep_alive']}
+    resp = retry.send(lambda base: get_session().post(base + path, params=keep_alive))
     if not resp.ok:
         _handle_es_err(resp)
+    return resp.json()['id']
+
+
+async def _open_pit_async(params) -> str:
+    path = _pit_path(params)
+    keep_alive = {'keep_alive': config['search_cursor_keep_alive']}
+    client = get_async_client()
+    resp = await retry.send_async(lambda base: client.post(base + path, params=keep_alive))
+    if resp.is_error:
+        _handle_es_err(resp)
+    return resp.json()['id']
+
+
+def _close_pit(pit_id: str):
+    """Release a point in time after its last page; it would otherwise expire with the keep-alive."""
+    with nodes.node() as base:
+        resp = get_session().delete(base + '/_pit', data=json.dumps({'id': pit_id}), headers=_HEADERS)
+    if not resp.ok:
+        logger.warning(f"Could not close a point in time: {resp.text}")
+
 
-    resp_json = resp.json()
-    return _handle_response(resp_json)
+async def _close_pit_async(pit_id: str):
+    # httpx's delete() takes no body
+    with nodes.node() as base:
+        resp = await get_async_client().request('DELETE', base + '/_pit',
+                                                content=json.dumps({'id': pit_id}), headers=_HEADERS)
+    if resp.is_error:
+        logger.warning(f"Could not close a point in time: {resp.text}")
+
+
+def _search_key(path: str, body: str, parts: list) -> str:
+    """
+    Key of a search for coalescing and caching, from its path and serialized
+    body. A body with a lookup filter only names the stored workspace ID sets,
+    so the key also covers the contents of those sets (`parts`).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((path + '\n' + body).encode('utf-8'))
+    for (name, ws_ids) in parts:
+        digest.update(('\n' + name + ':' + ws_ids.encode()).encode('ascii'))
+    return digest.hexdigest()
 
 
 def _handle_es_err(resp):
@@ -105,13 +633,20 @@ def _handle_es_err(resp):
         resp_json = resp.json()
     except Exception:
         raise ElasticsearchError(resp.text)
+    raise _es_error(resp_json, resp.text)
+
+
+def _es_error(resp_json: dict, resp_text: str) -> ResponseError:
+    """The error to raise for an Elasticsearch error response."""
     err_type = get_path(resp_json, ['error', 'root_cause', 0, 'type'])
     err_reason = get_path(resp_json, ['error', 'reason'])
     if err_type is None:
-        raise ElasticsearchError(resp.text)
+        return ElasticsearchError(resp_text)
     if err_type == 'index_not_found_exception':
-        raise UnknownIndex(err_reason)
-    raise ElasticsearchError(err_reason)
+        return UnknownIndex(err_reason)
+    if err_type == 'search_context_missing_exception':
+        return InvalidCursor('The cursor has expired')
+    return ElasticsearchError(err_reason)
 
 
 def _handle_response(resp_json):
@@ -121,13 +656,14 @@ def _handle_response(resp_json):
     """
     prefix = config['index_prefix']
     hits = []
-    for hit in resp_json['hits']['hits']:
+    # Filtered responses (see `_FILTER_PATH`) leave out empty arrays and objects
+    for hit in resp_json['hits'].get('hits', []):
         # Display the index name without prefix
         index_name = re.sub(f"^{prefix}.", "", hit['_index'])
         doc = {
             'index': index_name,
             'id': hit['_id'],
-            'doc': hit['_source'],
+            'doc': hit.get('_source', {}),
         }
         if hit.get('highlight'):
             doc['highlight'] = hit['highlight']
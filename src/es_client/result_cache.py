@@ -0,0 +1,138 @@
+"""
+Cache of the Elasticsearch responses to public searches.
+
+Searches that can only see public workspaces (anonymous or `only_public`)
+send the same request for every user, so their responses are cached, keyed on
+the search path and serialized body (see `query._search_key`). Keys also
+include a digest of the document counts of the search indexes, which is
+re-checked every SEARCH_CACHE_CHECK_INTERVAL seconds while public searches are
+being made, and whenever `show_indexes` is called: once the counts change,
+older entries are no longer used and age out of the cache. Changes that keep
+the counts the same (such as updates to existing documents) are picked up
+when entries expire after SEARCH_CACHE_TTL seconds.
+
+Counts from `query.count` are cached for COUNT_CACHE_TTL seconds for every
+caller, not only public ones: their keys include the access filter, so only
+callers who can see the same workspaces share a count. They are not checked
+against the document counts, so a count may be that many seconds old.
+"""
+import hashlib
+import threading
+import time
+
+from src.utils import metrics
+from src.utils.cache import MISSING
+from src.utils.cache_backends import make_cache
+from src.utils.config import config
+from src.utils.http_client import get_session
+from src.utils.refresher import BackgroundRefresher
+from src.es_client import nodes
+from src.exceptions import ElasticsearchError
+
+_results = make_cache(
+    'search_results',
+    max_entries=config['search_cache_size'],
+    ttl=config['search_cache_ttl'],
+    max_bytes=config['search_cache_max_bytes'],
+)
+metrics.register('search_results', _results.stats)
+
+_counts_cache = make_cache(
+    'search_counts',
+    max_entries=config['count_cache_size'],
+    ttl=config['count_cache_ttl'],
+)
+metrics.register('search_counts', _counts_cache.stats)
+
+# Digest of the document counts last seen, and when they were checked
+# (monotonic seconds). No results are cached until the counts are known.
+_counts = {'digest': None, 'checked_at': None}  # type: dict
+_counts_lock = threading.Lock()
+
+_COUNTS_KEY = 'index_counts'
+
+
+def _counts_due(key) -> bool:
+    checked_at = _counts['checked_at']
+    return checked_at is None or time.monotonic() - checked_at >= config['search_cache_check_interval']
+
+
+# Re-checks the document counts while public searches are being made
+_counts_refresher = BackgroundRefresher(
+    'index_counts',
+    needs_refresh=_counts_due,
+    interval=config['search_cache_check_interval'],
+    active_window=config['search_cache_ttl'],
+    max_workers=1,
+)
+metrics.register('index_counts', _counts_refresher.stats)
+
+
+def cacheable(params: dict, meta: dict) -> bool:
+    """Whether a search only sees public workspaces, so that its results can be shared."""
+    if config['search_cache_ttl'] <= 0 or params.get('cursor') is not None:
+        return False
+    return meta.get('auth') is None or bool(params.get('only_public'))
+
+
+def cache_key(search_key: str):
+    """
+    Cache key for the search with the given coalescing key, or None if the
+    document counts are not known yet.
+    """
+    _counts_refresher.track(_COUNTS_KEY, _refresh_counts)
+    digest = _counts['digest']
+    if digest is None:
+        _counts_refresher.refresh(_COUNTS_KEY)
+        return None
+    return (digest, search_key)
+
+
+def get(key):
+    """The cached response text for a key from `cache_key`, or MISSING."""
+    if key is None:
+        return MISSING
+    return _results.get(key)
+
+
+def put(key, resp_text: str):
+    if key is not None:
+        _results.set(key, resp_text)
+
+
+def get_count(search_key: str):
+    """The cached count for the count request with the given coalescing key, or MISSING."""
+    if config['count_cache_ttl'] <= 0:
+        return MISSING
+    return _counts_cache.get(search_key)
+
+
+def put_count(search_key: str, count: int):
+    if config['count_cache_ttl'] > 0:
+        _counts_cache.set(search_key, count)
+
+
+def observe_counts(indexes: list):
+    """
+    Record the document counts from a `_cat/indices` response (a list of
+    objects with "index" and "docs.count").
+    """
+    counts = sorted(
+        (each['index'], each['docs.count'])
+        for each in indexes
+        # Documents in the ACL index are not searched
+        if each['index'] != config['acl_index']
+    )
+    digest = hashlib.blake2b(repr(counts).encode('utf-8'), digest_size=16).hexdigest()
+    with _counts_lock:
+        _counts['digest'] = digest
+        _counts['checked_at'] = time.monotonic()
+
+
+def _refresh_counts():
+    path = '/_cat/indices/' + config['index_prefix'] + '*'
+    with nodes.node() as base:
+        resp = get_session().get(base + path, params={'format': 'json', 'h': 'index,docs.count'})
+    if not resp.ok:
+        raise ElasticsearchError(resp.text)
+    observe_counts(resp.json())
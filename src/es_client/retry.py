@@ -0,0 +1,114 @@
+"""
+Retries of searches that Elasticsearch turns away for a moment.
+
+A 429 (such as `es_rejected_execution_exception` when a search queue is full)
+or a 503 (such as while shards relocate) says nothing about the search itself,
+so searches, which are safe to repeat, are sent again after a delay rather than
+failing. Each attempt takes a node afresh (see `nodes.node`), so a retry may go
+to another node.
+
+The delay grows exponentially from ES_RETRY_BASE_DELAY seconds up to
+ES_RETRY_MAX_DELAY, with full jitter so that workers turned away together do
+not come back together; a `Retry-After` header from the node takes precedence.
+A request makes at most ES_RETRY_ATTEMPTS retries, and none that would end
+more than ES_RETRY_BUDGET seconds after the request started; the last response
+is then handled as usual.
+"""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from src.utils import metrics
+from src.utils.config import config
+from src.utils.logger import logger
+from src.es_client import nodes
+
+_RETRY_STATUSES = (429, 503)
+
+_stats = {'retries': 0, 'recovered': 0, 'exhausted': 0, 'by_status': {}}  # type: dict
+_stats_lock = threading.Lock()
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, by_status=dict(_stats['by_status']))
+
+
+metrics.register('es_retries', stats)
+
+
+def send(request):
+    """
+    Make `request(base)`, which sends a search to the node at the base URL and
+    returns its response, retrying while the response is transient.
+    """
+    deadline = time.monotonic() + config['es_retry_budget']
+    attempt = 0
+    while True:
+        with nodes.node() as base:
+            resp = request(base)
+        delay = _retry_delay(resp, attempt, deadline)
+        if delay is None:
+            return resp
+        time.sleep(delay)
+        attempt += 1
+
+
+async def send_async(request):
+    """Non-blocking version of `send`, where `request(base)` is awaited."""
+    deadline = time.monotonic() + config['es_retry_budget']
+    attempt = 0
+    while True:
+        with nodes.node() as base:
+            resp = await request(base)
+        delay = _retry_delay(resp, attempt, deadline)
+        if delay is None:
+            return resp
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def _retry_delay(resp, attempt: int, deadline: float) -> Optional[float]:
+    """
+    Seconds to wait before retrying after `resp`, the response to the given
+    attempt (counting from 0), or None to use the response as it is.
+    """
+    if resp.status_code not in _RETRY_STATUSES:
+        if attempt:
+            _count('recovered')
+        return None
+    retry_after = _retry_after(resp.headers.get('Retry-After'))
+    if retry_after is not None:
+        delay = retry_after
+    else:
+        delay = random.uniform(0, min(config['es_retry_max_delay'], config['es_retry_base_delay'] * 2 ** attempt))
+    if attempt >= config['es_retry_attempts'] or time.monotonic() + delay > deadline:
+        _count('exhausted')
+        return None
+    logger.warning(f"Elasticsearch responded with {resp.status_code}; retrying in {delay:.2f}s")
+    with _stats_lock:
+        _stats['retries'] += 1
+        _stats['by_status'][resp.status_code] = _stats['by_status'].get(resp.status_code, 0) + 1
+    return delay
+
+
+def _retry_after(value) -> Optional[float]:
+    """Seconds from a `Retry-After` header, which is either a number of seconds or a date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
@@ -21,6 +21,10 @@ class AuthError(ResponseError):
         super().__init__(code=-32001, message=msg)
 
 
+class InvalidToken(AuthError):
+    """An AuthError for a token that the workspace rejected, rather than a failure of the workspace."""
+
+
 class UnknownIndex(ResponseError):
 
     def __init__(self, message):
@@ -68,3 +72,23 @@ class NoUserProfileError(ResponseError):
     def __init__(self, username):
         message = f'A user profile could not be found for "{username}"'
         super().__init__(code=-32007, message=message)
+
+
+class ServerBusy(ResponseError):
+    """
+    Raised when the worker's RPC queue is full.
+    """
+
+    def __init__(self):
+        message = 'The server is too busy to handle this request; please retry later'
+        super().__init__(code=-32008, message=message)
+
+
+class InvalidCursor(ResponseError):
+    """
+    Raised when a paging cursor cannot be parsed, or its point in time has
+    expired.
+    """
+
+    def __init__(self, message):
+        super().__init__(code=-32009, message=message)
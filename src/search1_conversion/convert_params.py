@@ -9,6 +9,8 @@ PostProcessing type:
     skip_data - disclude "raw data" for the object ('data' and 'parent_data')
     ids_only - shortcut to mark all three skips as true
     include_highlight - include highlights of fields that matched the query
+    add_type_counts - also count the matching objects of each type, as
+        "search_types" does, in the same Elasticsearch request
 
 ObjectData type:
     guid - string - unique id for the doc ('_id' field in our case)
@@ -34,6 +36,7 @@ ObjectData type:
           "...".
 """
 
+from src.search1_conversion.convert_result import source_includes
 from src.utils.obj_utils import get_any
 from jsonrpc11base.errors import InvalidParamsError
 
@@ -54,6 +57,7 @@ def search_objects(params):
     """
     query = _get_search_params(params)
     post_proc = params.get('post_processing', {})
+    _add_source_filter(query, post_proc)
     if post_proc.get('include_highlight') == 1:
         # We need a special highlight query so that the main query does not generate
         # highlights for bits of the query which are not user-generated.
@@ -77,6 +81,10 @@ def search_objects(params):
             'require_field_match': False,
             'highlight_query': highlight_query
         }
+    if post_proc.get('add_type_counts') == 1:
+        # Saves the separate "search_types" call a search page makes with the
+        # same match filter
+        query['aggs'] = _type_count_aggs()
     return query
 
 
@@ -98,12 +106,7 @@ def search_types(params):
     aggregates results based on `obj_type_name`.
     """
     query = _get_search_params(params)
-    # Create the aggregation clause using a 'terms aggregation'
-    query['aggs'] = {
-        'type_count': {
-            'terms': {'field': 'obj_type_name'}
-        }
-    }
+    query['aggs'] = _type_count_aggs()
     query['size'] = 0
     return query
 
@@ -118,7 +121,25 @@ def get_objects(params):
     output:
         query - elasticsearch query for document ids specified in the params argument
     """
-    return {'query': {'terms': {'_id': params['ids']}}}
+    query = {'query': {'terms': {'_id': params['ids']}}}
+    _add_source_filter(query, params.get('post_processing', {}))
+    return query
+
+
+def _add_source_filter(query, post_proc):
+    """Only fetch the document fields that the post processing options keep."""
+    includes = source_includes(post_proc)
+    if includes is not None:
+        query['source'] = includes
+
+
+def _type_count_aggs():
+    """The aggregation clause for counts by type, using a 'terms aggregation'."""
+    return {
+        'type_count': {
+            'terms': {'field': 'obj_type_name'}
+        }
+    }
 
 
 def _get_search_params(params):
@@ -1,4 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from src.utils.config import config
+from src.utils.dataloader import get_loader
 from src.utils.formatting import iso8601_to_epoch_ms
 from src.utils.user_profiles import get_user_profiles
 from src.utils.workspace import get_workspace_info
@@ -48,6 +51,11 @@ _GLOBAL_DOC_KEY_TRANSFORMS = [
     'creation_date'
 ]
 
+# Fetches workspace infos, and the profiles of their owners, concurrently;
+# bounds the number of these calls in flight from this worker, across all
+# requests.
+_ws_info_pool = ThreadPoolExecutor(max_workers=config['ws_info_concurrency'], thread_name_prefix='ws_info')
+
 
 def search_objects(params: dict, results: dict, ctx: dict):
     """
@@ -65,6 +73,8 @@ def search_objects(params: dict, results: dict, ctx: dict):
     }
     _add_access_group_info(ret, results, ctx, post_processing)
     _add_objects_and_info(ret, results, ctx, post_processing)
+    if post_processing.get('add_type_counts') == 1:
+        ret['type_to_count'] = _get_type_to_count(results)
 
     return ret
 
@@ -76,15 +86,8 @@ def search_types(results: dict):
     """
     # Convert the ES result format into the API format
     search_time = results['search_time']
-    type_counts = results['aggregations']['type_count']['counts']
-    type_to_count = {}  # type: dict
-
-    for type_count in type_counts:
-        key = type_count['key']
-        count = type_count['count']
-        type_to_count[key] = count
     return {
-        'type_to_count': type_to_count,
+        'type_to_count': _get_type_to_count(results),
         'search_time': int(search_time)
     }
 
@@ -103,6 +106,30 @@ def get_objects(params, results, ctx):
     return ret
 
 
+def _get_type_to_count(results: dict) -> dict:
+    """Map each type name to its count, from the "type_count" aggregation."""
+    type_counts = results['aggregations']['type_count']['counts']
+    type_to_count = {}  # type: dict
+
+    for type_count in type_counts:
+        key = type_count['key']
+        count = type_count['count']
+        type_to_count[key] = count
+    return type_to_count
+
+
+def source_includes(post_processing: dict):
+    """
+    The document fields that are converted into ObjectData with the given
+    post processing options, for `_source` filtering, or None if whole
+    documents are needed.
+    """
+    if post_processing.get('ids_only') != 1 and post_processing.get('skip_data') != 1:
+        # The type-specific fields all go into "data"
+        return None
+    return list(_GLOBAL_DOC_KEY_MAPPING) + _GLOBAL_DOC_KEY_COPYING + _GLOBAL_DOC_KEY_TRANSFORMS
+
+
 def _get_post_processing(params: dict) -> dict:
     """
     Extract and set defaults for the post processing options
@@ -184,15 +211,19 @@ def _fetch_narrative_info(es_result, ctx):
     if len(workspace_ids) == 0:
         return {}, {}
 
-    for workspace_id in workspace_ids:
-        workspace_info = get_workspace_info(workspace_id, ctx['auth'])
+    # One batch of workspace infos for the whole request, fetched
+    # concurrently, so the time taken does not grow with the number of
+    # workspaces on the page (up to the pool size). Each owner's profile
+    # lookup starts as soon as their workspace info arrives.
+    workspace_infos = _ws_info_loader(ctx).load_many(workspace_ids)
+    for (workspace_id, workspace_info) in zip(workspace_ids, workspace_infos):
         if len(workspace_info) > 2:
             owners.add(workspace_info[2])
             ws_infos[str(workspace_id)] = workspace_info
 
     # Get profile for all owners in the search results
     owner_list = list(owners)
-    user_profiles = get_user_profiles(owner_list, ctx['auth'])
+    user_profiles = _user_profile_loader(ctx).load_many(owner_list)
     user_profile_map = {}
     for index, profile in enumerate(user_profiles):
         if profile is None:
@@ -217,6 +248,37 @@ def _fetch_narrative_info(es_result, ctx):
     return ws_infos, narr_infos
 
 
+def _ws_info_loader(ctx: dict):
+    def fetch(workspace_ids):
+        futures = [_ws_info_pool.submit(get_workspace_info, workspace_id, ctx['auth'])
+                   for workspace_id in workspace_ids]
+        for future in futures:
+            future.add_done_callback(lambda future: _prefetch_owner_profile(ctx, future))
+        return [future.result() for future in futures]
+    return get_loader(ctx, 'ws_info', fetch)
+
+
+def _prefetch_owner_profile(ctx: dict, ws_info_future):
+    """
+    Start looking up the profile of a workspace's owner. The owner is queued
+    on the request's loader, and the lookup takes every owner queued by the
+    time it runs, so owners found close together share a batch. The lookup
+    is shared with `_fetch_narrative_info`; if it fails, the owner is looked
+    up again there.
+    """
+    if ws_info_future.cancelled() or ws_info_future.exception() is not None:
+        return
+    workspace_info = ws_info_future.result()
+    if len(workspace_info) > 2:
+        loader = _user_profile_loader(ctx)
+        loader.prime([workspace_info[2]])
+        _ws_info_pool.submit(loader.load_many, [])
+
+
+def _user_profile_loader(ctx: dict):
+    return get_loader(ctx, 'user_profiles', lambda usernames: get_user_profiles(usernames, ctx['auth']))
+
+
 def _get_object_data_from_search_results(search_results, post_processing):
     """
     Construct a list of ObjectData (see the type def in the module docstring at top).
@@ -50,9 +50,15 @@ def search_workspace(params, meta):
     if "filters" in params:
         converted_query = _convert_filters(params['filters'])
         converted["query"]["bool"]["must"].append(converted_query)
+        # Lets es_client narrow the access filter to these workspaces
+        filter_ws_ids = _filter_ws_ids(params['filters'])
+        if filter_ws_ids is not None:
+            converted["filter_ws_ids"] = sorted(filter_ws_ids)
     paging = params.get('paging', {})
     converted['from'] = paging.get('offset', 0)
     converted['size'] = paging.get('length', 10)
+    if 'cursor' in paging:
+        converted['cursor'] = paging['cursor']
     return converted
 
 
@@ -101,3 +107,22 @@ def _convert_filters(filters):
         if "min" in filters["range"]:
             ret["range"][field]["gte"] = filters["range"]["min"]
         return ret
+
+
+def _filter_ws_ids(filters):
+    """
+    Find the workspace IDs that the filters restrict results to, from term
+    filters on "access_group". Returns None if any workspace may match.
+    """
+    if 'operator' in filters:
+        sub_ids = [_filter_ws_ids(f) for f in filters['fields']]
+        if filters['operator'] == 'AND':
+            restricted = [ids for ids in sub_ids if ids is not None]
+            return set.intersection(*restricted) if restricted else None
+        if not sub_ids or any(ids is None for ids in sub_ids):
+            return None
+        return set.union(*sub_ids)
+    # Booleans are ints too, but are not workspace IDs
+    if filters['field'] == 'access_group' and type(filters.get('term')) is int:
+        return {filters['term']}
+    return None
@@ -6,8 +6,11 @@ def search_workspace(results, params, meta):
     conforming to the schema found in
     rpc-methods.yaml/definitions/methods/search_workspace/result
     """
-    return {
+    converted = {
         "search_time": results["search_time"],
         "count": results["count"],
         "hits": [hit["doc"] for hit in results["hits"]],
     }
+    if "cursor" in results:
+        converted["cursor"] = results["cursor"]
+    return converted
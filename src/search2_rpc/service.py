@@ -1,18 +1,18 @@
 """
 JSON-RPC 2.0 service for the Search2 API
 """
-import jsonrpcbase
 import re
-import requests
 import time
 
-from src.es_client import search
+from src.es_client import count, count_async, msearch, msearch_async, nodes, result_cache, search, search_async
+from src.utils.async_rpc import AsyncJSONRPCService
 from src.utils.config import config
+from src.utils.http_client import get_async_client, get_session
 from src.utils.logger import logger
 from src.search2_conversion import convert_params, convert_result
-from src.exceptions import ElasticsearchError
+from src.exceptions import ElasticsearchError, ResponseError
 
-service = jsonrpcbase.JSONRPCService(
+service = AsyncJSONRPCService(
     info={
         'title': 'Search API',
         'description': 'Search API layer in front of Elasticsearch for KBase',
@@ -20,19 +20,40 @@ service = jsonrpcbase.JSONRPCService(
     },
     schema='rpc-schema.yaml',
     development=config['dev'],
+    batch_concurrency=config['rpc_batch_concurrency'],
 )
 
 
 def show_indexes(params, meta):
     """List all index names for our prefix"""
-    prefix = config['index_prefix']
-    resp = requests.get(
-        config['elasticsearch_url'] + '/_cat/indices/' + prefix + '*?format=json',
-        headers={'Content-Type': 'application/json'},
-    )
+    with nodes.node() as base:
+        resp = get_session().get(base + _cat_indices_path(), headers={'Content-Type': 'application/json'})
     if not resp.ok:
         raise ElasticsearchError(resp.text)
     resp_json = resp.json()
+    # Lets cached public search results be dropped once the counts change
+    result_cache.observe_counts(resp_json)
+    return _convert_indexes(resp_json)
+
+
+async def show_indexes_async(params, meta):
+    """Non-blocking version of `show_indexes`."""
+    with nodes.node() as base:
+        resp = await get_async_client().get(base + _cat_indices_path(), headers={'Content-Type': 'application/json'})
+    if resp.is_error:
+        raise ElasticsearchError(resp.text)
+    resp_json = resp.json()
+    # Lets cached public search results be dropped once the counts change
+    result_cache.observe_counts(resp_json)
+    return _convert_indexes(resp_json)
+
+
+def _cat_indices_path():
+    prefix = config['index_prefix']
+    return '/_cat/indices/' + prefix + '*?format=json'
+
+
+def _convert_indexes(resp_json):
     result = []
     # Drop the prefixes
     for each in resp_json:
@@ -67,6 +88,13 @@ def search_objects(params, meta):
     return result
 
 
+async def search_objects_async(params, meta):
+    start = time.time()
+    result = await search_async(params, meta)
+    logger.debug(f"Finished 'search_objects' method in {time.time() - start}s")
+    return result
+
+
 def search_workspace(params, meta):
     start = time.time()
     params = convert_params.search_workspace(params, meta)
@@ -76,7 +104,83 @@ def search_workspace(params, meta):
     return result
 
 
+async def search_workspace_async(params, meta):
+    start = time.time()
+    params = convert_params.search_workspace(params, meta)
+    result = await search_async(params, meta)
+    result = convert_result.search_workspace(result, params, meta)
+    logger.debug(f"Finished 'search_workspace' method in {time.time() - start}s")
+    return result
+
+
+def count_objects(params, meta):
+    start = time.time()
+    result = count(params, meta)
+    logger.debug(f"Finished 'count_objects' method in {time.time() - start}s")
+    return result
+
+
+async def count_objects_async(params, meta):
+    start = time.time()
+    result = await count_async(params, meta)
+    logger.debug(f"Finished 'count_objects' method in {time.time() - start}s")
+    return result
+
+
+def search_objects_multi(params, meta):
+    start = time.time()
+    results = msearch(params['searches'], meta)
+    logger.debug(f"Finished 'search_objects_multi' method in {time.time() - start}s")
+    return {'results': [_multi_result(result) for result in results]}
+
+
+async def search_objects_multi_async(params, meta):
+    start = time.time()
+    results = await msearch_async(params['searches'], meta)
+    logger.debug(f"Finished 'search_objects_multi' method in {time.time() - start}s")
+    return {'results': [_multi_result(result) for result in results]}
+
+
+def search_workspace_multi(params, meta):
+    start = time.time()
+    searches = [convert_params.search_workspace(each, meta) for each in params['searches']]
+    results = msearch(searches, meta)
+    logger.debug(f"Finished 'search_workspace_multi' method in {time.time() - start}s")
+    return {'results': _convert_workspace_results(results, searches, meta)}
+
+
+async def search_workspace_multi_async(params, meta):
+    start = time.time()
+    searches = [convert_params.search_workspace(each, meta) for each in params['searches']]
+    results = await msearch_async(searches, meta)
+    logger.debug(f"Finished 'search_workspace_multi' method in {time.time() - start}s")
+    return {'results': _convert_workspace_results(results, searches, meta)}
+
+
+def _convert_workspace_results(results, searches, meta):
+    return [
+        _multi_result(result, lambda res: convert_result.search_workspace(res, search_params, meta))
+        for (result, search_params) in zip(results, searches)
+    ]
+
+
+def _multi_result(result, convert=None):
+    """A search result from a multi-search, or the error that the search failed with."""
+    if isinstance(result, ResponseError):
+        return {'error': {'code': result.jsonrpc_code, 'message': result.message}}
+    return convert(result) if convert else result
+
+
 service.add(show_indexes)
-service.add(show_config)
+service.add_inline(show_config)
 service.add(search_objects)
 service.add(search_workspace)
+service.add(count_objects)
+service.add(search_objects_multi)
+service.add(search_workspace_multi)
+service.add_async(show_indexes_async, name='show_indexes')
+service.add_async(search_objects_async, name='search_objects')
+service.add_async(search_workspace_async, name='search_workspace')
+service.add_async(count_objects_async, name='count_objects')
+service.add_async(search_objects_multi_async, name='search_objects_multi')
+service.add_async(search_workspace_multi_async, name='search_workspace_multi')
@@ -4,9 +4,15 @@ import sanic
 import time
 import traceback
 
+from src.es_client import acl
+from src.exceptions import ResponseError, ServerBusy
 from src.search1_rpc import service as legacy_service
 from src.search2_rpc import service as rpc_service
+from src.server import export
+from src.utils import metrics
 from src.utils.config import config
+from src.utils.executor import rpc_executor
+from src.utils.http_client import close_async_client, prewarm, prewarm_async
 from src.utils.logger import logger
 from src.utils.obj_utils import get_path
 from src.utils.wait_for_service import wait_for_service
@@ -19,6 +25,7 @@ _ERR_STATUS = {
     -34001: 401,  # Unauthorized
     -32005: 404,  # Type not found
     -32002: 404,  # Index not found
+    -32008: 503,  # Server busy
 }
 
 
@@ -38,12 +45,21 @@ async def health_check(request):
     return sanic.response.raw(b'')
 
 
+@app.route('/metrics', methods=['GET', 'OPTIONS'])
+async def show_metrics(request):
+    """Runtime counters for this worker process."""
+    return sanic.response.json(metrics.snapshot())
+
+
 @app.route('/rpc', methods=['POST', 'GET', 'OPTIONS'])
 async def root(request):
     """Handle JSON RPC methods."""
     auth = request.headers.get('Authorization')
     body = _convert_rpc_formats(request.body)
-    result = rpc_service.call_py(body, {'auth': auth})
+    result = await rpc_service.call_py_async(body, {'auth': auth}, run_sync=rpc_executor.run)
+    if result is None:
+        # A batch of notifications
+        return sanic.response.raw(b'', status=204)
     status = _get_status_code(result)
     return sanic.response.json(result, status=status)
 
@@ -56,12 +72,38 @@ async def legacy(request):
     if request.method != 'POST':
         return sanic.response.raw(b'', status=405)
     auth = request.headers.get('Authorization')
-    result = legacy_service.call(request.body, {'auth': auth})
+    result = await rpc_executor.run(legacy_service.call, request.body, {'auth': auth})
     return sanic.response.raw(
         bytes(result, 'utf-8'),
         headers={'content-type': 'application/json'})
 
 
+@app.route('/export', methods=['POST', 'OPTIONS'])
+async def export_results(request):
+    """Stream every hit of a search as newline-delimited JSON (see src/server/export.py)."""
+    auth = request.headers.get('Authorization')
+    try:
+        lines = export.prepare(request.body, auth)
+    except ResponseError as err:
+        error = {'code': err.jsonrpc_code, 'message': err.message}
+        return sanic.response.json({'error': error}, status=400)
+
+    async def stream(response):
+        try:
+            async for line in lines:
+                await response.write(line)
+        except Exception as err:
+            # The status has already been sent, so the error ends the output
+            logger.exception(f"Export failed: {err}")
+            error = {'code': getattr(err, 'jsonrpc_code', -32000), 'message': getattr(err, 'message', str(err))}
+            await response.write(json.dumps({'error': error}).encode('utf-8') + b'\n')
+        finally:
+            # Ends the export when the client disconnects
+            await lines.aclose()
+
+    return sanic.response.stream(stream, content_type='application/x-ndjson')
+
+
 @app.middleware('response')
 async def cors_resp(req, res):
     """Handle cors response headers."""
@@ -70,11 +112,42 @@ async def cors_resp(req, res):
     res.headers['Access-Control-Allow-Headers'] = '*'
 
 
+@app.listener('before_server_start')
+async def prewarm_http_clients(app, loop):
+    """Open keep-alive connections to upstream services for this worker."""
+    await loop.run_in_executor(None, prewarm)
+    await prewarm_async()
+
+
+@app.listener('before_server_start')
+async def init_acl_index(app, loop):
+    """Create the index of stored workspace ID sets, if searches use it."""
+    if config['access_filter_mode'] == 'lookup':
+        await loop.run_in_executor(None, acl.ensure_index)
+
+
+@app.listener('after_server_stop')
+async def close_http_clients(app, loop):
+    """Close pooled upstream connections for this worker."""
+    await close_async_client()
+
+
 @app.exception(sanic.exceptions.NotFound)
 async def page_not_found(request, err):
     return sanic.response.raw(b'', status=404)
 
 
+@app.exception(ServerBusy)
+async def server_busy(request, err):
+    """Shed load when the worker's RPC queue is full."""
+    error = {'code': err.jsonrpc_code, 'message': err.message}
+    if request.path == '/legacy':
+        body = {'version': '1.1', 'error': error}
+    else:
+        body = {'jsonrpc': '2.0', 'id': None, 'error': error}
+    return sanic.response.json(body, status=503, headers={'Retry-After': '1'})
+
+
 @app.exception(Exception)
 async def any_exception(request, err):
     """
@@ -106,12 +179,23 @@ def _convert_rpc_formats(body: str):
     that notification style requests are always avoided.
     Of course, these conversion are violations of the JSON-RPC 2.0 spec. But we
     are prioritizing backwards compatibility here.
+
+    Batch requests are new, so their entries only get the "jsonrpc" field;
+    entries without an "id" are notifications, as the spec says.
     """
     try:
         data = json.loads(body)
     except Exception:
         # Let the JSONRPCService handle the error
         return body
+    if isinstance(data, list):
+        for entry in data:
+            if isinstance(entry, dict):
+                entry.pop('version', None)
+                entry.setdefault('jsonrpc', '2.0')
+        return data
+    if not isinstance(data, dict):
+        return data
     if 'version' in data:
         del data['version']
     if 'version' not in data and 'jsonrpc' not in data:
@@ -128,6 +212,9 @@ def _get_status_code(result: dict) -> int:
     usability and convenience, we return non-2xx status codes when there is an
     error.
     """
+    if isinstance(result, list):
+        # Each entry of a batch response carries its own error
+        return 200
     error_code = get_path(result, ['error', 'code'])
     if error_code is not None:
         return _ERR_STATUS.get(error_code, 400)
@@ -136,7 +223,7 @@ def _get_status_code(result: dict) -> int:
 
 # Wait for dependencies to start
 logger.info('Checking connection to elasticsearch')
-wait_for_service(config['elasticsearch_url'], 'Elasticsearch')
+wait_for_service(config['elasticsearch_urls'], 'Elasticsearch')
 # Start the server
 app.run(
     host='0.0.0.0',  # nosec
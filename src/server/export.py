@@ -0,0 +1,128 @@
+"""
+Streaming export of complete search results as newline-delimited JSON.
+
+`POST /export` takes a body of {"method": ..., "params": ...}, where the
+method is `search_objects` or `search_workspace` (with the params of the
+search2 RPC method), or the legacy `KBaseSearchEngine.search_objects` (with
+the legacy params, optionally wrapped in an array). Every matching hit is
+written as one line: the converted search2 hit, or the legacy ObjectData,
+along with its workspace and narrative info when `post_processing` asks for
+them.
+
+Results are walked a page of EXPORT_PAGE_SIZE hits at a time through a point
+in time (see the cursor paging in `es_client.query`), so each page costs the
+same and only one page is held in memory. Every page is filtered on the
+workspaces that the caller can read, exactly as in a regular search.
+"""
+import json
+import jsonschema
+from jsonrpcbase import utils as rpc_utils
+
+from src.es_client import close_cursor_async, search_async
+from src.search1_conversion import convert_params as legacy_params
+from src.search1_conversion import convert_result as legacy_result
+from src.search2_conversion import convert_params, convert_result
+from src.search2_rpc.service import service as rpc_service
+from src.utils.config import config
+from src.utils.executor import rpc_executor
+from src.exceptions import ResponseError
+
+_LEGACY_METHOD = 'KBaseSearchEngine.search_objects'
+
+_METHODS = ('search_objects', 'search_workspace', _LEGACY_METHOD)
+
+
+def prepare(body, auth):
+    """
+    Validate an export request and convert its params, before any output is
+    written. Returns an async iterator of NDJSON lines, as bytes.
+    Raises ResponseError for an invalid request.
+    """
+    try:
+        req = json.loads(body)
+    except ValueError:
+        raise ResponseError(code=-32700, message='Invalid JSON in the export request')
+    if not isinstance(req, dict) or req.get('method') not in _METHODS:
+        raise ResponseError(code=-32601, message=f'The export method must be one of {", ".join(_METHODS)}')
+    method = req['method']
+    params = req.get('params', {})
+    meta = {'auth': auth}
+    if method == _LEGACY_METHOD:
+        # KBase convention is to wrap params in an array
+        if isinstance(params, list) and len(params) == 1:
+            params = params[0]
+        try:
+            query = legacy_params.search_objects(params)
+        except Exception as err:
+            raise ResponseError(code=-32602, message=f'Invalid params: {err}')
+        # Type counts are not exported, so do not count them for every page
+        query.pop('aggs', None)
+        params.get('post_processing', {}).pop('add_type_counts', None)
+        return _export_lines(query, meta, _legacy_lines(params, auth))
+    _validate(method, params)
+    if method == 'search_workspace':
+        query = convert_params.search_workspace(params, meta)
+        return _export_lines(query, meta, _workspace_lines(query))
+    return _export_lines(params, meta, _object_lines)
+
+
+async def _export_lines(query: dict, meta: dict, to_lines):
+    """Page through the results of `query`, and convert each page with `to_lines`."""
+    page = dict(query, cursor='*', size=config['export_page_size'])
+    try:
+        while True:
+            result = await search_async(page, meta)
+            page['cursor'] = result['cursor']
+            for line in await to_lines(result):
+                yield line
+            if page['cursor'] is None:
+                return
+    finally:
+        # An export that ends early, such as when the client disconnects,
+        # leaves its point in time open until it expires
+        if page['cursor'] not in (None, '*'):
+            await close_cursor_async(page['cursor'])
+
+
+def _validate(method: str, params):
+    (params_schema, _) = rpc_utils.get_method_schemas(rpc_service.schema, method)
+    params_schema['definitions'] = rpc_service.schema['definitions']
+    try:
+        jsonschema.validate(params, params_schema)
+    except jsonschema.exceptions.ValidationError as err:
+        raise ResponseError(code=-32602, message=f'Invalid params: {err.message}')
+
+
+def _line(obj) -> bytes:
+    return json.dumps(obj).encode('utf-8') + b'\n'
+
+
+async def _object_lines(result: dict) -> list:
+    return [_line(hit) for hit in result['hits']]
+
+
+def _workspace_lines(query: dict):
+    async def to_lines(result: dict) -> list:
+        converted = convert_result.search_workspace(result, query, {})
+        return [_line(hit) for hit in converted['hits']]
+    return to_lines
+
+
+def _legacy_lines(params: dict, auth):
+    async def to_lines(result: dict) -> list:
+        # Fetching workspace and narrative info blocks, so it runs on the RPC
+        # thread pool; each page gets a fresh context, so that the
+        # request-scoped lookups do not grow with the export
+        converted = await rpc_executor.run(legacy_result.search_objects, params, result, {'auth': auth})
+        ws_infos = converted.get('access_groups_info')
+        narrative_infos = converted.get('access_group_narrative_info')
+        lines = []
+        for obj in converted['objects']:
+            workspace_id = str(obj['workspace_id'])
+            if ws_infos is not None:
+                obj['access_group_info'] = ws_infos.get(workspace_id)
+            if narrative_infos is not None:
+                obj['access_group_narrative_info'] = narrative_infos.get(workspace_id)
+            lines.append(_line(obj))
+        return lines
+    return to_lines
@@ -0,0 +1,143 @@
+"""
+Async dispatch for jsonrpcbase services.
+
+jsonrpcbase only knows how to call plain functions. This subclass lets a method
+also register a coroutine implementation, which `call_py_async` awaits from the
+event loop. Methods without a coroutine implementation fall back to the
+regular synchronous handler, so `call` and `call_py` keep working as before.
+Those synchronous calls can be handed to a thread pool, except for cheap
+methods added with `add_inline`, which always run directly on the loop.
+
+The entries of a batch request run concurrently, at most `batch_concurrency`
+at a time, and share the same metadata object, so anything a method caches in
+it for the request (see `src/utils/dataloader.py`) is shared by the batch.
+"""
+import asyncio
+import jsonrpcbase
+import jsonschema
+import logging
+from jsonrpcbase import utils as rpc_utils
+from jsonrpcbase.main import REQUEST_SCHEMA
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class AsyncJSONRPCService(jsonrpcbase.JSONRPCService):
+
+    def __init__(self, *args, batch_concurrency: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_concurrency = batch_concurrency
+        # Mapping of method name to coroutine function handler
+        self.async_methods = {}  # type: dict
+        # Names of cheap synchronous methods that never need a thread
+        self.inline_methods = {'rpc.discover'}
+
+    def add_async(self, func: Callable, name: Optional[str] = None):
+        """
+        Register a coroutine implementation for a method that has already been
+        added with `add()`.
+        """
+        fname = name if name else func.__name__
+        if fname not in self.method_data:
+            raise ValueError(f"Add a synchronous handler for '{fname}' before its async version")
+        self.async_methods[fname] = func
+
+    def add_inline(self, func: Callable, name: Optional[str] = None):
+        """Add a method that is cheap enough to always run on the event loop."""
+        self.add(func, name)
+        self.inline_methods.add(name if name else func.__name__)
+
+    async def call_py_async(self, req_data, metadata=None, run_sync=None):
+        """
+        Same as `call_py`, but awaits coroutine method implementations.
+
+        Args:
+            req_data: JSON-RPC 2.0 request payload as a python object
+            metadata: Any optional additional data to send to the handler function
+            run_sync: Optional coroutine function, called as
+                `run_sync(func, *args)`, used to run blocking handlers off the
+                event loop. Any exception it raises itself is passed on.
+        """
+        if isinstance(req_data, list) and req_data:
+            return await self._call_batch_async(req_data, metadata, run_sync)
+        method_name = req_data.get('method') if isinstance(req_data, dict) else None
+        if method_name in self.async_methods:
+            return await self._call_single_async(req_data, metadata)
+        if run_sync is None or method_name in self.inline_methods:
+            return self.call_py(req_data, metadata)
+        # Blocking methods
+        return await run_sync(self.call_py, req_data, metadata)
+
+    async def _call_batch_async(self, req_data: list, metadata, run_sync) -> Optional[list]:
+        """Async counterpart of `JSONRPCService._call_batch`, running the entries concurrently."""
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def call(req):
+            if not isinstance(req, dict):
+                # Nested batches and other junk are invalid requests
+                return self._call_single(req, metadata)
+            async with semaphore:
+                try:
+                    return await self.call_py_async(req, metadata, run_sync)
+                except Exception as err:
+                    # Such as a full thread pool; the other entries still get results
+                    if not hasattr(err, 'jsonrpc_code'):
+                        raise
+                    err_data = {'method': req.get('method'), 'details': getattr(err, 'message', str(err))}
+                    return self._err_response(err.jsonrpc_code, req, err_data)
+
+        responses = await asyncio.gather(*[call(req) for req in req_data])
+        # According to the spec, notification requests do not go in the result array
+        results = [resp for resp in responses if resp is not None]
+        return results or None
+
+    async def _call_single_async(self, req_data: dict, metadata) -> Optional[dict]:
+        """Async counterpart of `JSONRPCService._call_single`."""
+        try:
+            jsonschema.validate(req_data, REQUEST_SCHEMA)
+        except jsonschema.exceptions.ValidationError as err:
+            data = {'details': err.message}
+            return self._err_response(-32600, req_data, err_data=data, always_respond=True)
+        method_name = req_data['method']
+        params = req_data.get('params')
+        (params_schema, result_schema) = rpc_utils.get_method_schemas(self.schema, method_name)
+        if (method_name in self.schema['definitions']['methods']
+                and params_schema is None
+                and params is not None):
+            err_data = {'details': "Parameters not allowed"}
+            return self._err_response(-32602, req_data, err_data)
+        elif params_schema is not None:
+            params_schema['definitions'] = self.schema['definitions']
+            try:
+                jsonschema.validate(params, params_schema)
+            except jsonschema.exceptions.ValidationError as err:
+                err_data = {'details': err.message, 'path': list(err.path)}
+                return self._err_response(-32602, req_data, err_data)
+        try:
+            result = await self.async_methods[method_name](params, metadata)
+        except Exception as err:
+            log.exception(f"Method {method_name} threw an exception: {err}")
+            err_data = {'method': method_name}
+            if hasattr(err, 'message'):
+                err_data['details'] = err.message
+            code = getattr(err, 'jsonrpc_code', -32000)
+            if code > -32000 or code < -32099:
+                msg = (
+                    f"Invalid server error code '{code}'; "
+                    "must be in the range -32000 to -32099."
+                )
+                raise jsonrpcbase.exceptions.InvalidServerErrorCode(msg)
+            return self._err_response(code, req_data, err_data)
+        if self.development and result_schema:
+            result_schema['definitions'] = self.schema['definitions']
+            jsonschema.validate(result, result_schema)
+        _id = rpc_utils.response_id(req_data)
+        if _id is None:
+            # Notification request; no results
+            return None
+        return {
+            'id': _id,
+            'jsonrpc': '2.0',
+            'result': result,
+        }
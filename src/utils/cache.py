@@ -0,0 +1,123 @@
+"""
+Bounded in-memory caches for upstream lookups.
+
+`TTLCache` is a thread-safe LRU cache where each entry expires after a TTL
+and the total (approximate) size of the values is capped. It is safe to use
+from both the request threads and the event loop, since no call blocks while
+holding the lock for longer than a dict operation.
+"""
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# Returned by `get` when there is no usable entry
+MISSING = object()
+
+
+class TTLCache:
+
+    def __init__(self, name: str, max_entries: int, ttl: float, max_bytes: Optional[int] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Mapping of key to (expires_at, size, value), oldest first
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key) -> Any:
+        """Return the cached value for `key`, or MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            (expires_at, size, value) = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def peek(self, key) -> Any:
+        """Like `get`, but without counting a lookup or touching the LRU order."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return MISSING
+            return entry[2]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """Store `value` under `key`, evicting least recently used entries as needed."""
+        size = approx_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+            }
+
+    def _remove(self, key):
+        """Drop an entry; the lock must be held."""
+        (_, size, _) = self._entries.pop(key)
+        self._bytes -= size
+
+
+def token_fingerprint(token: Optional[str]) -> str:
+    """A stable cache key for an auth token that does not keep the token itself."""
+    if token is None:
+        return 'anonymous'
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def approx_size(value) -> int:
+    """Rough size in bytes of a JSON-like value, including nested containers."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for (k, v) in value.items())
+    elif isinstance(value, (list, tuple)) and value:
+        if isinstance(value[0], (int, float)) and isinstance(value[-1], (int, float)):
+            # Shortcut for long lists of numbers, such as workspace IDs
+            size += len(value) * sys.getsizeof(value[0])
+        else:
+            size += sum(approx_size(v) for v in value)
+    return size
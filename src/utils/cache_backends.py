@@ -0,0 +1,390 @@
+"""
+Cache backends that can be shared by all the Sanic workers on a node.
+
+Every backend has the same interface as `TTLCache` (get, peek, set, delete,
+clear, stats), and `make_cache` picks one based on the CACHE_BACKEND setting:
+
+- `memory`: a `TTLCache` in each worker process (the default)
+- `shm`: one file per entry in a directory on a shared-memory filesystem
+  such as /dev/shm; all workers read and write the same entries
+- `socket`: a sidecar process that holds the caches and is reached over a
+  Unix domain socket; start it with `python -m src.utils.cache_backends`
+
+Keys and values of the shared backends must be JSON-serializable; tuples
+come back as lists.
+
+The shared backends hold access-control data (the workspaces that each token
+can read), so their directories must be private to the service's user: the
+shm directory and the directory of the sidecar's socket are created with mode
+0700, and are refused if another user owns them or can write to them. Their
+file and socket I/O blocks, so coroutines reach the caches through `run_io`.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from src.utils.cache import TTLCache, MISSING
+from src.utils.config import config
+from src.utils.logger import logger
+
+# Entry files start with the expiry time as a little-endian double
+_HEADER = struct.Struct('<d')
+
+# How many `set` calls a process makes between sweeps of the shm directory
+_SWEEP_EVERY = 100
+
+# Threads that run cache I/O for coroutines; started on first use
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='cache-io')
+
+
+def make_cache(name: str, max_entries: int, ttl: float, max_bytes: Optional[int] = None):
+    """Create a cache using the backend configured for this deployment."""
+    backend = config['cache_backend']
+    if backend == 'memory':
+        return TTLCache(name, max_entries, ttl, max_bytes)
+    if backend == 'shm':
+        return SharedMemoryCache(name, max_entries, ttl, max_bytes, directory=config['cache_shm_dir'])
+    if backend == 'socket':
+        return SocketCache(name, max_entries, ttl, max_bytes, path=config['cache_socket_path'])
+    raise RuntimeError(f"Invalid cache backend: {backend}")
+
+
+async def run_io(func, *args):
+    """
+    Call `func(*args)`, which reads or writes the caches, from a coroutine:
+    on a thread if the configured backend does blocking I/O, and directly
+    otherwise.
+    """
+    if config['cache_backend'] == 'memory':
+        return func(*args)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_io_pool, functools.partial(func, *args))
+
+
+def private_dir(path: str):
+    """
+    Create the directory `path` with mode 0700 if needed. Raises
+    PermissionError if it is not a directory of our own that only we can
+    write to, since anyone who can write to it can plant cache entries.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    # lstat, so that a symlink to someone else's directory is refused
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"Cache directory {path} is not a directory")
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"Cache directory {path} is owned by another user")
+    if info.st_mode & 0o022:
+        raise PermissionError(f"Cache directory {path} can be written by other users")
+
+
+def _key_str(key) -> str:
+    return json.dumps(key, sort_keys=True)
+
+
+class SharedMemoryCache:
+    """
+    Cache entries stored as files in a directory that is shared by every
+    worker. Writes are atomic renames, so readers never see partial entries.
+    The least recently used files are removed when a periodic sweep finds
+    the cache over its entry or byte budget.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float,
+                 max_bytes: Optional[int] = None, directory: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = os.path.join(directory or tempfile.gettempdir(), 'search2-cache-' + name)
+        private_dir(self.directory)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._sets = 0
+        self._evictions = 0
+
+    def get(self, key) -> Any:
+        value = self._read(key, touch=True)
+        with self._lock:
+            if value is MISSING:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return value
+
+    def peek(self, key) -> Any:
+        return self._read(key, touch=False)
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        key_str = _key_str(key)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        data = _HEADER.pack(expires_at) + json.dumps([key_str, value]).encode('utf-8')
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return
+        path = self._path(key_str)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._sets += 1
+            sweep = self._sets % _SWEEP_EVERY == 0
+        if sweep:
+            self.sweep()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(_key_str(key)))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            _remove_quietly(entry.path)
+
+    def sweep(self):
+        """Remove expired entries, then the least recently used ones while over budget."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+                with open(entry.path, 'rb') as fd:
+                    (expires_at,) = _HEADER.unpack(fd.read(_HEADER.size))
+            except (OSError, struct.error):
+                continue
+            if expires_at <= now:
+                _remove_quietly(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for (_, size, _) in entries)
+        while entries and (len(entries) > self.max_entries
+                           or (self.max_bytes is not None and total > self.max_bytes)):
+            (_, size, path) = entries.pop(0)
+            _remove_quietly(path)
+            total -= size
+            with self._lock:
+                self._evictions += 1
+
+    def stats(self) -> dict:
+        entries = [e for e in os.scandir(self.directory) if not e.name.endswith('.tmp')]
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'backend': 'shm',
+                'entries': len(entries),
+                'bytes': sum(e.stat().st_size for e in entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+            }
+
+    def _path(self, key_str: str) -> str:
+        digest = hashlib.blake2b(key_str.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def _read(self, key, touch: bool) -> Any:
+        key_str = _key_str(key)
+        path = self._path(key_str)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            return MISSING
+        (expires_at,) = _HEADER.unpack_from(data)
+        if expires_at <= time.time():
+            _remove_quietly(path)
+            return MISSING
+        (stored_key, value) = json.loads(data[_HEADER.size:])
+        if stored_key != key_str:
+            # Hash collision
+            return MISSING
+        if touch:
+            # The modification time orders entries for LRU eviction
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return value
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SocketCache:
+    """
+    Client for a cache held by the sidecar process (see `CacheSidecar`).
+    Each thread keeps its own connection. If the sidecar cannot be reached,
+    lookups are misses and writes are dropped, so requests still succeed.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float,
+                 max_bytes: Optional[int] = None, path: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path or config['cache_socket_path']
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._errors = 0
+
+    def get(self, key) -> Any:
+        value = self._lookup('get', key)
+        with self._lock:
+            if value is MISSING:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return value
+
+    def peek(self, key) -> Any:
+        return self._lookup('peek', key)
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._call({'op': 'set', 'key': _key_str(key), 'value': value,
+                    'ttl': self.ttl if ttl is None else ttl})
+
+    def delete(self, key):
+        self._call({'op': 'delete', 'key': _key_str(key)})
+
+    def clear(self):
+        self._call({'op': 'clear'})
+
+    def stats(self) -> dict:
+        resp = self._call({'op': 'stats'})
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'backend': 'socket',
+                'sidecar': resp.get('stats') if resp else None,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'errors': self._errors,
+            }
+
+    def _lookup(self, op: str, key) -> Any:
+        resp = self._call({'op': op, 'key': _key_str(key)})
+        if resp is None or 'value' not in resp:
+            return MISSING
+        return resp['value']
+
+    def _call(self, req: dict) -> Optional[dict]:
+        req['cache'] = self.name
+        req['max_entries'] = self.max_entries
+        req['max_bytes'] = self.max_bytes
+        line = json.dumps(req).encode('utf-8') + b'\n'
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.sendall(line)
+                resp = self._local.reader.readline()
+                if not resp:
+                    raise ConnectionError('Cache sidecar closed the connection')
+                return json.loads(resp)
+            except OSError as err:
+                # Retry once on a fresh connection, in case the sidecar restarted
+                self._disconnect()
+                if attempt == 1:
+                    logger.warning(f"Cache sidecar at {self.path} is unavailable: {err}")
+                    with self._lock:
+                        self._errors += 1
+        return None
+
+    def _connection(self) -> socket.socket:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            private_dir(os.path.dirname(self.path))
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(1)
+            conn.connect(self.path)
+            self._local.conn = conn
+            self._local.reader = conn.makefile('rb')
+        return conn
+
+    def _disconnect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                self._local.reader.close()
+                conn.close()
+            except OSError:
+                pass
+        self._local.conn = None
+
+
+class _SidecarHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            req = json.loads(line)
+            cache = self.server.get_cache(req)  # type: ignore
+            resp = {}  # type: dict
+            op = req['op']
+            if op in ('get', 'peek'):
+                value = cache.get(req['key']) if op == 'get' else cache.peek(req['key'])
+                if value is not MISSING:
+                    resp['value'] = value
+            elif op == 'set':
+                cache.set(req['key'], req['value'], ttl=req['ttl'])
+            elif op == 'delete':
+                cache.delete(req['key'])
+            elif op == 'clear':
+                cache.clear()
+            elif op == 'stats':
+                resp['stats'] = cache.stats()
+            self.wfile.write(json.dumps(resp).encode('utf-8') + b'\n')
+
+
+class CacheSidecar(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Holds one `TTLCache` per cache name for every worker on the node.
+    Each cache is created with the size limits sent by the first client
+    that uses it.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        private_dir(os.path.dirname(path))
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _SidecarHandler)
+        self._caches = {}  # type: dict
+        self._caches_lock = threading.Lock()
+
+    def get_cache(self, req: dict) -> TTLCache:
+        name = req['cache']
+        with self._caches_lock:
+            if name not in self._caches:
+                # The TTL is sent with each `set`
+                self._caches[name] = TTLCache(name, req['max_entries'], ttl=0, max_bytes=req['max_bytes'])
+            return self._caches[name]
+
+
+if __name__ == '__main__':
+    path = config['cache_socket_path']
+    logger.info(f'Cache sidecar listening on {path}')
+    CacheSidecar(path).serve_forever()
@@ -12,7 +12,12 @@ def init_config():
     #       Reason? A failure to configure one of these in prod could lead to
     #       confusing failure conditions.
     ws_url = os.environ.get('WORKSPACE_URL', 'https://ci.kbase.us/services/ws').strip('/')
-    es_url = os.environ.get('ELASTICSEARCH_URL', 'http://localhost:9200').strip('/')
+    # One or more comma-separated nodes to spread requests over
+    es_urls = [
+        url.strip().strip('/')
+        for url in os.environ.get('ELASTICSEARCH_URL', 'http://localhost:9200').split(',')
+        if url.strip()
+    ]
     index_prefix = os.environ.get('INDEX_PREFIX', 'test')
     prefix_delimiter = os.environ.get('INDEX_PREFIX_DELIMITER', '.')
     suffix_delimiter = os.environ.get('INDEX_SUFFIX_DELIMITER', '_')
@@ -36,13 +41,98 @@ def init_config():
     return {
         'dev': bool(os.environ.get('DEVELOPMENT')),
         'global': global_config,
-        'elasticsearch_url': es_url,
+        # The first node, for anything that needs a single URL
+        'elasticsearch_url': es_urls[0],
+        'elasticsearch_urls': es_urls,
         'index_prefix': index_prefix,
         'prefix_delimiter': prefix_delimiter,
         'suffix_delimiter': suffix_delimiter,
         'workspace_url': ws_url,
         'user_profile_url': user_profile_url,
         'workers': int(os.environ.get('WORKERS', 8)),
+        # Where caches live: "memory" (per worker), "shm" or "socket" (shared by workers)
+        'cache_backend': os.environ.get('CACHE_BACKEND', 'memory'),
+        'cache_shm_dir': os.environ.get('CACHE_SHM_DIR', '/dev/shm'),
+        # The socket's directory must be private to the service's user
+        'cache_socket_path': os.environ.get('CACHE_SOCKET_PATH', f'/tmp/search2-cache-{os.getuid()}/cache.sock'),
+        # Cache of the workspace IDs readable by each auth token (seconds, bytes)
+        'ws_auth_cache_ttl': float(os.environ.get('WS_AUTH_CACHE_TTL', 60)),
+        'ws_auth_cache_stale_ttl': float(os.environ.get('WS_AUTH_CACHE_STALE_TTL', 300)),
+        'ws_auth_cache_error_ttl': float(os.environ.get('WS_AUTH_CACHE_ERROR_TTL', 10)),
+        'ws_auth_cache_size': int(os.environ.get('WS_AUTH_CACHE_SIZE', 10000)),
+        'ws_auth_cache_max_bytes': int(os.environ.get('WS_AUTH_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        # Background refresh of the cached workspace IDs of recently active users (seconds)
+        'ws_auth_refresh_ahead': float(os.environ.get('WS_AUTH_REFRESH_AHEAD', 15)),
+        'ws_auth_refresh_interval': float(os.environ.get('WS_AUTH_REFRESH_INTERVAL', 5)),
+        'ws_auth_active_window': float(os.environ.get('WS_AUTH_ACTIVE_WINDOW', 600)),
+        # How searches are restricted to readable workspaces: "inline" lists the
+        # workspace IDs in each query; "lookup" stores them as documents in the
+        # ACL index and references them with a terms lookup
+        'access_filter_mode': os.environ.get('ACCESS_FILTER_MODE', 'inline'),
+        'acl_index': os.environ.get('ACL_INDEX', index_prefix + prefix_delimiter + 'search_api_acl'),
+        # ACL documents that have not been written for `acl_doc_max_age`
+        # seconds are deleted, every `acl_sweep_interval` seconds
+        'acl_doc_max_age': float(os.environ.get('ACL_DOC_MAX_AGE', 86400)),
+        'acl_sweep_interval': float(os.environ.get('ACL_SWEEP_INTERVAL', 3600)),
+        # Per-worker thread pool for blocking RPC dispatch
+        'rpc_threads': int(os.environ.get('RPC_THREADS', 16)),
+        'rpc_queue_size': int(os.environ.get('RPC_QUEUE_SIZE', 64)),
+        # Entries of a JSON-RPC batch request that run at the same time
+        'rpc_batch_concurrency': int(os.environ.get('RPC_BATCH_CONCURRENCY', 4)),
+        # Cache of workspace infos (seconds). Public workspace infos are revalidated
+        # in bulk every `ws_info_sync_interval` seconds, and stay valid until
+        # `ws_info_cache_max_age`; others are valid for `ws_info_cache_ttl`.
+        'ws_info_cache_ttl': float(os.environ.get('WS_INFO_CACHE_TTL', 300)),
+        'ws_info_cache_max_age': float(os.environ.get('WS_INFO_CACHE_MAX_AGE', 86400)),
+        'ws_info_cache_size': int(os.environ.get('WS_INFO_CACHE_SIZE', 10000)),
+        'ws_info_sync_interval': float(os.environ.get('WS_INFO_SYNC_INTERVAL', 30)),
+        # Cache of user profiles by username (seconds)
+        'user_profile_cache_ttl': float(os.environ.get('USER_PROFILE_CACHE_TTL', 600)),
+        'user_profile_cache_size': int(os.environ.get('USER_PROFILE_CACHE_SIZE', 10000)),
+        # Cache of public search results (seconds, bytes; a TTL of 0 disables it).
+        # Entries are dropped when index document counts change, which are
+        # checked every `search_cache_check_interval` seconds.
+        'search_cache_ttl': float(os.environ.get('SEARCH_CACHE_TTL', 60)),
+        'search_cache_size': int(os.environ.get('SEARCH_CACHE_SIZE', 1000)),
+        'search_cache_max_bytes': int(os.environ.get('SEARCH_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        'search_cache_check_interval': float(os.environ.get('SEARCH_CACHE_CHECK_INTERVAL', 5)),
+        # Cache of `_count` results (seconds; a TTL of 0 disables it). Counts may be
+        # up to `count_cache_ttl` seconds old.
+        'count_cache_ttl': float(os.environ.get('COUNT_CACHE_TTL', 10)),
+        'count_cache_size': int(os.environ.get('COUNT_CACHE_SIZE', 10000)),
+        # How long a point in time used for cursor paging is kept between pages
+        'search_cursor_keep_alive': os.environ.get('SEARCH_CURSOR_KEEP_ALIVE', '5m'),
+        # Hits fetched per page by the streaming export
+        'export_page_size': int(os.environ.get('EXPORT_PAGE_SIZE', 1000)),
+        # Workspace info lookups in flight at once when converting legacy results
+        'ws_info_concurrency': int(os.environ.get('WS_INFO_CONCURRENCY', 16)),
+        # Connection pool settings for the shared HTTP clients
+        'http_pool_hosts': int(os.environ.get('HTTP_POOL_HOSTS', 10)),
+        'http_pool_size': int(os.environ.get('HTTP_POOL_SIZE', 16)),
+        'http_max_connections': int(os.environ.get('HTTP_MAX_CONNECTIONS', 100)),
+        'http_max_keepalive': int(os.environ.get('HTTP_MAX_KEEPALIVE', 20)),
+        # Connections to open to each upstream when a worker starts
+        'http_prewarm': int(os.environ.get('HTTP_PREWARM', 2)),
+        # Matches the 3m timeout that we send to Elasticsearch
+        'http_timeout': float(os.environ.get('HTTP_TIMEOUT', 180)),
+        # Upstreams whose request bodies are gzipped, when they are at least
+        # `http_compress_min_bytes` long: comma-separated names out of
+        # "elasticsearch", "workspace" and "user_profile". Off by default.
+        'http_compress': [name.strip() for name in os.environ.get('HTTP_COMPRESS', '').split(',') if name.strip()],
+        'http_compress_min_bytes': int(os.environ.get('HTTP_COMPRESS_MIN_BYTES', 1024)),
+        # Elasticsearch node selection ("round_robin" or "least_outstanding"),
+        # how often ejected nodes are probed (seconds), and how often the
+        # cluster's nodes are sniffed (seconds; 0 turns sniffing off)
+        'es_node_selection': os.environ.get('ES_NODE_SELECTION', 'round_robin'),
+        'es_node_probe_interval': float(os.environ.get('ES_NODE_PROBE_INTERVAL', 5)),
+        'es_sniff_interval': float(os.environ.get('ES_SNIFF_INTERVAL', 0)),
+        # Retries of searches that Elasticsearch answers with 429 or 503: at
+        # most `es_retry_attempts`, with delays from `es_retry_base_delay` up
+        # to `es_retry_max_delay`, ending within `es_retry_budget` seconds
+        'es_retry_attempts': int(os.environ.get('ES_RETRY_ATTEMPTS', 3)),
+        'es_retry_base_delay': float(os.environ.get('ES_RETRY_BASE_DELAY', 0.1)),
+        'es_retry_max_delay': float(os.environ.get('ES_RETRY_MAX_DELAY', 2)),
+        'es_retry_budget': float(os.environ.get('ES_RETRY_BUDGET', 10)),
         'app_version': app_version,
     }
 
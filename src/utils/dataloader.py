@@ -0,0 +1,101 @@
+"""
+Request-scoped batching of upstream lookups.
+
+A `DataLoader` wraps a batch function for one upstream service, taking a list
+of keys and returning their values in the same order. Within a request, keys
+can be queued with `prime` as they are discovered and are then fetched
+together by the next `load` or `load_many`, in a single call to the batch
+function; values are kept for the rest of the request, so each key is fetched
+at most once. Loaders are kept in the RPC context (`meta`) with `get_loader`,
+so the code paths that handle one request share them. The process-wide caches
+behind the batch functions (see `workspace.py` and `user_profiles.py`) still
+apply across requests.
+
+Coroutines on the event loop use `load_once_async` instead, which shares one
+task per key among the concurrent callers of a request.
+"""
+import asyncio
+import threading
+
+from src.utils.single_flight import SingleFlight
+
+
+class DataLoader:
+
+    def __init__(self, batch_fn):
+        self._batch_fn = batch_fn
+        self._lock = threading.Lock()
+        self._values = {}  # type: dict
+        self._queue = {}  # type: dict
+        self._in_flight = SingleFlight()
+        self.batches = 0
+
+    def prime(self, keys):
+        """Queue keys to be fetched along with the next load."""
+        with self._lock:
+            for key in keys:
+                if key not in self._values:
+                    self._queue[key] = None
+
+    def load(self, key):
+        return self.load_many([key])[0]
+
+    def load_many(self, keys) -> list:
+        """
+        Get the values for `keys`, in the same order. Keys that have not been
+        loaded yet, along with any queued keys, are fetched in one batch;
+        keys that another thread of this request is fetching are waited on.
+        """
+        with self._lock:
+            for key in keys:
+                if key not in self._values:
+                    self._queue[key] = None
+            wanted = list(self._queue)
+            self._queue.clear()
+            (owned, waiting) = self._in_flight.claim(wanted)
+        if owned:
+            try:
+                values = self._batch_fn(owned)
+            except BaseException as err:
+                self._in_flight.fail(owned, err)
+                raise
+            with self._lock:
+                self.batches += 1
+                self._values.update(zip(owned, values))
+            for (key, value) in zip(owned, values):
+                self._in_flight.resolve(key, value)
+        for future in waiting.values():
+            future.result()
+        with self._lock:
+            return [self._values[key] for key in keys]
+
+
+def get_loader(ctx: dict, name: str, batch_fn) -> DataLoader:
+    """
+    The loader called `name` for the request with RPC context `ctx`, created
+    with `batch_fn` on first use.
+    """
+    loaders = ctx.setdefault('loaders', {})
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders.setdefault(name, DataLoader(batch_fn))
+    return loader
+
+
+async def load_once_async(ctx: dict, name: str, key, fetch):
+    """
+    Await `fetch()` at most once for each (name, key) in the request with RPC
+    context `ctx`; callers that come while it runs await the same task. A
+    failed fetch is not kept, so the next caller tries again.
+    """
+    tasks = ctx.setdefault('async_loads', {})
+    task = tasks.get((name, key))
+    if task is None:
+        task = tasks[(name, key)] = asyncio.ensure_future(fetch())
+    try:
+        # A caller that is cancelled does not cancel the fetch for the others
+        return await asyncio.shield(task)
+    except Exception:
+        if tasks.get((name, key)) is task:
+            del tasks[(name, key)]
+        raise
@@ -0,0 +1,86 @@
+"""
+Bounded thread pool for running blocking RPC dispatch off the event loop.
+
+Each Sanic worker gets its own pool. Jobs beyond the pool size wait in a
+queue of limited length; once that is full, new jobs are rejected with
+`ServerBusy` instead of piling up behind the ones already waiting.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.exceptions import ServerBusy
+from src.utils import metrics
+from src.utils.config import config
+
+
+class BoundedExecutor:
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rpc')
+        self._lock = threading.Lock()
+        # Jobs accepted but not yet finished (both queued and running)
+        self._pending = 0
+        self._running = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(self, func, *args):
+        """
+        Run `func(*args)` on the pool and return its result.
+        Raises ServerBusy if the queue is full.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise ServerBusy()
+            self._pending += 1
+            queued = self._pending - self._running
+            self._max_queued = max(self._max_queued, queued)
+        submitted = time.monotonic()
+
+        def job():
+            wait = time.monotonic() - submitted
+            with self._lock:
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._pool, job)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+
+    def stats(self) -> dict:
+        """Current queue depth and wait times (in seconds)."""
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queued': self._pending - self._running,
+                'max_queued': self._max_queued,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_wait': self._total_wait / started if started else 0.0,
+                'max_wait': self._max_wait,
+            }
+
+
+rpc_executor = BoundedExecutor(config['rpc_threads'], config['rpc_queue_size'])
+metrics.register('rpc_executor', rpc_executor.stats)
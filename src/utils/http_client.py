@@ -0,0 +1,146 @@
+"""
+Shared HTTP clients for talking to Elasticsearch, the Workspace, and the
+UserProfile service.
+
+Both clients keep per-host pools of keep-alive connections, so repeated calls
+to an upstream reuse an open TCP/TLS connection instead of opening a new one:
+
+- a `requests.Session` for the blocking code paths, shared by all threads
+- an `httpx.AsyncClient` for the event loop, created lazily on first use
+  within the worker's loop and closed when the server stops
+
+Both also compress request bodies and count compressed responses, as set
+up in `http_compression`.
+
+`prewarm()` and `prewarm_async()` open a few connections to each upstream at
+startup so that the first requests do not pay for connection setup.
+"""
+import asyncio
+import httpx
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from src.utils import http_compression
+from src.utils.config import config
+from src.utils.logger import logger
+
+_async_client: Optional[httpx.AsyncClient] = None
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+class _CompressingAdapter(requests.adapters.HTTPAdapter):
+
+    def send(self, request, **kwargs):
+        compressed = http_compression.compress(request.url, request.body)
+        if compressed is not None:
+            request.body = compressed
+            request.headers['Content-Encoding'] = 'gzip'
+            request.headers['Content-Length'] = str(len(compressed))
+        resp = super().send(request, **kwargs)
+        encoding = resp.headers.get('Content-Encoding')
+        if encoding and not kwargs.get('stream'):
+            # Reads the body, which the session would do next anyway
+            decoded = len(resp.content)
+            http_compression.observe_response(request.url, encoding, resp.raw.tell(), decoded)
+        return resp
+
+
+class _CompressingAsyncClient(httpx.AsyncClient):
+
+    def build_request(self, method, url, **kwargs):
+        compressed = http_compression.compress(url, kwargs.get('content'))
+        if compressed is not None:
+            kwargs['content'] = compressed
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Encoding': 'gzip'})
+        return super().build_request(method, url, **kwargs)
+
+    async def send(self, request, **kwargs):
+        resp = await super().send(request, **kwargs)
+        encoding = resp.headers.get('Content-Encoding')
+        if encoding and not kwargs.get('stream'):
+            http_compression.observe_response(request.url, encoding, resp.num_bytes_downloaded, len(resp.content))
+        return resp
+
+
+def get_session() -> requests.Session:
+    """Return the pooled requests session for this process, creating it if needed."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = _CompressingAdapter(
+                # Number of distinct hosts to keep pools for
+                pool_connections=config['http_pool_hosts'],
+                # Number of keep-alive connections to keep per host
+                pool_maxsize=config['http_pool_size'],
+            )
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the pooled async client for this process, creating it if needed."""
+    global _async_client
+    if _async_client is None:
+        limits = httpx.Limits(
+            max_connections=config['http_max_connections'],
+            max_keepalive_connections=config['http_max_keepalive'],
+        )
+        _async_client = _CompressingAsyncClient(
+            limits=limits,
+            timeout=config['http_timeout'],
+        )
+    return _async_client
+
+
+async def close_async_client():
+    """Close the pooled async client, dropping any open connections."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def upstream_urls() -> list:
+    """URLs of every service that we keep connections open to."""
+    return config['elasticsearch_urls'] + [config['workspace_url'], config['user_profile_url']]
+
+
+def prewarm():
+    """Open `http_prewarm` connections to each upstream in the shared session."""
+    count = config['http_prewarm']
+    if count <= 0:
+        return
+    session = get_session()
+    urls = [url for url in upstream_urls() for _ in range(count)]
+
+    def connect(url):
+        try:
+            # Any response will do; we only want the open connection
+            session.get(url, timeout=5).close()
+        except Exception as err:
+            logger.debug(f"Could not pre-warm connection to {url}: {err}")
+
+    # Make the calls concurrently, so that each one needs its own connection
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        list(pool.map(connect, urls))
+
+
+async def prewarm_async():
+    """Open `http_prewarm` connections to each upstream in the async client."""
+    count = config['http_prewarm']
+    if count <= 0:
+        return
+    client = get_async_client()
+
+    async def connect(url):
+        try:
+            await client.get(url, timeout=5)
+        except Exception as err:
+            logger.debug(f"Could not pre-warm connection to {url}: {err}")
+
+    await asyncio.gather(*[connect(url) for url in upstream_urls() for _ in range(count)])
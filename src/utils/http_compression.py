@@ -0,0 +1,107 @@
+"""
+Compression of the traffic to Elasticsearch, the Workspace, and the
+UserProfile service.
+
+Request bodies of at least HTTP_COMPRESS_MIN_BYTES are gzipped and sent with
+`Content-Encoding: gzip` to the upstreams named in HTTP_COMPRESS, which must
+accept compressed requests (Elasticsearch does). It is off by default.
+
+Both shared HTTP clients send `Accept-Encoding: gzip, deflate` and decode
+compressed responses, so responses are compressed whenever the upstream
+supports it (for Elasticsearch, with `http.compression`).
+
+For each upstream, `/metrics` reports under "http_compression" the bytes of
+the compressed request bodies before and after compression, the thread CPU
+time spent compressing them, and the decoded and received bytes of the
+compressed responses.
+"""
+import gzip
+import threading
+import time
+from typing import Optional
+
+from src.utils import metrics
+from src.utils.config import config
+
+# Config keys of the upstream URLs, by upstream name
+_UPSTREAM_URLS = {
+    'elasticsearch': 'elasticsearch_urls',
+    'workspace': 'workspace_url',
+    'user_profile': 'user_profile_url',
+}
+
+# URLs found at runtime, such as sniffed Elasticsearch nodes, by upstream name
+_extra_urls = {}  # type: dict
+
+# Fast enough for bodies of a few MB, and most of the gain of higher levels
+_LEVEL = 6
+
+_lock = threading.Lock()
+_stats = {}  # type: dict
+
+
+def upstream_name(url) -> Optional[str]:
+    """The name of the upstream that a URL belongs to, or None."""
+    url = str(url)
+    for (name, key) in _UPSTREAM_URLS.items():
+        base_urls = config[key] if isinstance(config[key], list) else [config[key]]
+        if any(url.startswith(base_url) for base_url in base_urls + _extra_urls.get(name, [])):
+            return name
+    return None
+
+
+def register_urls(name: str, urls: list):
+    """Set the URLs found at runtime for an upstream, besides the configured ones."""
+    _extra_urls[name] = list(urls)
+
+
+def compress(url, body) -> Optional[bytes]:
+    """The gzipped body of a request to `url`, or None to send the body as it is."""
+    if not isinstance(body, (str, bytes)):
+        return None
+    upstream = upstream_name(url)
+    if upstream is None or upstream not in config['http_compress']:
+        return None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if len(body) < config['http_compress_min_bytes']:
+        return None
+    start = time.thread_time()
+    compressed = gzip.compress(body, compresslevel=_LEVEL)
+    _count(upstream, {
+        'requests_compressed': 1,
+        'request_bytes': len(body),
+        'request_bytes_sent': len(compressed),
+        'compress_seconds': time.thread_time() - start,
+    })
+    return compressed
+
+
+def observe_response(url, encoding: Optional[str], received: int, decoded: int):
+    """
+    Count a response from `url` with the given Content-Encoding, of which
+    `received` bytes came over the wire and `decoded` bytes were read.
+    """
+    upstream = upstream_name(url)
+    if upstream is None or encoding not in ('gzip', 'deflate'):
+        return
+    _count(upstream, {
+        'responses_compressed': 1,
+        'response_bytes': decoded,
+        'response_bytes_received': received,
+    })
+
+
+def _count(upstream: str, counts: dict):
+    with _lock:
+        totals = _stats.setdefault(upstream, {})
+        for (key, value) in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+
+def stats() -> dict:
+    with _lock:
+        return {upstream: dict(totals) for (upstream, totals) in _stats.items()}
+
+
+metrics.register('http_compression', stats)
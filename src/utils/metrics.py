@@ -0,0 +1,19 @@
+"""
+Per-worker runtime metrics.
+
+Components register a function that returns a dict of their current
+counters; `snapshot()` collects them all for the `/metrics` endpoint.
+"""
+from typing import Callable, Dict
+
+_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, stats_fn: Callable[[], dict]):
+    """Register a stats function under a name, replacing any previous one."""
+    _sources[name] = stats_fn
+
+
+def snapshot() -> dict:
+    """Return the current stats of every registered component."""
+    return {name: stats_fn() for (name, stats_fn) in _sources.items()}
@@ -0,0 +1,124 @@
+"""
+Background refresh of cache entries for recently active keys.
+
+Callers `track` a key, with a function that refreshes its cache entry, each
+time they use it. A daemon thread wakes every `interval` seconds and refreshes
+the entries of keys that were used within `active_window` seconds and that
+`needs_refresh` says are close to expiring. Callers that find a stale entry can
+also ask for an immediate `refresh`. At most one refresh per key is in flight
+at any time.
+
+The thread is started on first use, so that it is created inside each Sanic
+worker process rather than before the workers are forked.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from src.utils.logger import logger
+
+
+class BackgroundRefresher:
+
+    def __init__(self,
+                 name: str,
+                 needs_refresh: Callable[[object], bool],
+                 interval: float,
+                 active_window: float,
+                 max_workers: int = 4,
+                 max_tracked: int = 10000):
+        self.name = name
+        self.needs_refresh = needs_refresh
+        self.interval = interval
+        self.active_window = active_window
+        self.max_tracked = max_tracked
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        # Mapping of key to (last_used, refresh_fn)
+        self._tracked = {}  # type: dict
+        self._in_flight = set()  # type: set
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._refreshes = 0
+        self._errors = 0
+
+    def track(self, key, refresh_fn: Callable[[], None]):
+        """Mark `key` as recently used; `refresh_fn` re-fetches its entry."""
+        with self._lock:
+            if key not in self._tracked and len(self._tracked) >= self.max_tracked:
+                return
+            self._tracked[key] = (time.monotonic(), refresh_fn)
+            if self._thread is None:
+                self._start()
+
+    def untrack(self, key):
+        with self._lock:
+            self._tracked.pop(key, None)
+
+    def clear(self):
+        """Stop tracking every key."""
+        with self._lock:
+            self._tracked.clear()
+
+    def refresh(self, key) -> bool:
+        """
+        Refresh the entry for a tracked key in the background, unless a
+        refresh is already running. Returns whether a refresh was started.
+        """
+        with self._lock:
+            tracked = self._tracked.get(key)
+            if tracked is None or key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+            refresh_fn = tracked[1]
+        # The pool exists, since tracking a key starts it
+        self._pool.submit(self._run, key, refresh_fn)  # type: ignore
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'tracked': len(self._tracked),
+                'in_flight': len(self._in_flight),
+                'refreshes': self._refreshes,
+                'errors': self._errors,
+            }
+
+    def _start(self):
+        """Start the worker pool and the scheduling thread; the lock must be held."""
+        self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix=self.name)
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._refresh_due()
+            except Exception:
+                logger.exception(f"Error scheduling background refreshes for {self.name}")
+
+    def _refresh_due(self):
+        """Drop keys that are no longer active and refresh the ones that are due."""
+        cutoff = time.monotonic() - self.active_window
+        with self._lock:
+            for key in [k for (k, (last_used, _)) in self._tracked.items() if last_used < cutoff]:
+                del self._tracked[key]
+            keys = list(self._tracked.keys())
+        for key in keys:
+            if self.needs_refresh(key):
+                self.refresh(key)
+
+    def _run(self, key, refresh_fn):
+        try:
+            refresh_fn()
+            with self._lock:
+                self._refreshes += 1
+        except Exception as err:
+            logger.warning(f"Background refresh for {self.name} failed: {err}")
+            with self._lock:
+                self._errors += 1
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
@@ -0,0 +1,62 @@
+"""
+Coalescing of concurrent lookups for the same key.
+
+The first caller to `claim` a key fetches it; callers that claim the key while
+that fetch is in flight get a future for its result instead of making their
+own upstream call. Futures are `concurrent.futures.Future`s, so they can be
+waited on from request threads, or awaited on the event loop with
+`asyncio.wrap_future`.
+"""
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}  # type: dict
+        self._leaders = 0
+        self._coalesced = 0
+
+    def claim(self, keys) -> tuple:
+        """
+        Returns a pair of (owned, waiting): the keys this caller must fetch and
+        then `resolve` or `fail`, and a dict of key to future for the keys
+        that another caller is already fetching.
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._futures.get(key)
+                if future is None:
+                    self._futures[key] = Future()
+                    owned.append(key)
+                    self._leaders += 1
+                else:
+                    waiting[key] = future
+                    self._coalesced += 1
+        return (owned, waiting)
+
+    def resolve(self, key, value):
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is not None:
+            future.set_result(value)
+
+    def fail(self, keys, err: BaseException):
+        """Pass a fetch error on to every caller waiting for `keys`."""
+        with self._lock:
+            futures = [self._futures.pop(key, None) for key in keys]
+        for future in futures:
+            if future is not None:
+                future.set_exception(err)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._futures),
+                'fetched': self._leaders,
+                'coalesced': self._coalesced,
+            }
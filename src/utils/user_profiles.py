@@ -1,31 +1,121 @@
+import asyncio
 import json
-import requests
 
+from src.utils import metrics
+from src.utils.cache import MISSING
+from src.utils.cache_backends import make_cache, run_io
 from src.utils.config import config
+from src.utils.http_client import get_async_client, get_session
+from src.utils.single_flight import SingleFlight
 from src.exceptions import UserProfileError
 
+# User profiles by username. Missing profiles (None) are not cached.
+_profile_cache = make_cache(
+    'user_profiles',
+    max_entries=config['user_profile_cache_size'],
+    ttl=config['user_profile_cache_ttl'],
+)
+
+# Usernames being fetched right now, so that concurrent searches share a call
+_in_flight = SingleFlight()
+
+
+def _stats() -> dict:
+    return dict(_profile_cache.stats(), **_in_flight.stats())
+
+
+metrics.register('user_profiles', _stats)
+
 
 def get_user_profiles(usernames: list, auth_token=None):
     """
-    Get a list of workspace IDs that the given username is allowed to access in
-    the workspace.
+    Get the user profiles for a list of usernames, in the same order; a
+    profile is None if the user has none. Only the usernames that are neither
+    cached nor being fetched by another request are fetched upstream.
+    """
+    (profiles, owned, waiting) = _lookup(usernames)
+    if owned:
+        url = config['user_profile_url']
+        try:
+            resp = get_session().post(
+                url=url,
+                data=_payload(owned),
+                headers=_headers(auth_token),
+            )
+            if not resp.ok:
+                raise UserProfileError(url, resp.text)
+            profiles.update(_store(owned, resp.json()['result'][0]))
+        except BaseException as err:
+            _in_flight.fail(owned, err)
+            raise
+    for (username, future) in waiting.items():
+        profiles[username] = future.result(timeout=config['http_timeout'])
+    return [profiles[username] for username in usernames]
+
+
+async def get_user_profiles_async(usernames: list, auth_token=None):
+    """Non-blocking version of `get_user_profiles`."""
+    (profiles, owned, waiting) = await run_io(_lookup, usernames)
+    if owned:
+        url = config['user_profile_url']
+        try:
+            resp = await get_async_client().post(
+                url,
+                content=_payload(owned),
+                headers=_headers(auth_token),
+            )
+            if resp.is_error:
+                raise UserProfileError(url, resp.text)
+            profiles.update(await run_io(_store, owned, resp.json()['result'][0]))
+        except BaseException as err:
+            _in_flight.fail(owned, err)
+            raise
+    for (username, future) in waiting.items():
+        profiles[username] = await asyncio.wrap_future(future)
+    return [profiles[username] for username in usernames]
+
+
+def _lookup(usernames: list) -> tuple:
+    """
+    Returns (profiles, owned, waiting): a dict of the cached profiles, the
+    usernames to fetch, and futures for usernames that another caller is
+    fetching.
     """
-    url = config['user_profile_url']
-    # TODO session cache this
-    # Make a request to the workspace using the user's auth token to find their readable workspace IDs
+    profiles = {}
+    missing = []
+    for username in dict.fromkeys(usernames):
+        profile = _profile_cache.get(username)
+        if profile is MISSING:
+            missing.append(username)
+        else:
+            profiles[username] = profile
+    (owned, waiting) = _in_flight.claim(missing)
+    return (profiles, owned, waiting)
+
+
+def _store(usernames: list, profiles: list) -> dict:
+    """Cache fetched profiles and hand them to any waiting callers."""
+    # Pad a short response, so that no waiting caller is left hanging
+    profiles = profiles + [None] * (len(usernames) - len(profiles))
+    fetched = dict(zip(usernames, profiles))
+    for (username, profile) in fetched.items():
+        if profile is not None:
+            _profile_cache.set(username, profile)
+        _in_flight.resolve(username, profile)
+    return fetched
+
+
+def _payload(usernames: list) -> str:
     payload = {
         'method': 'UserProfile.get_user_profile',
         'version': '1.1',
         'params': [usernames]
     }
+    return json.dumps(payload)
+
+
+def _headers(auth_token) -> dict:
     headers = {}
     if auth_token is not None:
         headers['Authorization'] = auth_token
-    resp = requests.post(
-        url=url,
-        data=json.dumps(payload),
-        headers=headers,
-    )
-    if not resp.ok:
-        raise UserProfileError(url, resp.text)
-    return resp.json()['result'][0]
+    return headers
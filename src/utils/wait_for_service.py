@@ -8,17 +8,26 @@ WAIT_POLL_INTERVAL = 5
 
 
 def wait_for_service(url, name, timeout=DEFAULT_TIMEOUT):
+    """Wait until the service at `url`, or at any one of a list of URLs, responds."""
+    urls = [url] if isinstance(url, str) else list(url)
+    shown = ', '.join(urls)
     start = time.time()
     while True:
-        logger.info(f'Attempting to connect to {name} at {url}')
-        try:
-            requests.get(url, timeout=timeout).raise_for_status()
+        logger.info(f'Attempting to connect to {name} at {shown}')
+        if any(_is_online(each, timeout) for each in urls):
             logger.info(f'{name} is online!')
             break
-        except Exception:
-            logger.info(f'Waiting for {name} at {url}')
-            total_elapsed = time.time() - start
-            if total_elapsed > timeout:
-                logger.error(f'Unable to connect to {name} at {url} after {total_elapsed} seconds')
-                exit(1)
-            time.sleep(WAIT_POLL_INTERVAL)
+        logger.info(f'Waiting for {name} at {shown}')
+        total_elapsed = time.time() - start
+        if total_elapsed > timeout:
+            logger.error(f'Unable to connect to {name} at {shown} after {total_elapsed} seconds')
+            exit(1)
+        time.sleep(WAIT_POLL_INTERVAL)
+
+
+def _is_online(url, timeout) -> bool:
+    try:
+        requests.get(url, timeout=timeout).raise_for_status()
+        return True
+    except Exception:
+        return False
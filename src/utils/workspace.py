@@ -2,68 +2,452 @@
 Workspace user authentication: find workspaces the user can search
 """
 import json
-import requests
+import re
+import threading
+import time
 from typing import Optional
 
+from src.utils import metrics
+from src.utils.cache import MISSING, TTLCache, token_fingerprint
+from src.utils.cache_backends import make_cache, run_io
 from src.utils.config import config
-from src.exceptions import AuthError
+from src.utils.http_client import get_async_client, get_session
+from src.utils.obj_utils import get_path
+from src.utils.refresher import BackgroundRefresher
+from src.utils.ws_id_set import WorkspaceIdSet
+from src.exceptions import AuthError, InvalidToken
+
+# Workspace IDs readable with a token, keyed by (token fingerprint,), plus the
+# public workspace IDs, which are the same for every user, under
+# _PUBLIC_KEY. Per-user entries only hold the private portion
+# (excludeGlobal=1), which is merged with the shared public set on each call.
+# Values are {'ws_ids': encoded WorkspaceIdSet, 'fetched_at': epoch seconds}. Entries are fresh
+# for `ws_auth_cache_ttl` seconds, and may be served stale for another
+# `ws_auth_cache_stale_ttl` seconds while a background refresh runs.
+# Failed lookups for a token are also cached for a short time, as
+# {'auth_error': message}, so that a bad token does not hit the workspace on
+# every request.
+_ws_auth_cache = make_cache(
+    'ws_auth',
+    max_entries=config['ws_auth_cache_size'],
+    ttl=config['ws_auth_cache_ttl'] + config['ws_auth_cache_stale_ttl'],
+    max_bytes=config['ws_auth_cache_max_bytes'],
+)
+metrics.register('ws_auth_cache', _ws_auth_cache.stats)
+
+# Decoded and merged WorkspaceIdSets in this process, so that each cache entry
+# is only decoded once, and the merged set for a user (along with its
+# serialized filter clause) is reused until either part changes.
+_ws_id_sets = TTLCache(
+    'ws_id_sets',
+    max_entries=config['ws_auth_cache_size'],
+    ttl=config['ws_auth_cache_ttl'] + config['ws_auth_cache_stale_ttl'],
+    max_bytes=config['ws_auth_cache_max_bytes'],
+)
+metrics.register('ws_id_sets', _ws_id_sets.stats)
+
+_PUBLIC_KEY = ('public',)
+_PUBLIC_PARAMS = {'perm': 'r', 'onlyGlobal': 1, 'excludeGlobal': 0}
+_PRIVATE_PARAMS = {'perm': 'r', 'onlyGlobal': 0, 'excludeGlobal': 1}
+_EMPTY = WorkspaceIdSet()
+
+# Workspace error messages that mean the token was rejected, such as "Token
+# validation failed" or "Login failed! Server responded with code 401"
+_TOKEN_ERROR = re.compile(r'token|login failed|unauthori[sz]ed', re.IGNORECASE)
+
+
+def _ws_auth_needs_refresh(key) -> bool:
+    """Whether the cached entry for an active user is missing or about to go stale."""
+    cached = _ws_auth_cache.peek(key)
+    if cached is MISSING:
+        return True
+    if 'fetched_at' not in cached:
+        # Cached auth failure
+        return False
+    refresh_at = config['ws_auth_cache_ttl'] - config['ws_auth_refresh_ahead']
+    return time.time() - cached['fetched_at'] >= refresh_at
+
+
+# Keeps the public set and the entries of recently active users fresh in the background
+_ws_auth_refresher = BackgroundRefresher(
+    'ws_auth_refresh',
+    needs_refresh=_ws_auth_needs_refresh,
+    interval=config['ws_auth_refresh_interval'],
+    active_window=config['ws_auth_active_window'],
+    max_tracked=config['ws_auth_cache_size'],
+)
+metrics.register('ws_auth_refresh', _ws_auth_refresher.stats)
+
+
+# Workspace info tuples, keyed by (workspace ID, permission context), as
+# {'info': [...], 'checked_at': epoch seconds}. The context is "public" for
+# infos that are the same for everyone who can read the workspace (user_perm
+# is "n"), so popular public workspaces share one entry; otherwise it is the
+# token fingerprint.
+_ws_info_cache = make_cache(
+    'ws_info',
+    max_entries=config['ws_info_cache_size'],
+    ttl=config['ws_info_cache_max_age'],
+)
+metrics.register('ws_info_cache', _ws_info_cache.stats)
+
+# Public entries are revalidated in bulk: one anonymous list_workspace_info
+# call returns the public workspaces modified since the previous sync, and
+# only entries whose save_date or max_objid differ are replaced. Entries
+# checked after `origin` stay valid while syncs keep succeeding; `after` is
+# the time that the next sync asks for changes since.
+_ws_info_sync = {'origin': None, 'after': None, 'synced_at': None}  # type: dict
+_ws_info_sync_lock = threading.Lock()
+
+# Allowance for clock differences with the workspace server (seconds)
+_SYNC_OVERLAP = 60
+
+_SYNC_KEY = 'ws_info_sync'
+
+# Runs the bulk revalidation while workspace infos are being looked up
+_ws_info_refresher = BackgroundRefresher(
+    'ws_info_sync',
+    needs_refresh=lambda key: _ws_info_sync_due(),
+    interval=config['ws_info_sync_interval'],
+    active_window=config['ws_info_cache_ttl'],
+    max_workers=1,
+)
+metrics.register('ws_info_sync', _ws_info_refresher.stats)
+
+# Called with (name, ws_ids) after the background refresher re-fetches an entry
+_refresh_listeners = []  # type: list
 
 
 def ws_auth(auth_token, only_public=False, only_private=False):
     """
-    Get a list of workspace IDs that the given username is allowed to access in
-    the workspace.
+    Get the set of workspace IDs that the given username is allowed to access
+    in the workspace, as a WorkspaceIdSet.
     """
-    # TODO session cache this
-    # Make a request to the workspace using the user's auth token to find their
-    # readable workspace IDs
-    params = {
-        'perm': 'r'
-    }
+    return _merge_ws_ids(ws_auth_parts(auth_token, only_public, only_private))
+
+
+async def ws_auth_async(auth_token, only_public=False, only_private=False):
+    """Non-blocking version of `ws_auth`."""
+    return _merge_ws_ids(await ws_auth_parts_async(auth_token, only_public, only_private))
+
+
+def ws_auth_parts(auth_token, only_public=False, only_private=False) -> list:
+    """
+    The parts that make up `ws_auth` as a list of (name, WorkspaceIdSet)
+    pairs: the public workspaces, named "public", and the private workspaces
+    of the token, named by the token's fingerprint. A name always refers to
+    the same user (or to everyone), though its set changes over time.
+    """
+    _check_access_flags(only_public, only_private)
+    parts = []
+    if not only_private:
+        parts.append((_PUBLIC_KEY, _get_ws_ids(_PUBLIC_KEY, _PUBLIC_PARAMS, None)))
+    # Anonymous users have no private workspaces
+    if not only_public and auth_token is not None:
+        # Make a request to the workspace using the user's auth token to find their
+        # readable private workspace IDs
+        key = _ws_auth_key(auth_token)
+        parts.append((key, _get_ws_ids(key, _PRIVATE_PARAMS, auth_token)))
+    return [(key[0], ws_ids) for (key, ws_ids) in parts]
 
-    if only_public:
-        if only_private:
-            raise Exception('Only one of "only_public" or "only_private" may be set')
-        params['onlyGlobal'] = 1
-        params['excludeGlobal'] = 0
-    elif only_private:
-        params['onlyGlobal'] = 0
-        params['excludeGlobal'] = 1
-    else:
-        params['onlyGlobal'] = 0
-        params['excludeGlobal'] = 0
 
-    result = _req('list_workspace_ids', params, auth_token)
-    return result.get('workspaces', []) + result.get('pub', [])
+async def ws_auth_parts_async(auth_token, only_public=False, only_private=False) -> list:
+    """Non-blocking version of `ws_auth_parts`."""
+    _check_access_flags(only_public, only_private)
+    parts = []
+    if not only_private:
+        parts.append((_PUBLIC_KEY, await _get_ws_ids_async(_PUBLIC_KEY, _PUBLIC_PARAMS, None)))
+    if not only_public and auth_token is not None:
+        key = _ws_auth_key(auth_token)
+        parts.append((key, await _get_ws_ids_async(key, _PRIVATE_PARAMS, auth_token)))
+    return [(key[0], ws_ids) for (key, ws_ids) in parts]
+
+
+def select_ws_auth_parts(parts: list, only_public=False, only_private=False) -> list:
+    """
+    Pick, from the parts returned by `ws_auth_parts(token)` with neither flag
+    set, the parts that it would return with the given flags, so that
+    searches with different flags can share one lookup.
+    """
+    _check_access_flags(only_public, only_private)
+    selected = []
+    for (name, ws_ids) in parts:
+        is_public = name == _PUBLIC_KEY[0]
+        if (is_public and not only_private) or (not is_public and not only_public):
+            selected.append((name, ws_ids))
+    return selected
+
+
+def merge_ws_auth_parts(parts: list) -> WorkspaceIdSet:
+    """The union of the sets in `parts`, which is what `ws_auth` returns for them."""
+    return _merge_ws_ids(parts)
+
+
+def add_refresh_listener(listener):
+    """
+    Call `listener(name, ws_ids)`, with a name as in `ws_auth_parts`, each
+    time the background refresher re-fetches a set. It runs on the
+    refresher's threads, so it may block.
+    """
+    _refresh_listeners.append(listener)
 
 
 def get_workspace_info(workspace_id, auth_token=None):
     """
     Given a workspace id, return the associated workspace info
+    The returned list may be shared with other callers, so do not mutate it.
     """
-    # TODO session cache this
+    _ws_info_refresher.track(_SYNC_KEY, _sync_public_ws_infos)
+    key = _ws_info_key(workspace_id, auth_token)
+    info = _get_cached_ws_info(key)
+    if info is not MISSING:
+        return info
     params = {'id': workspace_id}
-    return _req('get_workspace_info', params, auth_token)
+    info = _req('get_workspace_info', params, auth_token)
+    _cache_ws_info(workspace_id, info, auth_token)
+    return info
+
+
+async def get_workspace_info_async(workspace_id, auth_token=None):
+    """Non-blocking version of `get_workspace_info`."""
+    _ws_info_refresher.track(_SYNC_KEY, _sync_public_ws_infos)
+    key = await run_io(_ws_info_key, workspace_id, auth_token)
+    info = await run_io(_get_cached_ws_info, key)
+    if info is not MISSING:
+        return info
+    params = {'id': workspace_id}
+    info = await _req_async('get_workspace_info', params, auth_token)
+    await run_io(_cache_ws_info, workspace_id, info, auth_token)
+    return info
+
+
+def _check_access_flags(only_public, only_private):
+    if only_public and only_private:
+        raise Exception('Only one of "only_public" or "only_private" may be set')
+
+
+def _ws_auth_key(auth_token) -> tuple:
+    return (token_fingerprint(auth_token),)
+
+
+def _get_ws_ids(key, params, auth_token) -> WorkspaceIdSet:
+    """Return the cached workspace IDs for `key`, fetching them on a miss."""
+    _track_ws_auth(key, params, auth_token)
+    ws_ids = _get_cached_ws_ids(key)
+    if ws_ids is not MISSING:
+        return ws_ids
+    return _fetch_ws_ids(key, params, auth_token)
+
+
+async def _get_ws_ids_async(key, params, auth_token) -> WorkspaceIdSet:
+    _track_ws_auth(key, params, auth_token)
+    ws_ids = await run_io(_get_cached_ws_ids, key)
+    if ws_ids is not MISSING:
+        return ws_ids
+    try:
+        result = await _req_async('list_workspace_ids', params, auth_token)
+    except AuthError as err:
+        await run_io(_cache_auth_error, key, auth_token, err)
+        raise
+    return await run_io(_cache_ws_ids, key, result)
+
+
+def _merge_ws_ids(parts: list) -> WorkspaceIdSet:
+    """Union of the sets from `ws_auth_parts`."""
+    sets = [ws_ids for (_, ws_ids) in parts if ws_ids]
+    if len(sets) < 2:
+        return sets[0] if sets else _EMPTY
+    memo_key = ('merged',) + tuple(ws_ids.serial for ws_ids in sets)
+    merged = _ws_id_sets.get(memo_key)
+    if merged is MISSING:
+        merged = sets[0]
+        for ws_ids in sets[1:]:
+            merged = merged.union(ws_ids)
+        _ws_id_sets.set(memo_key, merged)
+    return merged
+
+
+def _track_ws_auth(key, params, auth_token):
+    """Register the key as active, so its entry is refreshed in the background."""
+    _ws_auth_refresher.track(key, lambda: _refresh_ws_ids(key, params, auth_token))
+
+
+def _refresh_ws_ids(key, params, auth_token):
+    """Re-fetch an entry in the background and tell the listeners about it."""
+    ws_ids = _fetch_ws_ids(key, params, auth_token)
+    for listener in _refresh_listeners:
+        listener(key[0], ws_ids)
+
+
+def _fetch_ws_ids(key, params, auth_token) -> WorkspaceIdSet:
+    """Fetch the workspace IDs from the workspace and cache them."""
+    try:
+        result = _req('list_workspace_ids', params, auth_token)
+    except AuthError as err:
+        _cache_auth_error(key, auth_token, err)
+        raise
+    return _cache_ws_ids(key, result)
+
+
+def _ws_info_key(workspace_id, auth_token) -> tuple:
+    """
+    The cache key for a workspace info lookup. A user gets the public entry
+    for workspaces outside of their (cached) private set, since they have no
+    permissions of their own there.
+    """
+    if auth_token is not None:
+        private_ids = _peek_ws_ids(_ws_auth_key(auth_token))
+        if private_ids is None or workspace_id in private_ids:
+            return (workspace_id, token_fingerprint(auth_token))
+    return (workspace_id, 'public')
+
+
+def _get_cached_ws_info(key):
+    cached = _ws_info_cache.get(key)
+    if cached is MISSING:
+        return MISSING
+    now = time.time()
+    if now - cached['checked_at'] < config['ws_info_cache_ttl']:
+        return cached['info']
+    if key[1] == 'public':
+        with _ws_info_sync_lock:
+            (origin, synced_at) = (_ws_info_sync['origin'], _ws_info_sync['synced_at'])
+        if origin is not None and cached['checked_at'] >= origin \
+                and now - synced_at < config['ws_info_cache_ttl']:
+            return cached['info']
+    return MISSING
+
+
+def _cache_ws_info(workspace_id, info: list, auth_token):
+    [_, _, _, _, _, user_perm, global_perm, _, _] = info
+    if auth_token is None or (user_perm == 'n' and global_perm != 'n'):
+        context = 'public'
+    else:
+        context = token_fingerprint(auth_token)
+    _ws_info_cache.set((workspace_id, context), {'info': info, 'checked_at': time.time()})
+
+
+def _ws_info_sync_due() -> bool:
+    with _ws_info_sync_lock:
+        synced_at = _ws_info_sync['synced_at']
+    return synced_at is None or time.time() - synced_at >= config['ws_info_sync_interval']
+
+
+def _sync_public_ws_infos():
+    """Replace the cached public workspace infos that changed since the last sync."""
+    started_at = time.time()
+    with _ws_info_sync_lock:
+        after = _ws_info_sync['after']
+        synced_at = _ws_info_sync['synced_at']
+    restart = after is None or started_at - synced_at >= config['ws_info_cache_max_age']
+    if restart:
+        # Covers every entry that is still valid by its own age
+        after = started_at - config['ws_info_cache_ttl']
+    params = {'after_epoch': int((after - _SYNC_OVERLAP) * 1000)}
+    infos = _req('list_workspace_info', params, None)
+    for info in infos:
+        key = (info[0], 'public')
+        cached = _ws_info_cache.peek(key)
+        # Compare save_date and max_objid
+        if cached is not MISSING and cached['info'][3:5] != info[3:5]:
+            _cache_ws_info(info[0], info, None)
+    with _ws_info_sync_lock:
+        if restart:
+            _ws_info_sync['origin'] = after
+        _ws_info_sync['after'] = started_at
+        _ws_info_sync['synced_at'] = started_at
+
+
+def _peek_ws_ids(key) -> Optional[WorkspaceIdSet]:
+    """The cached workspace IDs for `key`, without counting a lookup; None if not cached."""
+    cached = _ws_auth_cache.peek(key)
+    if cached is MISSING or 'ws_ids' not in cached:
+        return None
+    return _decode_ws_ids(key, cached)
+
+
+def _get_cached_ws_ids(key):
+    """
+    Return cached workspace IDs or MISSING; raise AuthError for a cached failure.
+    Stale IDs are returned as-is, and a background refresh is started for them.
+    """
+    cached = _ws_auth_cache.get(key)
+    if cached is MISSING:
+        return MISSING
+    if 'auth_error' in cached:
+        raise AuthError(None, cached['auth_error'])
+    if time.time() - cached['fetched_at'] >= config['ws_auth_cache_ttl']:
+        _ws_auth_refresher.refresh(key)
+    return _decode_ws_ids(key, cached)
+
+
+def _decode_ws_ids(key, cached: dict) -> WorkspaceIdSet:
+    """Decode a cache entry, once per entry in this process."""
+    memo_key = ('decoded', key, cached['fetched_at'])
+    ws_ids = _ws_id_sets.get(memo_key)
+    if ws_ids is MISSING:
+        ws_ids = WorkspaceIdSet.decode(cached['ws_ids'])
+        ws_ids.fetched_at = cached['fetched_at']
+        _ws_id_sets.set(memo_key, ws_ids)
+    return ws_ids
+
+
+def _cache_ws_ids(key, result: dict) -> WorkspaceIdSet:
+    ws_ids = WorkspaceIdSet(result.get('workspaces', []) + result.get('pub', []))
+    fetched_at = time.time()
+    ws_ids.fetched_at = fetched_at
+    _ws_auth_cache.set(key, {'ws_ids': ws_ids.encode(), 'fetched_at': fetched_at})
+    _ws_id_sets.set(('decoded', key, fetched_at), ws_ids)
+    return ws_ids
+
+
+def _cache_auth_error(key, auth_token, err: AuthError):
+    # Other failures, and any failure without a token, mean that the
+    # workspace itself is in trouble
+    if auth_token is not None and isinstance(err, InvalidToken):
+        _ws_auth_cache.set(key, {'auth_error': err.message}, ttl=config['ws_auth_cache_error_ttl'])
+        _ws_auth_refresher.untrack(key)
 
 
 def _req(method: str, params: dict, token: Optional[str]):
     """Make a generic workspace http/rpc request"""
+    resp = get_session().post(
+        url=config['workspace_url'],
+        headers=_headers(token),
+        data=_payload(method, params),
+    )
+    return _handle_resp(resp, resp.ok)
+
+
+async def _req_async(method: str, params: dict, token: Optional[str]):
+    """Make a generic workspace http/rpc request without blocking the event loop"""
+    resp = await get_async_client().post(
+        config['workspace_url'],
+        headers=_headers(token),
+        content=_payload(method, params),
+    )
+    return _handle_resp(resp, not resp.is_error)
+
+
+def _payload(method: str, params: dict) -> str:
     payload = {
         'method': 'Workspace.' + method,
         'version': '1.1',
         'id': 0,
         'params': [params],
     }
+    return json.dumps(payload)
+
 
+def _headers(token: Optional[str]) -> dict:
     headers = {}
     if token is not None:
         headers['Authorization'] = token
+    return headers
 
-    resp = requests.post(
-        url=config['workspace_url'],
-        headers=headers,
-        data=json.dumps(payload),
-    )
+
+def _handle_resp(resp, ok: bool):
+    """Extract the result from a workspace response; works for requests and httpx."""
     resp_json = None
     result = None
     try:
@@ -71,6 +455,17 @@ def _req(method: str, params: dict, token: Optional[str]):
         resp_json = resp.json()
     except json.decoder.JSONDecodeError:
         pass
-    if not resp.ok or not result or len(result) == 0:
+    if not ok or not result or len(result) == 0:
+        if _token_rejected(resp.status_code, resp_json):
+            raise InvalidToken(resp_json, resp.text)
         raise AuthError(resp_json, resp.text)
     return result[0]
+
+
+def _token_rejected(status: int, resp_json) -> bool:
+    """Whether a failed workspace response rejects the token, as opposed to an outage."""
+    if status in (401, 403):
+        return True
+    # The workspace reports token errors as JSON-RPC errors with a 500 status
+    message = get_path(resp_json, ['error', 'message']) if isinstance(resp_json, dict) else None
+    return isinstance(message, str) and _TOKEN_ERROR.search(message) is not None
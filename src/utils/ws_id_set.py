@@ -0,0 +1,139 @@
+"""
+Compact sets of workspace IDs for access control.
+
+`WorkspaceIdSet` keeps the IDs in a sorted array of 64-bit integers, which
+takes 8 bytes per ID instead of the ~36 bytes per ID of a list of Python ints.
+Sets are immutable, so the values derived from them (the encoded form stored
+in the caches and the serialized `terms` filter for Elasticsearch) are
+computed once and kept on the instance.
+"""
+import base64
+import itertools
+import json
+import operator
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Optional
+
+# Used to tell instances apart in memo keys; never reused within a process
+_serials = itertools.count()
+
+# Array type codes for the gaps between IDs in the encoded form, smallest first
+_GAP_TYPES = ('B', 'H', 'I', 'q')
+
+
+class WorkspaceIdSet:
+    __slots__ = ('serial', 'fetched_at', '_ids', '_encoded', '_terms')
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._init(array('q', sorted(set(ids))))
+
+    @classmethod
+    def of(cls, ids) -> 'WorkspaceIdSet':
+        """Return `ids` if it is already a set, or build one from an iterable."""
+        if isinstance(ids, cls):
+            return ids
+        return cls(ids)
+
+    @classmethod
+    def decode(cls, encoded: str) -> 'WorkspaceIdSet':
+        """Inverse of `encode`."""
+        ids = array('q')
+        if encoded:
+            data = base64.b64decode(encoded[1:])
+            first = array('q')
+            first.frombytes(data[:first.itemsize])
+            gaps = array(encoded[0])
+            gaps.frombytes(data[first.itemsize:])
+            if sys.byteorder == 'big':
+                first.byteswap()
+                gaps.byteswap()
+            ids = array('q', itertools.accumulate(itertools.chain(first, gaps)))
+        ws_ids = cls.__new__(cls)
+        ws_ids._init(ids)
+        ws_ids._encoded = encoded
+        return ws_ids
+
+    def _init(self, ids: array):
+        self.serial = next(_serials)
+        # When the workspace listed the set (epoch seconds), for the sets
+        # behind `ws_auth_parts`; None for sets built in this process
+        self.fetched_at: Optional[float] = None
+        self._ids = ids
+        self._encoded: Optional[str] = None
+        self._terms = {}  # type: dict
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, ws_id) -> bool:
+        idx = bisect_left(self._ids, ws_id)
+        return idx < len(self._ids) and self._ids[idx] == ws_id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, WorkspaceIdSet) and self._ids == other._ids
+
+    def __hash__(self) -> int:
+        return hash(self._ids.tobytes())
+
+    def __repr__(self) -> str:
+        return f"WorkspaceIdSet({self._ids.tolist()})"
+
+    def __sizeof__(self) -> int:
+        size = object.__sizeof__(self) + sys.getsizeof(self._ids)
+        if self._encoded is not None:
+            size += sys.getsizeof(self._encoded)
+        return size + sum(sys.getsizeof(terms) for terms in self._terms.values())
+
+    def union(self, other: 'WorkspaceIdSet') -> 'WorkspaceIdSet':
+        if not other._ids or other._ids == self._ids:
+            return self
+        if not self._ids:
+            return other
+        return WorkspaceIdSet(itertools.chain(self._ids, other._ids))
+
+    def intersection(self, ids: Iterable[int]) -> 'WorkspaceIdSet':
+        """The IDs in this set that are also in `ids`, such as an explicit workspace filter."""
+        return WorkspaceIdSet(ws_id for ws_id in set(ids) if ws_id in self)
+
+    def to_list(self) -> list:
+        return self._ids.tolist()
+
+    def encode(self) -> str:
+        """
+        A compact, JSON-safe form for the shared caches: the type code of the
+        gaps, then the base64 of the first ID and the gaps between sorted IDs,
+        as little-endian integers of the smallest width that fits every gap.
+        Workspace IDs are dense, so this is usually about 1-2 bytes per ID.
+        """
+        if self._encoded is None:
+            # Built in a local first, since other threads may read `_encoded`
+            encoded = ''
+            if self._ids:
+                first = array('q', self._ids[:1])
+                gaps = list(map(operator.sub, self._ids[1:], self._ids[:-1]))
+                max_gap = max(gaps, default=0)
+                for typecode in _GAP_TYPES:
+                    packed = array(typecode)
+                    if typecode == 'q' or max_gap < 2 ** (8 * packed.itemsize):
+                        break
+                packed.extend(gaps)
+                if sys.byteorder == 'big':
+                    first.byteswap()
+                    packed.byteswap()
+                data = first.tobytes() + packed.tobytes()
+                encoded = typecode + base64.b64encode(data).decode('ascii')
+            self._encoded = encoded
+        return self._encoded
+
+    def terms_json(self, field: str) -> str:
+        """The serialized Elasticsearch `terms` clause matching `field` against this set."""
+        terms = self._terms.get(field)
+        if terms is None:
+            terms = json.dumps({'terms': {field: self._ids.tolist()}})
+            self._terms[field] = terms
+        return terms
@@ -1,5 +1,8 @@
 # content of a/conftest.py
 import pytest
+from unittest.mock import patch
+
+from src.utils.config import config
 from tests.helpers.unit_setup import (
     start_service,
     stop_service
@@ -16,3 +19,10 @@ def services():
     init_elasticsearch()
     yield {'app_url': APP_URL}
     stop_service()
+
+
+@pytest.fixture(autouse=True)
+def no_search_cache():
+    """Searches go to Elasticsearch, unless a test turns the result or count cache on."""
+    with patch.dict(config, {'search_cache_ttl': 0, 'count_cache_ttl': 0}):
+        yield
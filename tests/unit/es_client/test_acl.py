@@ -0,0 +1,162 @@
+import json
+import pytest
+import responses
+import time
+from unittest.mock import patch
+
+from src.es_client import acl
+from src.es_client import search
+from src.exceptions import ElasticsearchError
+from src.utils.config import config
+from src.utils.ws_id_set import WorkspaceIdSet
+from tests.unit.mocks.async_client import mock_async_client, run_with_client
+
+_ACL_URL = config['elasticsearch_url'] + '/' + config['acl_index']
+
+_ES_RESP = {
+    'took': 3,
+    'hits': {'total': {'value': 0}, 'hits': []},
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_stored():
+    acl._stored.clear()
+    yield
+
+
+def _lookup(name):
+    return {'terms': {'access_group': {'index': config['acl_index'], 'id': name, 'path': 'ws_ids'}}}
+
+
+@responses.activate
+def test_lookup_filter_stores_once():
+    responses.add(responses.PUT, _ACL_URL + '/_doc/public', json={}, status=201)
+    responses.add(responses.PUT, _ACL_URL + '/_doc/abc', json={}, status=201)
+    parts = [('public', WorkspaceIdSet([10, 11])), ('abc', WorkspaceIdSet([1]))]
+    clause = json.loads(acl.lookup_filter(parts))
+    assert clause == {'bool': {'should': [_lookup('public'), _lookup('abc')], 'minimum_should_match': 1}}
+    assert json.loads(responses.calls[0].request.body)['ws_ids'] == [10, 11]
+    assert json.loads(responses.calls[1].request.body)['ws_ids'] == [1]
+    # Unchanged sets are not stored again
+    acl.lookup_filter(parts)
+    assert len(responses.calls) == 2
+    # A changed set is
+    acl.lookup_filter([('abc', WorkspaceIdSet([1, 2]))])
+    assert len(responses.calls) == 3
+    assert json.loads(responses.calls[2].request.body)['ws_ids'] == [1, 2]
+
+
+@responses.activate
+def test_lookup_filter_empty_parts():
+    # Empty sets are left out of the filter, and nothing at all matches no workspaces
+    responses.add(responses.PUT, _ACL_URL + '/_doc/public', json={}, status=201)
+    clause = json.loads(acl.lookup_filter([('public', WorkspaceIdSet([10])), ('abc', WorkspaceIdSet())]))
+    assert clause == _lookup('public')
+    assert json.loads(acl.lookup_filter([('abc', WorkspaceIdSet())])) == {'terms': {'access_group': []}}
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_lookup_filter_store_error():
+    responses.add(responses.PUT, _ACL_URL + '/_doc/public', body='oops', status=500)
+    with pytest.raises(ElasticsearchError):
+        acl.lookup_filter([('public', WorkspaceIdSet([10]))])
+    # Stored again on the next search
+    with pytest.raises(ElasticsearchError):
+        acl.lookup_filter([('public', WorkspaceIdSet([10]))])
+
+
+def test_lookup_filter_async():
+    client = mock_async_client(lambda request: (201, {}, '{}'))
+    with patch('src.es_client.acl.get_async_client', return_value=client):
+        clause = run_with_client(client, acl.lookup_filter_async([('public', WorkspaceIdSet([10]))]))
+    assert json.loads(clause) == _lookup('public')
+    assert client.calls[0].method == 'PUT'
+    assert client.calls[0].path_url == '/' + config['acl_index'] + '/_doc/public'
+    assert json.loads(client.calls[0].body)['ws_ids'] == [10]
+
+
+@responses.activate
+def test_store_versioned():
+    """Sets are written with the time that they were fetched, and a newer stored set is kept"""
+    responses.add(responses.PUT, _ACL_URL + '/_doc/abc', json={'error': {'type': 'version_conflict_engine_exception'}},
+                  status=409)
+    ws_ids = WorkspaceIdSet([1])
+    ws_ids.fetched_at = 1600000000.5
+    acl.lookup_filter([('abc', ws_ids)])
+    assert responses.calls[0].request.params == {'version': '1600000000500', 'version_type': 'external_gte'}
+    # Not written again
+    acl.lookup_filter([('abc', ws_ids)])
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_sweep():
+    responses.add(responses.POST, _ACL_URL + '/_delete_by_query', json={'deleted': 2}, status=200)
+    with patch.dict(config, {'acl_doc_max_age': 86400}):
+        acl.sweep()
+    body = json.loads(responses.calls[0].request.body)
+    assert body['query']['range']['stored_at']['lt'] < time.time() - 86000
+    assert responses.calls[0].request.params == {'conflicts': 'proceed'}
+    # Never so soon that documents in use could be deleted
+    with patch.dict(config, {'acl_doc_max_age': 0}):
+        acl.sweep()
+    body = json.loads(responses.calls[1].request.body)
+    assert body['query']['range']['stored_at']['lt'] <= time.time() - 2 * acl._stored.ttl
+    responses.replace(responses.POST, _ACL_URL + '/_delete_by_query', body='oops', status=500)
+    with pytest.raises(ElasticsearchError):
+        acl.sweep()
+
+
+@responses.activate
+def test_refresh_rewrites_stored_doc():
+    responses.add(responses.PUT, _ACL_URL + '/_doc/abc', json={}, status=201)
+    # Sets that this process has not stored are ignored
+    acl._on_refresh('abc', WorkspaceIdSet([1]))
+    assert len(responses.calls) == 0
+    acl.lookup_filter([('abc', WorkspaceIdSet([1]))])
+    acl._on_refresh('abc', WorkspaceIdSet([1]))
+    assert len(responses.calls) == 1
+    acl._on_refresh('abc', WorkspaceIdSet([1, 2]))
+    assert len(responses.calls) == 2
+    assert json.loads(responses.calls[1].request.body)['ws_ids'] == [1, 2]
+
+
+@responses.activate
+def test_ensure_index():
+    responses.add(responses.PUT, _ACL_URL, json={'acknowledged': True}, status=200)
+    acl.ensure_index()
+    body = json.loads(responses.calls[0].request.body)
+    assert body['mappings']['dynamic'] is False
+    # Another worker created it first
+    responses.replace(responses.PUT, _ACL_URL, json={'error': {'type': 'resource_already_exists_exception'}},
+                      status=400)
+    acl.ensure_index()
+    responses.replace(responses.PUT, _ACL_URL, body='oops', status=500)
+    with pytest.raises(ElasticsearchError):
+        acl.ensure_index()
+
+
+@responses.activate
+def test_search_lookup_mode():
+    responses.add(responses.PUT, _ACL_URL + '/_doc/public', json={}, status=201)
+    responses.add(responses.POST, config['elasticsearch_url'] + '/test.index1/_search', json=_ES_RESP, status=200)
+    with patch.dict(config, {'access_filter_mode': 'lookup'}), \
+            patch('src.es_client.query.ws_auth_parts') as mocked_auth:
+        mocked_auth.return_value = [('public', WorkspaceIdSet([0, 1]))]
+        search({'indexes': ['index1']}, {'auth': None})
+    body = json.loads(responses.calls[1].request.body)
+    assert body['query']['bool']['filter'] == [_lookup('public')]
+
+
+@responses.activate
+def test_search_lookup_mode_explicit_workspaces():
+    # Queries restricted to a few workspaces list them inline
+    responses.add(responses.POST, config['elasticsearch_url'] + '/test.index1/_search', json=_ES_RESP, status=200)
+    with patch.dict(config, {'access_filter_mode': 'lookup'}), \
+            patch('src.es_client.query.ws_auth') as mocked_auth:
+        mocked_auth.return_value = WorkspaceIdSet([0, 1])
+        search({'indexes': ['index1'], 'filter_ws_ids': [1]}, {'auth': None})
+    body = json.loads(responses.calls[0].request.body)
+    assert body['query']['bool']['filter'] == [{'terms': {'access_group': [1]}}]
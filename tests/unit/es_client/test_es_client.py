@@ -1,14 +1,32 @@
+import asyncio
 import json
 import pytest
 import responses
+import threading
+import time
 
 # For mocking workspace calls
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from src.utils.config import config
-from src.exceptions import UnknownIndex
-from src.es_client import search
-from src.exceptions import ElasticsearchError
+from src.exceptions import InvalidCursor, UnknownIndex
+from src.es_client import query as search_query
+from src.es_client import result_cache
+from src.es_client import count, count_async, msearch, msearch_async, search, search_async
+from src.es_client.query import _ACCESS_FILTER_PLACEHOLDER
+from src.utils.ws_id_set import WorkspaceIdSet
+from src.exceptions import ElasticsearchError, ResponseError
+from tests.unit.mocks.async_client import mock_async_client, run_with_client
+
+_ES_RESP = {
+    'took': 3,
+    'hits': {
+        'total': {'value': 1},
+        'hits': [
+            {'_index': 'test.index1_1', '_id': 'doc1', '_source': {'name': 'doc1'}},
+        ],
+    },
+}
 
 
 def test_search_public_valid(services):
@@ -32,6 +50,21 @@ def test_search_public_valid(services):
         assert docs == expected
 
 
+def test_search_cursor_services(services):
+    """Paging through every public document with a cursor, against Elasticsearch"""
+    with patch('src.es_client.query.ws_auth') as mocked:
+        mocked.return_value = [0, 1]  # Public workspaces
+        params = {'only_public': True, 'size': 3, 'cursor': '*'}
+        first = search(params, {'auth': None})
+        assert len(first['hits']) == 3
+        assert first['cursor'] is not None
+        second = search(dict(params, cursor=first['cursor']), {'auth': None})
+    assert len(second['hits']) == 1
+    assert second['cursor'] is None
+    docs = {(doc['index'], doc['id']) for doc in first['hits'] + second['hits']}
+    assert len(docs) == 4
+
+
 def test_search_query_valid(services):
     with patch('src.es_client.query.ws_auth') as mocked:
         mocked.return_value = [0, 1]  # Public workspaces
@@ -152,6 +185,19 @@ def test_search_private_valid(services):
         assert is_public == {False}
 
 
+def test_search_shares_ws_auth_in_request(services):
+    with patch('src.es_client.query.ws_auth') as mocked:
+        mocked.return_value = [100]
+        meta = {'auth': 'x'}
+        search({'only_private': True}, meta)
+        search({'only_private': True, 'query': {'term': {'name': 'x'}}}, meta)
+        search({}, meta)
+        # Once for each pair of flags in the request
+        assert mocked.call_count == 2
+        search({'only_private': True}, {'auth': 'x'})
+        assert mocked.call_count == 3
+
+
 def test_search_private_no_access(services):
     with patch('src.es_client.query.ws_auth') as mocked:
         mocked.return_value = [55]  # A workspace which is not indexed
@@ -210,3 +256,482 @@ def test_es_response_error_default(services):
         responses.add(responses.POST, url, body=json.dumps(error_response), status=500)
         with pytest.raises(ElasticsearchError):
             search({}, {'auth': None})
+
+
+def test_search_async_valid():
+    client = mock_async_client(lambda request: (200, {}, json.dumps(_ES_RESP)))
+    with patch('src.es_client.query.ws_auth_async') as mocked_auth, \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        async def ws_ids(*args):
+            return [0, 1]
+        mocked_auth.side_effect = ws_ids
+        result = run_with_client(client, search_async({'indexes': ['index1']}, {'auth': None}))
+    assert result == {
+        'count': 1,
+        'hits': [{'index': 'index1_1', 'id': 'doc1', 'doc': {'name': 'doc1'}}],
+        'search_time': 3,
+        'aggregations': {},
+    }
+    req = client.calls[0]
+    assert req.path_url == '/test.index1/_search?allow_no_indices=true&filter_path=' + search_query._SEARCH_FILTER_PATH
+    assert json.loads(req.body)['query']['bool']['filter'] == [{'terms': {'access_group': [0, 1]}}]
+
+
+def test_search_async_shares_ws_auth_in_request():
+    client = mock_async_client(lambda request: (200, {}, json.dumps(_ES_RESP)))
+    with patch('src.es_client.query.ws_auth_async') as mocked_auth, \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        async def ws_ids(*args):
+            await asyncio.sleep(0.01)
+            return [0, 1]
+        mocked_auth.side_effect = ws_ids
+
+        async def run():
+            meta = {'auth': 'x'}
+            return await asyncio.gather(*[search_async({'indexes': ['index1'], 'size': size}, meta)
+                                          for size in (1, 2, 3)])
+        results = run_with_client(client, run())
+    assert len(results) == 3
+    assert mocked_auth.call_count == 1
+
+
+def test_search_async_unknown_index():
+    error_response = {
+        'error': {
+            'reason': 'no such index [test.xyz]',
+            'root_cause': [{'type': 'index_not_found_exception'}],
+        }
+    }
+    client = mock_async_client(lambda request: (404, {}, json.dumps(error_response)))
+    with patch('src.es_client.query.ws_auth_async') as mocked_auth, \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        async def ws_ids(*args):
+            return [0, 1]
+        mocked_auth.side_effect = ws_ids
+        with pytest.raises(UnknownIndex):
+            run_with_client(client, search_async({'indexes': ['xyz']}, {'auth': None}))
+
+
+@responses.activate
+def test_search_filter_ws_ids():
+    """The access filter only lists the authorized workspaces that the query is restricted to"""
+    responses.add(responses.POST,
+                  config['elasticsearch_url'] + '/test.index1/_search',
+                  json=_ES_RESP,
+                  status=200)
+    with patch('src.es_client.query.ws_auth') as mocked_auth:
+        mocked_auth.return_value = WorkspaceIdSet([0, 1, 2])
+        search({'indexes': ['index1'], 'filter_ws_ids': [1, 2, 5]}, {'auth': None})
+    body = json.loads(responses.calls[0].request.body)
+    assert body['query']['bool']['filter'] == [{'terms': {'access_group': [1, 2]}}]
+
+
+@responses.activate
+def test_search_access_filter_placeholder_in_query():
+    """A user query that looks like the access filter placeholder is left alone"""
+    responses.add(responses.POST,
+                  config['elasticsearch_url'] + '/test.index1/_search',
+                  json=_ES_RESP,
+                  status=200)
+    user_query = {'term': {'name': _ACCESS_FILTER_PLACEHOLDER}}
+    with patch('src.es_client.query.ws_auth') as mocked_auth:
+        mocked_auth.return_value = WorkspaceIdSet([0])
+        search({'indexes': ['index1'], 'query': user_query}, {'auth': None})
+    body = json.loads(responses.calls[0].request.body)
+    assert body['query']['bool']['filter'] == [{'terms': {'access_group': [0]}}]
+    assert body['query']['bool']['must'] == user_query
+
+
+def _slow_session(status=200, body=json.dumps(_ES_RESP)):
+    """A session whose searches take long enough for concurrent ones to overlap."""
+    def post(*args, **kwargs):
+        time.sleep(0.1)
+        return MagicMock(ok=status < 400, status_code=status, text=body, json=lambda: json.loads(body))
+    session = MagicMock()
+    session.post.side_effect = post
+    return session
+
+
+def _search_concurrently(params_list):
+    results = []
+    errors = []
+
+    def run(params, ws_ids):
+        try:
+            with patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet(ws_ids)):
+                results.append(search(params, {'auth': None}))
+        except Exception as err:
+            errors.append(err)
+    threads = [threading.Thread(target=run, args=args) for args in params_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (results, errors)
+
+
+def test_search_coalesced():
+    """Identical concurrent searches share one Elasticsearch request"""
+    session = _slow_session()
+    with patch('src.es_client.query.get_session', return_value=session):
+        (results, errors) = _search_concurrently([
+            ({'indexes': ['index1'], 'query': {'term': {'a': 1}, 'match': {'b': 2}}}, [0, 1]),
+            ({'indexes': ['index1'], 'query': {'match': {'b': 2}, 'term': {'a': 1}}}, [0, 1]),
+            ({'indexes': ['index1'], 'query': {'term': {'a': 1}, 'match': {'b': 2}}}, [0, 1]),
+        ])
+    assert errors == []
+    assert session.post.call_count == 1
+    assert len(results) == 3
+    assert results[0] == results[1] == results[2]
+    # Each caller gets its own copy of the results
+    assert results[0]['hits'][0] is not results[1]['hits'][0]
+
+
+def test_search_not_coalesced_across_workspaces():
+    """Searches over different authorized workspaces are not shared"""
+    session = _slow_session()
+    with patch('src.es_client.query.get_session', return_value=session):
+        (results, errors) = _search_concurrently([
+            ({'indexes': ['index1']}, [0, 1]),
+            ({'indexes': ['index1']}, [0, 1, 2]),
+        ])
+    assert errors == []
+    assert session.post.call_count == 2
+
+
+def test_search_coalesced_error():
+    """An error is passed on to every caller sharing the request"""
+    session = _slow_session(status=500, body='oops')
+    with patch('src.es_client.query.get_session', return_value=session):
+        (results, errors) = _search_concurrently([({'indexes': ['index1']}, [0])] * 3)
+    assert session.post.call_count == 1
+    assert len(errors) == 3
+    assert all(isinstance(err, ElasticsearchError) for err in errors)
+
+
+def test_search_retried():
+    """A search that Elasticsearch turns away for a moment is sent again"""
+    rejected = MagicMock(ok=False, status_code=429, headers={}, text='{}')
+    accepted = MagicMock(ok=True, status_code=200, text=json.dumps(_ES_RESP))
+    session = MagicMock()
+    session.post.side_effect = [rejected, accepted]
+    with patch('src.es_client.query.get_session', return_value=session), \
+            patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet([0])), \
+            patch.dict(config, {'es_retry_base_delay': 0}):
+        result = search({'indexes': ['index1']}, {'auth': None})
+    assert session.post.call_count == 2
+    assert result['count'] == 1
+
+
+def test_search_async_coalesced():
+    calls = []
+
+    async def post(*args, **kwargs):
+        calls.append(args)
+        await asyncio.sleep(0.05)
+        return MagicMock(is_error=False, text=json.dumps(_ES_RESP))
+
+    async def ws_ids(*args):
+        return [0, 1]
+
+    async def run():
+        return await asyncio.gather(*[search_async({'indexes': ['index1']}, {'auth': None}) for _ in range(3)])
+
+    client = MagicMock()
+    client.post.side_effect = post
+    with patch('src.es_client.query.ws_auth_async', side_effect=ws_ids), \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        results = asyncio.run(run())
+    assert len(calls) == 1
+    assert results[0] == results[1] == results[2]
+
+
+def test_post_once_store_error():
+    """A response that cannot be stored is still handed out, and the key is released"""
+    session = _slow_session()
+    store = MagicMock(side_effect=OSError('No space left on device'))
+    with patch('src.es_client.query.get_session', return_value=session):
+        assert search_query._post_once('/_search', '{}', 'key1', store) == json.dumps(_ES_RESP)
+        assert search_query._post_once('/_search', '{}', 'key1') == json.dumps(_ES_RESP)
+    assert session.post.call_count == 2
+    assert search_query._in_flight.stats()['in_flight'] == 0
+
+
+def test_post_once_async_leader_cancelled():
+    """Cancelling the caller that sends a request does not fail the callers waiting on it"""
+    async def post(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return MagicMock(is_error=False, text='resp')
+
+    async def run():
+        leader = asyncio.ensure_future(search_query._post_once_async('/_search', '{}', 'key2'))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(search_query._post_once_async('/_search', '{}', 'key2'))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await waiter
+
+    client = MagicMock()
+    client.post.side_effect = post
+    with patch('src.es_client.query.get_async_client', return_value=client):
+        assert asyncio.run(run()) == 'resp'
+    assert client.post.call_count == 1
+
+
+def _page(ids, pit_id):
+    """
+    A page of a cursor search, sorted on the default score and the
+    `_shard_doc` tiebreaker. The scores are all equal, as for a filter-only
+    query, so only the tiebreaker tells the hits apart.
+    """
+    return {
+        'took': 3,
+        'pit_id': pit_id,
+        'hits': {
+            'total': {'value': 3},
+            'hits': [
+                {'_index': 'test.index1_1', '_id': doc_id, '_source': {}, 'sort': [1.0, n]}
+                for (n, doc_id) in ids
+            ],
+        },
+    }
+
+
+@responses.activate
+def test_search_cursor():
+    """Paging through a point in time with search_after"""
+    es_url = config['elasticsearch_url']
+    responses.add(responses.POST, es_url + '/test.index1/_pit', json={'id': 'pit1'}, status=200)
+    responses.add(responses.POST, es_url + '/_search', json=_page([(0, 'a'), (1, 'b')], 'pit2'), status=200)
+    responses.add(responses.DELETE, es_url + '/_pit', json={'succeeded': True}, status=200)
+    with patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet([0])):
+        first = search({'indexes': ['index1'], 'size': 2, 'from': 5, 'cursor': '*'}, {'auth': None})
+        assert [hit['id'] for hit in first['hits']] == ['a', 'b']
+        assert first['cursor'] is not None
+        assert 'keep_alive=5m' in responses.calls[0].request.url
+        body = json.loads(responses.calls[1].request.body)
+        assert body['pit'] == {'id': 'pit1', 'keep_alive': '5m'}
+        assert body['sort'] == [{'_score': {'order': 'desc'}}, {'_shard_doc': 'asc'}]
+        assert 'from' not in body
+        assert 'search_after' not in body
+        assert 'terminate_after' not in body
+        # The last page has fewer hits than the page size
+        responses.replace(responses.POST, es_url + '/_search', json=_page([(2, 'c')], 'pit3'), status=200)
+        second = search({'indexes': ['index1'], 'size': 2, 'cursor': first['cursor']}, {'auth': None})
+    assert [hit['id'] for hit in second['hits']] == ['c']
+    assert second['cursor'] is None
+    body = json.loads(responses.calls[2].request.body)
+    assert body['pit']['id'] == 'pit2'
+    assert body['search_after'] == [1.0, 1]
+    assert body['query']['bool']['filter'] == [{'terms': {'access_group': [0]}}]
+    # The point in time is released
+    assert responses.calls[3].request.method == 'DELETE'
+    assert json.loads(responses.calls[3].request.body) == {'id': 'pit3'}
+
+
+def test_cursor_sort():
+    """Cursor sorts end with a unique tiebreaker, so that ties are not skipped"""
+    sort = [{'timestamp': {'order': 'desc'}}]
+    assert search_query._cursor_sort(sort) == [{'timestamp': {'order': 'desc'}}, {'_shard_doc': 'asc'}]
+    assert sort == [{'timestamp': {'order': 'desc'}}]
+    assert search_query._cursor_sort(['_score']) == ['_score', {'_shard_doc': 'asc'}]
+    assert search_query._cursor_sort([{'_shard_doc': 'desc'}]) == [{'_shard_doc': 'desc'}]
+    assert search_query._cursor_sort(['_shard_doc']) == ['_shard_doc']
+
+
+def test_search_cursor_invalid():
+    with patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet([0])):
+        with pytest.raises(InvalidCursor):
+            search({'cursor': 'not a cursor'}, {'auth': None})
+
+
+@responses.activate
+def test_search_cursor_expired():
+    error_response = {
+        'error': {
+            'reason': 'No search context found for id [1]',
+            'root_cause': [{'type': 'search_context_missing_exception'}],
+        }
+    }
+    responses.add(responses.POST, config['elasticsearch_url'] + '/_search', json=error_response, status=404)
+    cursor = search_query._next_cursor({'size': 1}, {'pit': 'pit1'}, _page([(0, 'a')], 'pit1'))
+    with patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet([0])):
+        with pytest.raises(InvalidCursor):
+            search({'size': 1, 'cursor': cursor}, {'auth': None})
+
+
+def test_search_async_cursor():
+    def handle(request):
+        if request.path_url.startswith('/test.index1/_pit'):
+            return (200, {}, json.dumps({'id': 'pit1'}))
+        return (200, {}, json.dumps(_page([(0, 'a')], 'pit1')))
+    client = mock_async_client(handle)
+
+    async def ws_ids(*args):
+        return [0]
+
+    with patch('src.es_client.query.ws_auth_async', side_effect=ws_ids), \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        result = run_with_client(client, search_async({'indexes': ['index1'], 'size': 1, 'cursor': '*'},
+                                                      {'auth': None}))
+    assert result['cursor'] is not None
+    assert client.calls[1].path_url == '/_search?filter_path=' + search_query._SEARCH_FILTER_PATH
+    assert json.loads(client.calls[1].body)['pit']['id'] == 'pit1'
+
+
+@responses.activate
+def test_msearch():
+    """Several searches in one _msearch request, with one workspace lookup"""
+    error = {'error': {'root_cause': [{'type': 'index_not_found_exception'}], 'reason': 'no such index'},
+             'status': 404}
+    responses.add(responses.POST, config['elasticsearch_url'] + '/_msearch',
+                  json={'took': 5, 'responses': [_ES_RESP, error]}, status=200)
+    parts = [('public', WorkspaceIdSet([0, 1])), ('abc', WorkspaceIdSet([5]))]
+    with patch('src.es_client.query.ws_auth_parts', return_value=parts) as mocked_auth:
+        results = msearch([
+            {'indexes': ['index1'], 'only_public': True},
+            {'indexes': ['xyz']},
+            {'indexes': ['index1'], 'cursor': '*'},
+        ], {'auth': 'x'})
+    mocked_auth.assert_called_once_with('x', False, False)
+    assert results[0]['hits'] == [{'index': 'index1_1', 'id': 'doc1', 'doc': {'name': 'doc1'}}]
+    assert isinstance(results[1], UnknownIndex)
+    assert isinstance(results[2], InvalidCursor)
+    lines = responses.calls[0].request.body.split('\n')
+    assert lines[-1] == ''
+    assert json.loads(lines[0]) == {'index': 'test.index1', 'allow_no_indices': True}
+    assert json.loads(lines[1])['query']['bool']['filter'] == [{'terms': {'access_group': [0, 1]}}]
+    assert json.loads(lines[2]) == {'index': 'test.xyz', 'allow_no_indices': True}
+    assert json.loads(lines[3])['query']['bool']['filter'] == [{'terms': {'access_group': [0, 1, 5]}}]
+    assert len(lines) == 5
+
+
+@responses.activate
+def test_msearch_public_only():
+    """Only the public workspaces are looked up when no search needs private ones"""
+    responses.add(responses.POST, config['elasticsearch_url'] + '/_msearch',
+                  json={'took': 5, 'responses': [_ES_RESP]}, status=200)
+    with patch('src.es_client.query.ws_auth_parts', return_value=[('public', WorkspaceIdSet([0]))]) as mocked_auth:
+        msearch([{'only_public': True}], {'auth': 'x'})
+    mocked_auth.assert_called_once_with('x', True, False)
+    assert msearch([], {'auth': 'x'}) == []
+
+
+@responses.activate
+def test_msearch_both_access_flags():
+    """A search with both access flags gets its own error, and the others still run"""
+    responses.add(responses.POST, config['elasticsearch_url'] + '/_msearch',
+                  json={'took': 5, 'responses': [_ES_RESP]}, status=200)
+    both = {'only_public': True, 'only_private': True}
+    with patch('src.es_client.query.ws_auth_parts', return_value=[('public', WorkspaceIdSet([0]))]) as mocked_auth:
+        results = msearch([both, {'only_public': True}], {'auth': 'x'})
+        assert isinstance(results[0], ResponseError)
+        assert 'only_public' in results[0].message
+        assert results[1]['count'] == 1
+        # Nothing is looked up or sent when no search can run
+        results = msearch([both, both], {'auth': 'x'})
+    assert len(results) == 2
+    assert all(isinstance(result, ResponseError) for result in results)
+    mocked_auth.assert_called_once_with('x', True, False)
+    assert len(responses.calls) == 1
+
+
+def test_msearch_async():
+    resp = {'took': 5, 'responses': [_ES_RESP, _ES_RESP]}
+    client = mock_async_client(lambda request: (200, {}, json.dumps(resp)))
+
+    async def ws_auth_parts(*args, **kwargs):
+        return [('public', WorkspaceIdSet([0]))]
+
+    with patch('src.es_client.query.ws_auth_parts_async', side_effect=ws_auth_parts), \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        results = run_with_client(client, msearch_async([{'indexes': ['index1']}, {'indexes': ['index2']}],
+                                                        {'auth': None}))
+    assert len(results) == 2
+    assert results[1]['count'] == 1
+    assert client.calls[0].path_url == '/_msearch?filter_path=' + search_query._MSEARCH_FILTER_PATH
+    assert client.calls[0].headers['Content-Type'] == 'application/x-ndjson'
+
+
+@responses.activate
+def test_count():
+    """Counts go to _count, with only the query and access filter"""
+    responses.add(responses.POST, config['elasticsearch_url'] + '/test.index1/_count',
+                  json={'count': 5}, status=200)
+    with patch('src.es_client.query.ws_auth', return_value=[0, 1]):
+        result = count({'indexes': ['index1'], 'query': {'term': {'a': 1}}}, {'auth': None})
+    assert result['count'] == 5
+    req = responses.calls[0].request
+    assert req.url.endswith('/test.index1/_count?allow_no_indices=true')
+    assert json.loads(req.body) == {
+        'query': {'bool': {'filter': [{'terms': {'access_group': [0, 1]}}], 'must': {'term': {'a': 1}}}},
+    }
+
+
+@responses.activate
+def test_search_count_only():
+    """A search for just the count uses _count, and ignores the sort and highlight options"""
+    responses.add(responses.POST, config['elasticsearch_url'] + '/test.index1/_count',
+                  json={'count': 5}, status=200)
+    params = {'indexes': ['index1'], 'count': 1, 'sort': ['x'], 'highlight': {'fields': {'*': {}}}}
+    with patch('src.es_client.query.ws_auth', return_value=[0, 1]):
+        result = search(params, {'auth': None})
+    assert result['count'] == 5
+    assert result['hits'] == []
+    assert result['aggregations'] == {}
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_search_count_with_aggs():
+    """Aggregations still need a search"""
+    responses.add(responses.POST, config['elasticsearch_url'] + '/test.index1/_search',
+                  json=_ES_RESP, status=200)
+    params = {'indexes': ['index1'], 'count': 1, 'aggs': {'x': {'terms': {'field': 'x'}}}}
+    with patch('src.es_client.query.ws_auth', return_value=[0, 1]):
+        search(params, {'auth': None})
+    body = json.loads(responses.calls[0].request.body)
+    assert body['size'] == 0
+    assert body['aggs'] == params['aggs']
+
+
+@responses.activate
+def test_count_cached():
+    """Recent counts are reused by callers who can see the same workspaces"""
+    responses.add(responses.POST, config['elasticsearch_url'] + '/test.index1/_count',
+                  json={'count': 5}, status=200)
+    result_cache._counts_cache.clear()
+    params = {'indexes': ['index1']}
+    with patch.dict(config, {'count_cache_ttl': 10}), \
+            patch('src.es_client.query.ws_auth') as mocked_auth:
+        mocked_auth.return_value = [0, 1]
+        first = count(params, {'auth': 'x'})
+        second = count(params, {'auth': 'y'})
+        mocked_auth.return_value = [0, 1, 2]
+        count(params, {'auth': 'z'})
+    result_cache._counts_cache.clear()
+    assert first['count'] == second['count'] == 5
+    assert second['search_time'] == 0
+    assert len(responses.calls) == 2
+
+
+def test_count_async():
+    client = mock_async_client(lambda request: (200, {}, json.dumps({'count': 7})))
+    with patch('src.es_client.query.ws_auth_async') as mocked_auth, \
+            patch('src.es_client.query.get_async_client', return_value=client):
+        async def ws_ids(*args):
+            return [0, 1]
+        mocked_auth.side_effect = ws_ids
+        result = run_with_client(client, search_async({'indexes': ['index1'], 'count': 1}, {'auth': None}))
+        assert result['count'] == 7
+        assert run_with_client(client, count_async({'indexes': ['index1']}, {'auth': None}))['count'] == 7
+    assert client.calls[0].path_url == '/test.index1/_count?allow_no_indices=true'
+
+
+def test_handle_response_filtered():
+    """Filtered responses leave out empty hits and unused fields"""
+    resp = {'took': 1, 'hits': {'total': {'value': 0}}}
+    assert search_query._handle_response(resp) == {'count': 0, 'hits': [], 'search_time': 1, 'aggregations': {}}
+    resp = {'took': 1, 'hits': {'total': {'value': 1}, 'hits': [{'_index': 'test.index1_1', '_id': 'x'}]}}
+    assert search_query._handle_response(resp)['hits'] == [{'index': 'index1_1', 'id': 'x', 'doc': {}}]
+    assert search_query._next_cursor({}, {'pit': 'p', 'after': None}, {'hits': {'total': {'value': 0}}}) is None
@@ -0,0 +1,118 @@
+import httpx
+import pytest
+import requests
+import responses
+from unittest.mock import patch
+
+from src.es_client import nodes
+from src.utils.config import config
+
+_NODES = ['http://es1:9200', 'http://es2:9200', 'http://es3:9200']
+
+
+@pytest.fixture
+def pool():
+    """The module's pool, with three nodes, and with probing stubbed out."""
+    pool = nodes.NodePool(_NODES)
+    with patch('src.es_client.nodes._pool', pool), \
+            patch('src.es_client.nodes._prober') as prober:
+        pool.prober = prober
+        yield pool
+
+
+def test_round_robin():
+    pool = nodes.NodePool(_NODES)
+    picked = [pool.acquire() for _ in range(6)]
+    assert picked == _NODES * 2
+
+
+def test_least_outstanding():
+    pool = nodes.NodePool(_NODES, 'least_outstanding')
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first != second
+    pool.release(first)
+    # The first node is free again, and the third was never used
+    assert pool.acquire() in (first, _NODES[2])
+    assert pool.stats()[second]['in_flight'] == 1
+
+
+def test_invalid_selection():
+    with pytest.raises(RuntimeError):
+        nodes.NodePool(_NODES, 'random')
+
+
+def test_eject_and_readmit():
+    pool = nodes.NodePool(_NODES)
+    url = pool.acquire()
+    assert pool.release(url, failed=True)
+    assert pool.is_ejected(url)
+    assert url not in [pool.acquire() for _ in range(4)]
+    pool.readmit(url)
+    assert url in [pool.acquire() for _ in range(3)]
+    assert pool.stats()[url]['ejections'] == 1
+
+
+def test_all_ejected():
+    """With every node out of rotation, requests go to the one that failed first"""
+    pool = nodes.NodePool(_NODES)
+    for url in _NODES:
+        pool.release(pool.acquire(), failed=True)
+    assert pool.acquire() == _NODES[0]
+
+
+def test_node_connection_error(pool):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with nodes.node() as url:
+            requests.get('http://127.0.0.1:1', timeout=1)
+    assert pool.is_ejected(url)
+    assert pool.prober.track.call_args[0][0] == url
+    # Other errors leave the node in rotation
+    with pytest.raises(ValueError):
+        with nodes.node() as other:
+            raise ValueError()
+    assert not pool.is_ejected(other)
+    assert all(state['in_flight'] == 0 for state in pool.stats().values())
+
+
+def test_node_read_timeout(pool):
+    """A slow search does not take a healthy node out of rotation"""
+    request = httpx.Request('POST', _NODES[0])
+    for err in (requests.exceptions.ReadTimeout(), httpx.ReadTimeout('slow', request=request),
+                requests.exceptions.ConnectionError('Connection aborted.')):
+        with pytest.raises(type(err)):
+            with nodes.node() as url:
+                raise err
+        assert not pool.is_ejected(url)
+    with pytest.raises(httpx.ConnectTimeout):
+        with nodes.node() as url:
+            raise httpx.ConnectTimeout('no answer', request=request)
+    assert pool.is_ejected(url)
+
+
+@responses.activate
+def test_probe(pool):
+    pool.release(pool.acquire(), failed=True)
+    responses.add(responses.GET, _NODES[0], json={}, status=503)
+    with pytest.raises(Exception):
+        nodes._probe(_NODES[0])
+    assert pool.is_ejected(_NODES[0])
+    responses.replace(responses.GET, _NODES[0], json={}, status=200)
+    nodes._probe(_NODES[0])
+    assert not pool.is_ejected(_NODES[0])
+    pool.prober.untrack.assert_called_once_with(_NODES[0])
+
+
+@responses.activate
+def test_sniff(pool):
+    resp = {'nodes': {
+        'a': {'http': {'publish_address': 'es4.example.com/10.0.0.4:9200'}},
+        'b': {'http': {'publish_address': '10.0.0.5:9201'}},
+    }}
+    for url in _NODES:
+        responses.add(responses.GET, url + '/_nodes/http', json=resp, status=200)
+    with patch.dict(config, {'es_sniff_interval': 0}), \
+            patch('src.es_client.nodes.http_compression.register_urls') as register:
+        nodes.sniff()
+    assert pool.urls() == ['http://10.0.0.5:9201', 'http://es4.example.com:9200']
+    register.assert_called_once_with('elasticsearch', pool.urls())
@@ -0,0 +1,119 @@
+import json
+import pytest
+import responses
+from unittest.mock import patch
+
+from src.es_client import acl, result_cache, search
+from src.utils.cache import MISSING
+from src.utils.config import config
+from src.utils.ws_id_set import WorkspaceIdSet
+
+_SEARCH_URL = config['elasticsearch_url'] + '/test.index1/_search'
+
+_ES_RESP = {
+    'took': 3,
+    'hits': {
+        'total': {'value': 1},
+        'hits': [{'_index': 'test.index1_1', '_id': 'doc1', '_source': {'name': 'doc1'}}],
+    },
+}
+
+
+def _counts(count):
+    return [
+        {'index': 'test.index1_1', 'docs.count': str(count)},
+        {'index': config['acl_index'], 'docs.count': '3'},
+    ]
+
+
+@pytest.fixture(autouse=True)
+def search_cache():
+    result_cache._results.clear()
+    result_cache._counts.update({'digest': None, 'checked_at': None})
+    with patch.dict(config, {'search_cache_ttl': 60}), \
+            patch('src.es_client.result_cache._counts_refresher') as refresher:
+        yield refresher
+    acl._stored.clear()
+
+
+def test_cacheable():
+    assert result_cache.cacheable({}, {'auth': None})
+    assert result_cache.cacheable({'only_public': True}, {'auth': 'x'})
+    assert not result_cache.cacheable({}, {'auth': 'x'})
+    with patch.dict(config, {'search_cache_ttl': 0}):
+        assert not result_cache.cacheable({}, {'auth': None})
+
+
+def test_cache_key_needs_counts(search_cache):
+    # Nothing is cached until the document counts are known
+    assert result_cache.cache_key('abc') is None
+    search_cache.refresh.assert_called_once_with('index_counts')
+    assert result_cache.get(None) is MISSING
+    result_cache.put(None, 'x')
+    result_cache.observe_counts(_counts(1))
+    key = result_cache.cache_key('abc')
+    assert key is not None
+    assert result_cache.get(key) is MISSING
+    result_cache.put(key, 'x')
+    assert result_cache.get(key) == 'x'
+
+
+def test_counts_change_key():
+    result_cache.observe_counts(_counts(1))
+    key = result_cache.cache_key('abc')
+    # Changes to the ACL index are ignored
+    result_cache.observe_counts(_counts(1)[:1] + [{'index': config['acl_index'], 'docs.count': '4'}])
+    assert result_cache.cache_key('abc') == key
+    result_cache.observe_counts(_counts(2))
+    assert result_cache.cache_key('abc') != key
+
+
+@responses.activate
+def test_refresh_counts():
+    responses.add(responses.GET, config['elasticsearch_url'] + '/_cat/indices/test*', json=_counts(1), status=200)
+    result_cache._refresh_counts()
+    assert result_cache._counts['digest'] is not None
+    assert 'h=index%2Cdocs.count' in responses.calls[0].request.url
+
+
+@responses.activate
+def test_public_search_cached():
+    responses.add(responses.POST, _SEARCH_URL, json=_ES_RESP, status=200)
+    result_cache.observe_counts(_counts(1))
+    with patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet([0, 1])):
+        first = search({'indexes': ['index1']}, {'auth': None})
+        second = search({'indexes': ['index1']}, {'auth': None})
+        assert len(responses.calls) == 1
+        assert first == second
+        assert first['hits'][0] is not second['hits'][0]
+        # A change in the public workspaces is a different search
+        with patch('src.es_client.query.ws_auth', return_value=WorkspaceIdSet([0, 1, 2])):
+            search({'indexes': ['index1']}, {'auth': None})
+        assert len(responses.calls) == 2
+        # As are new documents
+        result_cache.observe_counts(_counts(2))
+        search({'indexes': ['index1']}, {'auth': None})
+        assert len(responses.calls) == 3
+        # Searches that can see private workspaces are not cached
+        search({'indexes': ['index1']}, {'auth': 'x'})
+        search({'indexes': ['index1']}, {'auth': 'x'})
+        assert len(responses.calls) == 5
+    body = json.loads(responses.calls[0].request.body)
+    assert body['query']['bool']['filter'] == [{'terms': {'access_group': [0, 1]}}]
+
+
+@responses.activate
+def test_lookup_mode_key_covers_sets():
+    responses.add(responses.PUT, config['elasticsearch_url'] + '/' + config['acl_index'] + '/_doc/public',
+                  json={}, status=201)
+    responses.add(responses.POST, _SEARCH_URL, json=_ES_RESP, status=200)
+    result_cache.observe_counts(_counts(1))
+    with patch.dict(config, {'access_filter_mode': 'lookup'}), \
+            patch('src.es_client.query.ws_auth_parts') as mocked_auth:
+        mocked_auth.return_value = [('public', WorkspaceIdSet([0, 1]))]
+        search({'indexes': ['index1']}, {'auth': None})
+        search({'indexes': ['index1']}, {'auth': None})
+        mocked_auth.return_value = [('public', WorkspaceIdSet([0, 1, 2]))]
+        search({'indexes': ['index1']}, {'auth': None})
+    searches = [call for call in responses.calls if call.request.method == 'POST']
+    assert len(searches) == 2
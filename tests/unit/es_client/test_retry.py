@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+
+from src.es_client import retry
+from src.utils.config import config
+
+
+@pytest.fixture(autouse=True)
+def no_delay():
+    """Retries are immediate, unless a test says otherwise."""
+    with patch.dict(config, {'es_retry_attempts': 3, 'es_retry_base_delay': 0, 'es_retry_budget': 10}):
+        yield
+
+
+def _responses(*statuses, headers=None):
+    """A request function answering with each status in turn, recording the nodes it was sent to."""
+    statuses = list(statuses)
+    bases = []
+
+    def request(base):
+        bases.append(base)
+        return MagicMock(status_code=statuses.pop(0), headers=headers or {})
+    request.bases = bases
+    return request
+
+
+def test_retry_recovers():
+    before = retry.stats()
+    request = _responses(429, 503, 200)
+    assert retry.send(request).status_code == 200
+    assert len(request.bases) == 3
+    after = retry.stats()
+    assert after['retries'] - before['retries'] == 2
+    assert after['recovered'] - before['recovered'] == 1
+    assert after['by_status'][429] - before['by_status'].get(429, 0) == 1
+
+
+def test_retry_other_errors():
+    """Only transient errors are retried"""
+    request = _responses(500, 200)
+    assert retry.send(request).status_code == 500
+    assert len(request.bases) == 1
+
+
+def test_retry_attempts_exhausted():
+    before = retry.stats()
+    request = _responses(*[429] * 5)
+    assert retry.send(request).status_code == 429
+    assert len(request.bases) == 4
+    assert retry.stats()['exhausted'] - before['exhausted'] == 1
+
+
+def test_retry_after():
+    request = _responses(503, 200, headers={'Retry-After': '1.5'})
+    with patch('src.es_client.retry.time.sleep') as sleep:
+        retry.send(request)
+    sleep.assert_called_once_with(1.5)
+
+
+def test_retry_after_past_budget():
+    """A retry that could not be made before the budget runs out is not made"""
+    request = _responses(503, 200, headers={'Retry-After': '30'})
+    with patch('src.es_client.retry.time.sleep') as sleep:
+        assert retry.send(request).status_code == 503
+    sleep.assert_not_called()
+
+
+def test_retry_backoff_capped():
+    with patch.dict(config, {'es_retry_base_delay': 1, 'es_retry_max_delay': 2}), \
+            patch('src.es_client.retry.time.sleep') as sleep:
+        retry.send(_responses(429, 429, 429, 200))
+    delays = [call[0][0] for call in sleep.call_args_list]
+    assert len(delays) == 3
+    assert all(0 <= delay <= 2 for delay in delays)
+
+
+def test_retry_after_date():
+    assert retry._retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert retry._retry_after('soon') is None
+    assert retry._retry_after(None) is None
+
+
+def test_retry_async():
+    statuses = [429, 200]
+
+    async def request(base):
+        return MagicMock(status_code=statuses.pop(0), headers={})
+    assert asyncio.run(retry.send_async(request)).status_code == 200
+    assert statuses == []
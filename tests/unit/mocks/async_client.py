@@ -0,0 +1,62 @@
+"""
+Mock upstream services for the async HTTP client.
+
+Builds an httpx.AsyncClient that answers every request in-process via an ASGI
+app. Callbacks have the same shape as the `responses` callbacks in
+mocked.py: they receive a request object with `method`, `url`, `path_url`,
+`headers` and `body`, and return a tuple of (status, headers, body).
+"""
+import asyncio
+import httpx
+
+
+class MockRequest:
+
+    def __init__(self, method, url, path_url, headers, body):
+        self.method = method
+        self.url = url
+        self.path_url = path_url
+        self.headers = headers
+        self.body = body
+
+
+def mock_async_client(callback):
+    """Return an AsyncClient whose requests are all answered by `callback`."""
+    calls = []
+
+    async def app(scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        headers = {k.decode('latin-1').title(): v.decode('latin-1') for (k, v) in scope['headers']}
+        path_url = scope['path']
+        if scope.get('query_string'):
+            path_url += '?' + scope['query_string'].decode()
+        request = MockRequest(scope['method'], 'http://mock' + path_url, path_url, headers, body)
+        calls.append(request)
+        (status, resp_headers, resp_body) = callback(request)
+        if isinstance(resp_body, str):
+            resp_body = resp_body.encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.lower().encode(), v.encode()) for (k, v) in resp_headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': resp_body})
+
+    client = httpx.AsyncClient(app=app, base_url='http://mock')
+    client.calls = calls  # type: ignore
+    return client
+
+
+def run_with_client(client, coro):
+    """Run `coro` to completion on a new event loop, then close `client`."""
+    async def run():
+        try:
+            return await coro
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
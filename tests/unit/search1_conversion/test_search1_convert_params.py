@@ -338,3 +338,27 @@ def test_search_objects_private_nor_public():
     assert re.value.code == -32602
     assert re.value.message == 'Invalid params'
     assert re.value.error['message'] == 'May not specify no private data and no public data'
+
+
+def test_search_objects_type_counts():
+    params = {
+        'match_filter': {},
+        'post_processing': {'add_type_counts': 1},
+    }
+    query = convert_params.search_objects(params)
+    # The same counts as search_types, along with the page of objects
+    assert query['aggs'] == convert_params.search_types({'match_filter': {}})['aggs']
+    assert query['size'] == 20
+
+
+def test_search_objects_skip_data_source():
+    """Without the data, only the global document fields are fetched"""
+    for post_processing in [{'skip_data': 1}, {'ids_only': 1}]:
+        params = {'match_filter': {}, 'post_processing': post_processing}
+        query = convert_params.search_objects(params)
+        assert 'obj_name' in query['source']
+        assert 'creation_date' in query['source']
+    query = convert_params.search_objects({'match_filter': {}, 'post_processing': {'skip_keys': 1}})
+    assert 'source' not in query
+    query = convert_params.get_objects({'ids': ['x'], 'post_processing': {'ids_only': 1}})
+    assert 'access_group' in query['source']
@@ -1,5 +1,8 @@
+import threading
+import time
 import unittest
 import responses
+from unittest.mock import patch
 from src.exceptions import NoAccessGroupError, NoUserProfileError
 from src.search1_conversion import convert_result
 from src.utils.config import config
@@ -69,6 +72,31 @@ class Search1ConversionTest(unittest.TestCase):
 
         self.assertEqual(final['type_to_count'], test_expected['type_to_count'])
 
+    @responses.activate
+    def test_search_objects_type_counts(self):
+        responses.add_callback(responses.POST, config['workspace_url'],
+                               callback=workspace_call)
+
+        responses.add_callback(responses.POST, config['user_profile_url'],
+                               callback=user_profile_call)
+
+        _found, test_params = get_data(
+            'SearchAPI/legacy/search_objects/case-01/params.json')
+        _found, test_es_search_results = get_data(
+            'elasticsearch/legacy/search_objects/case-01/result.json')
+        _found, test_es_types_results = get_data(
+            'elasticsearch/legacy/search_types/case-01/result.json')
+        _found, test_expected = get_data(
+            'SearchAPI/legacy/search_types/case-01/result.json')
+
+        test_params['post_processing']['add_type_counts'] = 1
+        test_es_search_results['aggregations'] = test_es_types_results['aggregations']
+        final = convert_result.search_objects(test_params, test_es_search_results,
+                                              {'auth': None})
+
+        self.assertEqual(final['type_to_count'], test_expected['type_to_count'])
+        self.assertEqual(len(final['objects']), len(test_es_search_results['hits']))
+
     def test_fetch_narrative_info_no_hits(self):
         results = {
             'hits': []
@@ -133,6 +161,70 @@ class Search1ConversionTest(unittest.TestCase):
         self.assertEqual(e.exception.message,
                          'A user profile could not be found for "kbaseuitestx"')
 
+    def test_fetch_narrative_info_concurrent(self):
+        """Workspace infos for the page are fetched concurrently"""
+        lock = threading.Lock()
+        in_flight = [0, 0]  # current, max
+
+        def get_workspace_info(workspace_id, auth_token):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return [workspace_id, 'ws', 'owner', '2020-06-06T03:49:55+0000', 1, 'n', 'r', 'unlocked', {}]
+
+        profile = {'user': {'username': 'owner', 'realname': 'Owner'}}
+        results = {'hits': [{'doc': {'access_group': ws_id}} for ws_id in range(10)]}
+        with patch('src.search1_conversion.convert_result.get_workspace_info', side_effect=get_workspace_info), \
+                patch('src.search1_conversion.convert_result.get_user_profiles',
+                      return_value=[profile]) as get_user_profiles:
+            (ws_infos, narr_infos) = convert_result._fetch_narrative_info(results, {'auth': None})
+        self.assertEqual(sorted(ws_infos.keys()), sorted(str(ws_id) for ws_id in range(10)))
+        self.assertEqual(ws_infos['3'][0], 3)
+        self.assertGreater(in_flight[1], 1)
+        # One profile lookup for all the owners
+        get_user_profiles.assert_called_once_with(['owner'], None)
+
+    def test_fetch_narrative_info_profiles_start_early(self):
+        """An owner's profile is looked up while other workspace infos are still pending"""
+        profile_requested = threading.Event()
+        waited = []
+
+        def get_workspace_info(workspace_id, auth_token):
+            if workspace_id == 2:
+                waited.append(profile_requested.wait(2))
+            owner = 'owner' + str(workspace_id)
+            return [workspace_id, 'ws', owner, '2020-06-06T03:49:55+0000', 1, 'n', 'r', 'unlocked', {}]
+
+        def get_user_profiles(usernames, auth_token):
+            profile_requested.set()
+            return [{'user': {'username': username, 'realname': username}} for username in usernames]
+
+        results = {'hits': [{'doc': {'access_group': ws_id}} for ws_id in (1, 2)]}
+        with patch('src.search1_conversion.convert_result.get_workspace_info', side_effect=get_workspace_info), \
+                patch('src.search1_conversion.convert_result.get_user_profiles', side_effect=get_user_profiles):
+            (ws_infos, _) = convert_result._fetch_narrative_info(results, {'auth': None})
+        self.assertEqual(waited, [True])
+        self.assertEqual(sorted(ws_infos.keys()), ['1', '2'])
+
+    def test_fetch_narrative_info_request_scoped(self):
+        """Lookups are not repeated within a request"""
+        ws_info = [1, 'ws', 'owner', '2020-06-06T03:49:55+0000', 1, 'n', 'r', 'unlocked', {}]
+        profile = {'user': {'username': 'owner', 'realname': 'Owner'}}
+        results = {'hits': [{'doc': {'access_group': 1}}]}
+        ctx = {'auth': None}
+        with patch('src.search1_conversion.convert_result.get_workspace_info',
+                   return_value=ws_info) as get_workspace_info, \
+                patch('src.search1_conversion.convert_result.get_user_profiles',
+                      return_value=[profile]) as get_user_profiles:
+            convert_result._fetch_narrative_info(results, ctx)
+            convert_result._fetch_narrative_info(results, ctx)
+            convert_result._fetch_narrative_info(results, {'auth': None})
+        self.assertEqual(get_workspace_info.call_count, 2)
+        self.assertEqual(get_user_profiles.call_count, 2)
+
     def test_get_object_data_from_search_results(self):
         responses.add_callback(responses.POST, config['workspace_url'],
                                callback=workspace_call)
@@ -151,3 +243,19 @@ class Search1ConversionTest(unittest.TestCase):
             test_es_search_results,
             post_processing)
         self.assertEqual(converted, test_expected['objects'])
+
+
+def test_source_includes_skip_data():
+    """Every field that a result without data reads is fetched"""
+    hit = {
+        'id': 'WS::1:2',
+        'index': 'genome_2',
+        'doc': {'access_group': 1, 'obj_name': 'x', 'creation_date': '2020-01-01T00:00:00+0000', 'dna': 'ACGT'},
+    }
+    post_processing = {'skip_data': 1}
+    includes = convert_result.source_includes(post_processing)
+    projected = dict(hit, doc={key: val for (key, val) in hit['doc'].items() if key in includes})
+    assert 'dna' not in projected['doc']
+    assert (convert_result._get_object_data_from_search_results({'hits': [projected]}, post_processing)
+            == convert_result._get_object_data_from_search_results({'hits': [hit]}, post_processing))
+    assert convert_result.source_includes({}) is None
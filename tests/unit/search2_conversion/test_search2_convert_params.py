@@ -111,3 +111,47 @@ def test_search_workspace_blank():
     }
     result = convert_params.search_workspace(params, {})
     assert result == expected
+
+
+def test_search_workspace_filter_ws_ids():
+    """Term filters on access_group restrict the workspaces to check access for"""
+    params = {
+        'filters': {
+            'operator': 'AND',
+            'fields': [
+                {
+                    'operator': 'OR',
+                    'fields': [
+                        {'field': 'access_group', 'term': 3},
+                        {'field': 'access_group', 'term': 1},
+                    ]
+                },
+                {'field': 'x', 'term': 1}
+            ]
+        },
+    }
+    result = convert_params.search_workspace(params, {})
+    assert result['filter_ws_ids'] == [1, 3]
+
+
+def test_search_workspace_filter_ws_ids_unrestricted():
+    """An OR with a non-workspace filter can match any workspace"""
+    params = {
+        'filters': {
+            'operator': 'OR',
+            'fields': [
+                {'field': 'access_group', 'term': 3},
+                {'field': 'x', 'term': 1},
+            ]
+        },
+    }
+    result = convert_params.search_workspace(params, {})
+    assert 'filter_ws_ids' not in result
+
+
+def test_search_workspace_cursor():
+    params = {'paging': {'length': 20, 'cursor': '*'}}
+    result = convert_params.search_workspace(params, {})
+    assert result['cursor'] == '*'
+    assert result['size'] == 20
+    assert 'cursor' not in convert_params.search_workspace({'paging': {'offset': 10}}, {})
@@ -14,3 +14,16 @@ def test_search2_convert_result_valid():
     assert converted["search_time"] == result["search_time"]
     assert converted["count"] == result["count"]
     assert converted["hits"] == ["hi", "there"]
+
+
+def test_search2_convert_result_cursor():
+    result = {
+        "search_time": 10,
+        "count": 11,
+        "hits": [{"doc": "hi"}],
+        "cursor": "abc",
+    }
+    converted = convert_result.search_workspace(result, {}, {})
+    assert converted["cursor"] == "abc"
+    del result["cursor"]
+    assert "cursor" not in convert_result.search_workspace(result, {}, {})
@@ -8,6 +8,7 @@ import json
 # For mocking workspace calls
 from unittest.mock import patch
 from src.search2_rpc import service as rpc
+from src.exceptions import UnknownIndex
 
 
 def test_show_indexes(services):
@@ -96,3 +97,37 @@ def test_search_workspace(services):
         res = json.loads(result)
         assert 'error' not in res
         assert res['result']['count'] > 0
+
+
+def test_search_workspace_multi():
+    """Each search gets its own result, or its own error"""
+    es_result = {'count': 1, 'search_time': 2, 'aggregations': {}, 'hits': [{'doc': {'x': 1}}]}
+    with patch('src.search2_rpc.service.msearch') as mocked:
+        mocked.return_value = [es_result, UnknownIndex('no such index')]
+        params = {
+            "method": "search_workspace_multi",
+            "jsonrpc": "2.0",
+            "id": 0,
+            "params": {"searches": [{"types": []}, {"access": {"only_public": True}}]},
+        }
+        res = json.loads(rpc.call(json.dumps(params), {'auth': None}))
+    searches = mocked.call_args[0][0]
+    assert searches[1]['only_public'] is True
+    assert res['result']['results'] == [
+        {'count': 1, 'search_time': 2, 'hits': [{'x': 1}]},
+        {'error': {'code': -32002, 'message': 'no such index'}},
+    ]
+
+
+def test_count_objects():
+    with patch('src.search2_rpc.service.count') as mocked:
+        mocked.return_value = {'count': 3, 'search_time': 1}
+        params = {
+            "method": "count_objects",
+            "jsonrpc": "2.0",
+            "id": 0,
+            "params": {"indexes": ["x"], "only_public": True},
+        }
+        res = json.loads(rpc.call(json.dumps(params), {'auth': None}))
+    assert mocked.call_args[0][0] == {'indexes': ['x'], 'only_public': True}
+    assert res['result'] == {'count': 3, 'search_time': 1}
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import patch
+
+from src.server import export
+from src.exceptions import ResponseError
+from tests.unit.mocks.async_client import mock_async_client, run_with_client
+
+
+def _pages(*pages):
+    """A search_async stand-in that returns the given pages in turn, recording its params."""
+    calls = []
+
+    async def search_async(params, meta):
+        calls.append((dict(params), meta))
+        return pages[len(calls) - 1]
+    return (search_async, calls)
+
+
+def _collect(lines):
+    async def run():
+        return [json.loads(line) async for line in lines]
+    return asyncio.run(run())
+
+
+def _page(hits, cursor):
+    return {'count': 3, 'search_time': 1, 'aggregations': {}, 'hits': hits, 'cursor': cursor}
+
+
+def test_prepare_invalid():
+    with pytest.raises(ResponseError) as err:
+        export.prepare('{', None)
+    assert err.value.jsonrpc_code == -32700
+    with pytest.raises(ResponseError) as err:
+        export.prepare(json.dumps({'method': 'show_config'}), None)
+    assert err.value.jsonrpc_code == -32601
+    with pytest.raises(ResponseError) as err:
+        export.prepare(json.dumps({'method': 'search_objects', 'params': {'size': 'x'}}), None)
+    assert err.value.jsonrpc_code == -32602
+
+
+def test_export_search_objects():
+    hits = [{'index': 'index1', 'id': str(n), 'doc': {'n': n}} for n in range(3)]
+    (search_async, calls) = _pages(_page(hits[:2], 'c1'), _page(hits[2:], None))
+    with patch('src.server.export.search_async', side_effect=search_async), \
+            patch('src.server.export.close_cursor_async') as close_cursor_async, \
+            patch.dict(export.config, {'export_page_size': 2}):
+        lines = export.prepare(json.dumps({'method': 'search_objects', 'params': {'indexes': ['index1']}}), 'tok')
+        assert _collect(lines) == hits
+    # The last page closes its own point in time
+    close_cursor_async.assert_not_called()
+    assert [params['cursor'] for (params, _) in calls] == ['*', 'c1']
+    assert calls[0][0]['size'] == 2
+    assert calls[0][0]['indexes'] == ['index1']
+    # The caller's token restricts every page
+    assert all(meta == {'auth': 'tok'} for (_, meta) in calls)
+
+
+def test_export_tied_sort():
+    """Hits with equal sort values, as in a filter-only search, are all exported across pages"""
+    docs = [{'_index': 'test.index1_1', '_id': str(n), '_source': {'n': n}} for n in range(5)]
+
+    def handle(request):
+        # Searches after a hit return the hits that sort after it, comparing
+        # every requested sort value as Elasticsearch does
+        if request.path_url.startswith('/test.index1/_pit'):
+            return (200, {}, json.dumps({'id': 'pit1'}))
+        if request.method == 'DELETE':
+            return (200, {}, json.dumps({'succeeded': True}))
+        body = json.loads(request.body)
+        sort_values = {'_score': lambda n: 1.0, '_shard_doc': lambda n: n}
+        keys = [sort_values[next(iter(each))] for each in body['sort']]
+        hits = [dict(doc, sort=[key(n) for key in keys]) for (n, doc) in enumerate(docs)]
+        after = body.get('search_after')
+        hits = [hit for hit in hits if after is None or hit['sort'] > after][:body['size']]
+        resp = {'took': 1, 'pit_id': 'pit1', 'hits': {'total': {'value': 5}, 'hits': hits}}
+        return (200, {}, json.dumps(resp))
+    client = mock_async_client(handle)
+
+    async def ws_ids(*args):
+        return [1]
+
+    with patch('src.es_client.query.ws_auth_async', side_effect=ws_ids), \
+            patch('src.es_client.query.get_async_client', return_value=client), \
+            patch.dict(export.config, {'export_page_size': 2}):
+        lines = export.prepare(json.dumps({'method': 'search_objects', 'params': {'indexes': ['index1']}}), 'tok')
+
+        async def collect():
+            return [json.loads(line) async for line in lines]
+        exported = run_with_client(client, collect())
+    assert [hit['doc']['n'] for hit in exported] == [0, 1, 2, 3, 4]
+    # The point in time is closed after the last page
+    assert [call.method for call in client.calls].count('DELETE') == 1
+
+
+def test_export_closed_early():
+    """An export that is not read to the end, such as on a disconnect, closes its point in time"""
+    hits = [{'index': 'index1', 'id': str(n), 'doc': {'n': n}} for n in range(3)]
+    (search_async, _) = _pages(_page(hits[:2], 'c1'), _page(hits[2:], None))
+
+    async def close_cursor_async(cursor):
+        closed.append(cursor)
+    closed = []
+    with patch('src.server.export.search_async', side_effect=search_async), \
+            patch('src.server.export.close_cursor_async', side_effect=close_cursor_async):
+        lines = export.prepare(json.dumps({'method': 'search_objects', 'params': {'indexes': ['index1']}}), None)
+
+        async def read_one():
+            line = await lines.__anext__()
+            await lines.aclose()
+            return json.loads(line)
+        assert asyncio.run(read_one()) == hits[0]
+    assert closed == ['c1']
+
+
+def test_export_search_workspace():
+    hits = [{'index': 'index1', 'id': '1', 'doc': {'n': 1}}]
+    (search_async, calls) = _pages(_page(hits, None))
+    with patch('src.server.export.search_async', side_effect=search_async):
+        body = {'method': 'search_workspace', 'params': {'paging': {'offset': 10}, 'access': {'only_public': True}}}
+        assert _collect(export.prepare(json.dumps(body), None)) == [{'n': 1}]
+    assert calls[0][0]['only_public'] is True
+    assert calls[0][0]['cursor'] == '*'
+
+
+def test_export_legacy():
+    doc = {
+        'access_group': 1,
+        'obj_name': 'x',
+        'creation_date': '2020-06-06T03:49:55+0000',
+        'timestamp': 0,
+    }
+    hits = [{'index': 'index1_1', 'id': 'WS::1:1', 'doc': doc}]
+    (search_async, calls) = _pages(_page(hits, None))
+    ws_info = [1, 'ws', 'owner', '2020-06-06T03:49:55+0000', 1, 'n', 'r', 'unlocked', {}]
+    profile = {'user': {'username': 'owner', 'realname': 'Owner'}}
+    body = {
+        'method': 'KBaseSearchEngine.search_objects',
+        'params': [{'match_filter': {}, 'post_processing': {'add_access_group_info': 1}}],
+    }
+    with patch('src.server.export.search_async', side_effect=search_async), \
+            patch('src.search1_conversion.convert_result.get_workspace_info', return_value=ws_info), \
+            patch('src.search1_conversion.convert_result.get_user_profiles', return_value=[profile]):
+        lines = _collect(export.prepare(json.dumps(body), 'tok'))
+    assert len(lines) == 1
+    assert lines[0]['workspace_id'] == 1
+    assert lines[0]['object_name'] == 'x'
+    assert lines[0]['access_group_info'] == ws_info
+    assert 'access_group_narrative_info' not in lines[0]
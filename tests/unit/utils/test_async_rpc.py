@@ -0,0 +1,164 @@
+import asyncio
+
+from src.utils.async_rpc import AsyncJSONRPCService
+
+
+def _service():
+    # jsonrpcbase mutates the schema, so build a fresh one for each service
+    schema = {
+        'definitions': {
+            'methods': {
+                'echo': {
+                    'params': {'type': 'object', 'required': ['x']},
+                },
+            },
+        },
+    }
+    svc = AsyncJSONRPCService(info={'title': 'x', 'description': 'x', 'version': '0'}, schema=schema)
+
+    def echo(params, meta):
+        return {'sync': params['x']}
+
+    async def echo_async(params, meta):
+        await asyncio.sleep(0)
+        return {'async': params['x'], 'auth': meta['auth']}
+
+    def fail(params, meta):
+        raise RuntimeError('sync')
+
+    async def fail_async(params, meta):
+        raise RuntimeError('boom')
+
+    def plain(params, meta):
+        return 'plain'
+
+    def config(params, meta):
+        return 'config'
+
+    svc.add(echo)
+    svc.add(plain)
+    svc.add_inline(config)
+    svc.add_async(echo_async, name='echo')
+    svc.add(fail)
+    svc.add_async(fail_async, name='fail')
+    return svc
+
+
+def test_call_py_async_awaits_coroutine():
+    req = {'jsonrpc': '2.0', 'id': 1, 'method': 'echo', 'params': {'x': 1}}
+    resp = asyncio.run(_service().call_py_async(req, {'auth': 'tok'}))
+    assert resp == {'id': 1, 'jsonrpc': '2.0', 'result': {'async': 1, 'auth': 'tok'}}
+
+
+def test_call_py_still_sync():
+    req = {'jsonrpc': '2.0', 'id': 1, 'method': 'echo', 'params': {'x': 1}}
+    resp = _service().call_py(req, {})
+    assert resp['result'] == {'sync': 1}
+
+
+def test_call_py_async_invalid_params():
+    req = {'jsonrpc': '2.0', 'id': 1, 'method': 'echo', 'params': {}}
+    resp = asyncio.run(_service().call_py_async(req, {}))
+    assert resp['error']['code'] == -32602
+
+
+def test_call_py_async_method_error():
+    req = {'jsonrpc': '2.0', 'id': 'a', 'method': 'fail'}
+    resp = asyncio.run(_service().call_py_async(req, {}))
+    assert resp['id'] == 'a'
+    assert resp['error']['code'] == -32000
+    assert resp['error']['data'] == {'method': 'fail'}
+
+
+def test_call_py_async_notification():
+    req = {'jsonrpc': '2.0', 'method': 'echo', 'params': {'x': 1}}
+    assert asyncio.run(_service().call_py_async(req, {})) is None
+
+
+def test_call_py_async_run_sync():
+    calls = []
+
+    async def run_sync(func, *args):
+        calls.append(func)
+        return func(*args)
+
+    svc = _service()
+    req = {'jsonrpc': '2.0', 'id': 1, 'method': 'plain'}
+    resp = asyncio.run(svc.call_py_async(req, {}, run_sync=run_sync))
+    assert resp['result'] == 'plain'
+    assert calls == [svc.call_py]
+    # Inline and async methods do not go through run_sync
+    for method in ['config', 'echo']:
+        req = {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': {'x': 1}}
+        asyncio.run(svc.call_py_async(req, {'auth': None}, run_sync=run_sync))
+    assert len(calls) == 1
+
+
+def test_call_py_async_batch_concurrent():
+    running = []
+    peak = []
+
+    async def slow_async(params, meta):
+        running.append(params['x'])
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(params['x'])
+        meta.setdefault('seen', []).append(params['x'])
+        return params['x']
+
+    svc = _service()
+    svc.batch_concurrency = 2
+    svc.add(slow_async, name='slow')
+    svc.add_async(slow_async, name='slow')
+    reqs = [{'jsonrpc': '2.0', 'id': i, 'method': 'slow', 'params': {'x': i}} for i in range(5)]
+    meta = {}
+    resp = asyncio.run(svc.call_py_async(reqs, meta))
+    # Responses keep the order of the requests
+    assert [r['result'] for r in resp] == [0, 1, 2, 3, 4]
+    assert max(peak) == 2
+    # The entries share the metadata of the request
+    assert sorted(meta['seen']) == [0, 1, 2, 3, 4]
+
+
+def test_call_py_async_batch_mixed():
+    reqs = [
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'echo', 'params': {'x': 1}},
+        {'jsonrpc': '2.0', 'method': 'echo', 'params': {'x': 2}},
+        {'jsonrpc': '2.0', 'id': 3, 'method': 'fail'},
+        1,
+        {'jsonrpc': '2.0', 'id': 5, 'method': 'nope'},
+    ]
+    resp = asyncio.run(_service().call_py_async(reqs, {'auth': None}))
+    # The notification gets no response
+    assert len(resp) == 4
+    assert resp[0]['result'] == {'async': 1, 'auth': None}
+    assert resp[1]['id'] == 3
+    assert resp[1]['error']['code'] == -32000
+    assert resp[2]['id'] is None
+    assert resp[2]['error']['code'] == -32600
+    assert resp[3]['id'] == 5
+    assert resp[3]['error']['code'] == -32601
+
+
+def test_call_py_async_batch_notifications():
+    reqs = [{'jsonrpc': '2.0', 'method': 'echo', 'params': {'x': i}} for i in range(2)]
+    assert asyncio.run(_service().call_py_async(reqs, {'auth': None})) is None
+
+
+def test_call_py_async_batch_busy():
+    class Busy(Exception):
+        jsonrpc_code = -32008
+        message = 'busy'
+
+    async def run_sync(func, *args):
+        raise Busy()
+
+    reqs = [
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'plain'},
+        {'jsonrpc': '2.0', 'id': 2, 'method': 'config'},
+    ]
+    resp = asyncio.run(_service().call_py_async(reqs, {}, run_sync=run_sync))
+    assert resp[0]['error']['code'] == -32008
+    assert resp[0]['error']['data'] == {'method': 'plain', 'details': 'busy'}
+    # Inline methods do not need the pool
+    assert resp[1]['result'] == 'config'
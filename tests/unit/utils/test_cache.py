@@ -0,0 +1,70 @@
+import time
+
+from src.utils.cache import TTLCache, MISSING, token_fingerprint, approx_size
+
+
+def test_get_set():
+    cache = TTLCache('test', max_entries=10, ttl=60)
+    assert cache.get('a') is MISSING
+    cache.set('a', [1, 2, 3])
+    assert cache.get('a') == [1, 2, 3]
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+    assert stats['entries'] == 1
+
+
+def test_expiry():
+    cache = TTLCache('test', max_entries=10, ttl=60)
+    cache.set('a', 1, ttl=0.01)
+    cache.set('b', 2)
+    time.sleep(0.02)
+    assert cache.get('a') is MISSING
+    assert cache.get('b') == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_lru_eviction():
+    cache = TTLCache('test', max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # Touch 'a' so that 'b' is the least recently used
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_budget():
+    big = list(range(1000))
+    size = approx_size(big)
+    cache = TTLCache('test', max_entries=100, ttl=60, max_bytes=size * 2)
+    cache.set('a', big)
+    cache.set('b', list(big))
+    cache.set('c', list(big))
+    assert cache.get('a') is MISSING
+    assert cache.stats()['bytes'] <= size * 2
+    # Values larger than the whole budget are not cached
+    cache.set('huge', list(range(10000)))
+    assert cache.get('huge') is MISSING
+
+
+def test_delete_clear():
+    cache = TTLCache('test', max_entries=10, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.delete('a')
+    assert cache.get('a') is MISSING
+    cache.clear()
+    assert cache.get('b') is MISSING
+    assert cache.stats()['bytes'] == 0
+
+
+def test_token_fingerprint():
+    assert token_fingerprint(None) == 'anonymous'
+    assert token_fingerprint('x') == token_fingerprint('x')
+    assert token_fingerprint('x') != token_fingerprint('y')
+    assert 'x' not in token_fingerprint('x')
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import pytest
+import threading
+import time
+from unittest.mock import patch
+
+from src.utils.cache import TTLCache, MISSING
+from src.utils.cache_backends import make_cache, run_io, SharedMemoryCache, SocketCache, CacheSidecar
+from src.utils.config import config
+
+
+@pytest.fixture
+def sidecar(tmp_path):
+    path = str(tmp_path / 'cache.sock')
+    server = CacheSidecar(path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def _check_basic_ops(cache):
+    assert cache.get(('a', True)) is MISSING
+    cache.set(('a', True), {'ws_ids': [1, 2]})
+    assert cache.get(('a', True)) == {'ws_ids': [1, 2]}
+    assert cache.peek(('a', True)) == {'ws_ids': [1, 2]}
+    cache.set('short', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('short') is MISSING
+    cache.delete(('a', True))
+    assert cache.get(('a', True)) is MISSING
+    cache.set('b', 2)
+    cache.clear()
+    assert cache.get('b') is MISSING
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 4
+
+
+def test_make_cache(tmp_path):
+    assert isinstance(make_cache('x', 10, 60), TTLCache)
+    with patch.dict(config, {'cache_backend': 'shm', 'cache_shm_dir': str(tmp_path)}):
+        assert isinstance(make_cache('x', 10, 60), SharedMemoryCache)
+    with patch.dict(config, {'cache_backend': 'socket'}):
+        assert isinstance(make_cache('x', 10, 60), SocketCache)
+    with patch.dict(config, {'cache_backend': 'redis'}):
+        with pytest.raises(RuntimeError):
+            make_cache('x', 10, 60)
+
+
+def test_shm_basic_ops(tmp_path):
+    _check_basic_ops(SharedMemoryCache('test', 10, 60, directory=str(tmp_path)))
+
+
+def test_shm_shared_between_instances(tmp_path):
+    # Stands in for two worker processes using the same directory
+    cache1 = SharedMemoryCache('test', 10, 60, directory=str(tmp_path))
+    cache2 = SharedMemoryCache('test', 10, 60, directory=str(tmp_path))
+    cache1.set('k', [1, 2, 3])
+    assert cache2.get('k') == [1, 2, 3]
+
+
+def test_shm_sweep_evicts_lru(tmp_path):
+    cache = SharedMemoryCache('test', 2, 60, directory=str(tmp_path))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('c', 3)
+    # Make 'a' the most recently used
+    past = time.time() - 10
+    for name in os.listdir(cache.directory):
+        os.utime(os.path.join(cache.directory, name), (past, past))
+    cache.get('a')
+    cache.set('expired', 4, ttl=-1)
+    cache.sweep()
+    assert cache.stats()['entries'] == 2
+    assert cache.get('a') == 1
+    assert cache.get('expired') is MISSING
+
+
+def test_socket_basic_ops(sidecar):
+    _check_basic_ops(SocketCache('test', 10, 60, path=sidecar))
+
+
+def test_socket_shared_between_clients(sidecar):
+    cache1 = SocketCache('test', 10, 60, path=sidecar)
+    cache2 = SocketCache('test', 10, 60, path=sidecar)
+    cache1.set('k', [1, 2, 3])
+    assert cache2.get('k') == [1, 2, 3]
+    assert cache2.stats()['sidecar']['entries'] == 1
+
+
+def test_socket_sidecar_unavailable(tmp_path):
+    cache = SocketCache('test', 10, 60, path=str(tmp_path / 'missing.sock'))
+    cache.set('k', 1)
+    assert cache.get('k') is MISSING
+    assert cache.stats()['errors'] == 3
+
+
+def test_shm_directory_is_private(tmp_path):
+    cache = SharedMemoryCache('test', 10, 60, directory=str(tmp_path))
+    assert os.stat(cache.directory).st_mode & 0o777 == 0o700
+
+
+def test_shm_refuses_shared_directory(tmp_path):
+    """A directory that others could plant entries in is not used"""
+    shared = tmp_path / 'search2-cache-test'
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(PermissionError):
+        SharedMemoryCache('test', 10, 60, directory=str(tmp_path))
+    shared.chmod(0o700)
+    with patch('src.utils.cache_backends.os.getuid', return_value=os.getuid() + 1):
+        with pytest.raises(PermissionError):
+            SharedMemoryCache('test', 10, 60, directory=str(tmp_path))
+
+
+def test_socket_refuses_shared_directory(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o777)
+    cache = SocketCache('test', 10, 60, path=str(shared / 'cache.sock'))
+    assert cache.get('k') is MISSING
+    assert cache.stats()['errors'] == 2
+
+
+def test_run_io(tmp_path):
+    """Shared backends are reached from a thread, so the event loop does not block"""
+    async def run():
+        return await run_io(threading.get_ident)
+    with patch.dict(config, {'cache_backend': 'shm'}):
+        assert asyncio.run(run()) != threading.get_ident()
+    with patch.dict(config, {'cache_backend': 'memory'}):
+        assert asyncio.run(run()) == threading.get_ident()
@@ -13,3 +13,17 @@ def test_init_config_invalid_config_url():
         os.environ['GLOBAL_CONFIG_URL'] = original_url
     else:
         os.environ.pop('GLOBAL_CONFIG_URL')
+
+
+def test_init_config_elasticsearch_nodes():
+    original_url = os.environ.get('ELASTICSEARCH_URL')
+    os.environ['ELASTICSEARCH_URL'] = "http://es1:9200/, http://es2:9200"
+    try:
+        config = init_config()
+    finally:
+        if original_url is not None:
+            os.environ['ELASTICSEARCH_URL'] = original_url
+        else:
+            os.environ.pop('ELASTICSEARCH_URL')
+    assert config['elasticsearch_urls'] == ['http://es1:9200', 'http://es2:9200']
+    assert config['elasticsearch_url'] == 'http://es1:9200'
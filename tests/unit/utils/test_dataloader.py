@@ -0,0 +1,74 @@
+import pytest
+import threading
+import time
+
+from src.utils.dataloader import DataLoader, get_loader
+
+
+def _loader(calls, delay=0):
+    def batch_fn(keys):
+        calls.append(list(keys))
+        time.sleep(delay)
+        return [key * 2 for key in keys]
+    return DataLoader(batch_fn)
+
+
+def test_load_many_batches_and_dedupes():
+    calls = []
+    loader = _loader(calls)
+    assert loader.load_many([1, 2, 1, 3]) == [2, 4, 2, 6]
+    assert calls == [[1, 2, 3]]
+    # Loaded keys are kept for the rest of the request
+    assert loader.load_many([3, 4]) == [6, 8]
+    assert loader.load(1) == 2
+    assert calls == [[1, 2, 3], [4]]
+    assert loader.batches == 2
+
+
+def test_prime():
+    calls = []
+    loader = _loader(calls)
+    loader.prime([1, 2])
+    loader.prime([2, 3])
+    assert loader.load(1) == 2
+    # Queued keys were fetched in the same batch
+    assert calls == [[1, 2, 3]]
+    assert loader.load_many([2, 3]) == [4, 6]
+    assert len(calls) == 1
+
+
+def test_error_not_kept():
+    calls = []
+
+    def batch_fn(keys):
+        calls.append(keys)
+        if len(calls) == 1:
+            raise RuntimeError('oops')
+        return keys
+    loader = DataLoader(batch_fn)
+    with pytest.raises(RuntimeError):
+        loader.load(1)
+    assert loader.load(1) == 1
+    assert len(calls) == 2
+
+
+def test_concurrent_loads_share_batch():
+    calls = []
+    loader = _loader(calls, delay=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(loader.load_many([1, 2]))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [[2, 4]] * 4
+    assert calls == [[1, 2]]
+
+
+def test_get_loader():
+    ctx = {'auth': None}
+    loader = get_loader(ctx, 'x', lambda keys: keys)
+    assert get_loader(ctx, 'x', lambda keys: []) is loader
+    assert get_loader(ctx, 'y', lambda keys: keys) is not loader
+    # Each request gets its own loaders
+    assert get_loader({}, 'x', lambda keys: keys) is not loader
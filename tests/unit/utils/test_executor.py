@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import pytest
+
+from src.exceptions import ServerBusy
+from src.utils.executor import BoundedExecutor
+
+
+def test_run_returns_result():
+    executor = BoundedExecutor(max_workers=2, max_queue=2)
+    result = asyncio.run(executor.run(lambda x, y: x + y, 1, 2))
+    assert result == 3
+    stats = executor.stats()
+    assert stats['completed'] == 1
+    assert stats['running'] == 0
+    assert stats['queued'] == 0
+
+
+def test_run_raises_from_func():
+    executor = BoundedExecutor(max_workers=1, max_queue=0)
+
+    def fail():
+        raise ValueError('x')
+
+    with pytest.raises(ValueError):
+        asyncio.run(executor.run(fail))
+    assert executor.stats()['completed'] == 1
+
+
+def test_run_rejects_when_full():
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        second = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        assert executor.stats()['queued'] == 1
+        with pytest.raises(ServerBusy):
+            await executor.run(release.wait)
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(main())
+    stats = executor.stats()
+    assert stats['rejected'] == 1
+    assert stats['completed'] == 2
+    assert stats['max_queued'] == 1
+    assert stats['max_wait'] > 0
@@ -0,0 +1,80 @@
+import gzip
+import json
+import responses
+from unittest.mock import patch
+
+from src.utils import http_client, http_compression
+from src.utils.config import config
+from tests.unit.mocks.async_client import mock_async_client, run_with_client
+
+
+def test_get_session_shared():
+    session = http_client.get_session()
+    assert http_client.get_session() is session
+    adapter = session.get_adapter('https://example.com')
+    assert adapter._pool_maxsize == config['http_pool_size']
+    assert adapter._pool_connections == config['http_pool_hosts']
+
+
+@responses.activate
+def test_prewarm():
+    for url in http_client.upstream_urls():
+        responses.add(responses.GET, url, status=405)
+    with patch.dict(config, {'http_prewarm': 2}):
+        http_client.prewarm()
+    urls = sorted(call.request.url.rstrip('/') for call in responses.calls)
+    assert urls == sorted(url.rstrip('/') for url in http_client.upstream_urls() * 2)
+
+
+@responses.activate
+def test_prewarm_ignores_errors():
+    # No responses registered, so every call raises a ConnectionError
+    with patch.dict(config, {'http_prewarm': 1}):
+        http_client.prewarm()
+
+
+def test_prewarm_disabled():
+    with patch.dict(config, {'http_prewarm': 0}), \
+            patch('src.utils.http_client.get_session') as mocked:
+        http_client.prewarm()
+        mocked.assert_not_called()
+
+
+def test_prewarm_async():
+    client = mock_async_client(lambda request: (200, {}, ''))
+    with patch.dict(config, {'http_prewarm': 3}), \
+            patch('src.utils.http_client.get_async_client', return_value=client):
+        run_with_client(client, http_client.prewarm_async())
+    assert len(client.calls) == 3 * len(http_client.upstream_urls())
+
+
+@responses.activate
+def test_session_compression():
+    url = config['elasticsearch_url'] + '/_search'
+    body = json.dumps({'x': 'y' * 2000})
+    resp_body = json.dumps({'took': 1})
+    responses.add(responses.POST, url, body=gzip.compress(resp_body.encode()),
+                  headers={'Content-Encoding': 'gzip'}, status=200)
+    with patch.dict(config, {'http_compress': ['elasticsearch'], 'http_compress_min_bytes': 1024}):
+        before = http_compression.stats().get('elasticsearch', {})
+        resp = http_client.get_session().post(url, data=body)
+        after = http_compression.stats()['elasticsearch']
+    req = responses.calls[0].request
+    assert req.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(req.body) == body.encode()
+    assert resp.json() == {'took': 1}
+    assert after['responses_compressed'] == before.get('responses_compressed', 0) + 1
+    assert after['response_bytes'] - before.get('response_bytes', 0) == len(resp_body)
+
+
+def test_async_client_compression():
+    url = config['elasticsearch_url'] + '/_search'
+    body = json.dumps({'x': 'y' * 2000})
+    client = http_client._CompressingAsyncClient()
+    with patch.dict(config, {'http_compress': ['elasticsearch'], 'http_compress_min_bytes': 1024}):
+        request = client.build_request('POST', url, content=body, headers={'Content-Type': 'application/json'})
+        small = client.build_request('POST', url, content='{}')
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert request.headers['Content-Type'] == 'application/json'
+    assert gzip.decompress(request.read()) == body.encode()
+    assert 'Content-Encoding' not in small.headers
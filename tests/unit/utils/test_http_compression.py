@@ -0,0 +1,48 @@
+import gzip
+from unittest.mock import patch
+
+from src.utils import http_compression
+from src.utils.config import config
+
+
+def _es_url():
+    return config['elasticsearch_url'] + '/test.index1/_search'
+
+
+def test_compress_off_by_default():
+    assert config['http_compress'] == []
+    assert http_compression.compress(_es_url(), 'x' * 10000) is None
+
+
+def test_compress():
+    body = '{"query": "' + 'x' * 2000 + '"}'
+    with patch.dict(config, {'http_compress': ['elasticsearch'], 'http_compress_min_bytes': 1024}):
+        before = http_compression.stats().get('elasticsearch', {})
+        compressed = http_compression.compress(_es_url(), body)
+        after = http_compression.stats()['elasticsearch']
+        # Small bodies, other upstreams and streams are sent as they are
+        assert http_compression.compress(_es_url(), '{}') is None
+        assert http_compression.compress(config['workspace_url'], body) is None
+        assert http_compression.compress(_es_url(), iter([body])) is None
+    assert gzip.decompress(compressed) == body.encode('utf-8')
+    assert after['requests_compressed'] == before.get('requests_compressed', 0) + 1
+    assert after['request_bytes'] - before.get('request_bytes', 0) == len(body)
+    assert after['request_bytes_sent'] - before.get('request_bytes_sent', 0) == len(compressed)
+    assert after['compress_seconds'] >= 0
+
+
+def test_observe_response():
+    before = http_compression.stats().get('user_profile', {})
+    http_compression.observe_response(config['user_profile_url'], 'gzip', 100, 1000)
+    # Responses that were not compressed, or from elsewhere, are not counted
+    http_compression.observe_response(config['user_profile_url'], 'identity', 100, 100)
+    http_compression.observe_response('http://example.com', 'gzip', 100, 1000)
+    after = http_compression.stats()['user_profile']
+    assert after['responses_compressed'] == before.get('responses_compressed', 0) + 1
+    assert after['response_bytes'] == before.get('response_bytes', 0) + 1000
+    assert after['response_bytes_received'] == before.get('response_bytes_received', 0) + 100
+
+
+def test_upstream_name():
+    assert http_compression.upstream_name(config['workspace_url']) == 'workspace'
+    assert http_compression.upstream_name('http://example.com') is None
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from src.utils.refresher import BackgroundRefresher
+
+
+def _wait_idle(refresher):
+    for _ in range(100):
+        if refresher.stats()['in_flight'] == 0:
+            return
+        time.sleep(0.01)
+
+
+def test_refresh_single_flight():
+    release = threading.Event()
+    calls = []
+
+    def refresh_fn():
+        calls.append(1)
+        release.wait()
+
+    refresher = BackgroundRefresher('test', needs_refresh=lambda key: False, interval=60, active_window=60)
+    assert not refresher.refresh('a')  # Not tracked
+    refresher.track('a', refresh_fn)
+    assert refresher.refresh('a')
+    assert not refresher.refresh('a')  # Already in flight
+    release.set()
+    _wait_idle(refresher)
+    assert calls == [1]
+    assert refresher.stats()['refreshes'] == 1
+
+
+def test_refresh_errors_counted():
+    def refresh_fn():
+        raise RuntimeError('x')
+
+    refresher = BackgroundRefresher('test', needs_refresh=lambda key: False, interval=60, active_window=60)
+    refresher.track('a', refresh_fn)
+    refresher.refresh('a')
+    _wait_idle(refresher)
+    assert refresher.stats()['errors'] == 1
+
+
+def test_refresh_due():
+    refreshed = []
+    refresher = BackgroundRefresher('test', needs_refresh=lambda key: key != 'fresh',
+                                    interval=60, active_window=0.05)
+    refresher.track('old', lambda: refreshed.append('old'))
+    time.sleep(0.06)
+    refresher.track('due', lambda: refreshed.append('due'))
+    refresher.track('fresh', lambda: refreshed.append('fresh'))
+    refresher._refresh_due()
+    _wait_idle(refresher)
+    # Inactive keys are dropped; active keys are refreshed only when due
+    assert refreshed == ['due']
+    assert refresher.stats()['tracked'] == 2
+
+
+def test_max_tracked():
+    refresher = BackgroundRefresher('test', needs_refresh=lambda key: False,
+                                    interval=60, active_window=60, max_tracked=1)
+    refresher.track('a', lambda: None)
+    refresher.track('b', lambda: None)
+    assert refresher.stats()['tracked'] == 1
@@ -1,9 +1,20 @@
+import json
 import pytest
 import responses
+import threading
+from unittest.mock import MagicMock, patch
 
 from src.utils.config import config
-from src.utils.user_profiles import get_user_profiles
+from src.utils import user_profiles
+from src.utils.user_profiles import get_user_profiles, get_user_profiles_async
 from src.exceptions import UserProfileError
+from tests.unit.mocks.async_client import mock_async_client, run_with_client
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    user_profiles._profile_cache.clear()
+    yield
 
 
 mock_resp = {
@@ -40,3 +51,99 @@ def test_get_user_profiles_invalid():
     responses.add(responses.POST, config['user_profile_url'], status=400)
     with pytest.raises(UserProfileError):
         get_user_profiles(['username'], 'x')
+
+
+def test_get_user_profiles_async_valid():
+    client = mock_async_client(lambda request: (200, {}, json.dumps(mock_resp)))
+    with patch('src.utils.user_profiles.get_async_client', return_value=client):
+        res = run_with_client(client, get_user_profiles_async(['username'], 'x'))
+    assert res == mock_resp['result'][0]
+    assert client.calls[0].headers['Authorization'] == 'x'
+
+
+def test_get_user_profiles_async_invalid():
+    client = mock_async_client(lambda request: (400, {}, ''))
+    with patch('src.utils.user_profiles.get_async_client', return_value=client):
+        with pytest.raises(UserProfileError):
+            run_with_client(client, get_user_profiles_async(['username'], 'x'))
+
+
+def _profile(username):
+    return {'user': {'username': username, 'realname': username.title()}, 'profile': {}}
+
+
+def _profiles_callback(request):
+    usernames = json.loads(request.body)['params'][0]
+    profiles = [None if username == 'nobody' else _profile(username) for username in usernames]
+    return (200, {}, json.dumps({'version': '1.1', 'result': [profiles]}))
+
+
+@responses.activate
+def test_get_user_profiles_cached():
+    responses.add_callback(responses.POST, config['user_profile_url'], callback=_profiles_callback)
+    # Clearing the cache keeps its counters, so only count this test's lookups
+    before = user_profiles._stats()
+    assert get_user_profiles(['a', 'b', 'a'], None) == [_profile('a'), _profile('b'), _profile('a')]
+    # Only the missing usernames are fetched
+    assert get_user_profiles(['b', 'c'], None) == [_profile('b'), _profile('c')]
+    assert json.loads(responses.calls[1].request.body)['params'] == [['c']]
+    assert get_user_profiles(['a', 'b', 'c'], None) == [_profile('a'), _profile('b'), _profile('c')]
+    assert len(responses.calls) == 2
+    assert json.loads(responses.calls[0].request.body)['params'] == [['a', 'b']]
+    # Missing profiles are not cached
+    assert get_user_profiles(['nobody'], None) == [None]
+    assert get_user_profiles(['nobody'], None) == [None]
+    assert len(responses.calls) == 4
+    stats = user_profiles._stats()
+    assert stats['hits'] - before['hits'] == 4
+    assert stats['misses'] - before['misses'] == 5
+    assert stats['hit_rate'] > 0
+
+
+def test_get_user_profiles_coalesced():
+    """Concurrent lookups of the same username share one upstream call"""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def post(url, data, headers):
+        calls.append(json.loads(data)['params'][0])
+        started.set()
+        release.wait(5)
+        resp = MagicMock(ok=True)
+        resp.json.return_value = {'result': [[_profile(u) for u in calls[0]]]}
+        return resp
+
+    results = []
+    with patch('src.utils.user_profiles.get_session') as get_session:
+        get_session.return_value.post.side_effect = post
+        first = threading.Thread(target=lambda: results.append(get_user_profiles(['a'], None)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(get_user_profiles(['a'], None)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+    assert results == [[_profile('a')], [_profile('a')]]
+    assert len(calls) == 1
+
+
+def test_get_user_profiles_coalesced_error():
+    """A failed fetch is passed on to callers waiting for the same usernames"""
+    (owned, waiting) = user_profiles._in_flight.claim(['a'])
+    assert owned == ['a']
+    (_, waiting) = user_profiles._in_flight.claim(['a'])
+    user_profiles._in_flight.fail(owned, UserProfileError('url', 'oops'))
+    with pytest.raises(UserProfileError):
+        waiting['a'].result()
+
+
+def test_get_user_profiles_async_cached():
+    client = mock_async_client(_profiles_callback)
+    with patch('src.utils.user_profiles.get_async_client', return_value=client):
+        res = run_with_client(client, get_user_profiles_async(['a', 'b'], None))
+    assert res == [_profile('a'), _profile('b')]
+    # Shared with the sync version
+    assert get_user_profiles(['a'], None) == [_profile('a')]
+    assert len(client.calls) == 1
@@ -3,6 +3,7 @@ import pytest
 import logging
 import time
 import math
+import responses
 
 # An upper limit on clock time within wait_for_services to make
 # a url get call (and other code in that pathway)
@@ -52,3 +53,11 @@ def test_init_config_invalid_config_url_10_timeout(caplog):
 
 def test_init_config_invalid_config_url_12_timeout(caplog):
     bad_url_with_timeout('foo', 'https://foo.bar.baz', 12, caplog)
+
+
+@responses.activate
+def test_wait_for_any_url():
+    """With several URLs, one that responds is enough"""
+    responses.add(responses.GET, 'http://es1:9200', status=503)
+    responses.add(responses.GET, 'http://es2:9200', json={}, status=200)
+    wait_for_service(['http://es1:9200', 'http://es2:9200'], 'foo', timeout=0)
@@ -1,15 +1,33 @@
 import pytest
 import responses
 import json
+import time
+from unittest.mock import patch
 
+from src.utils.cache import MISSING
 from src.utils.config import config
-from src.utils.workspace import ws_auth, get_workspace_info
+from src.utils import workspace
+from src.utils.workspace import ws_auth, get_workspace_info, ws_auth_async, get_workspace_info_async
+from src.utils.workspace import merge_ws_auth_parts, select_ws_auth_parts
+from src.utils.ws_id_set import WorkspaceIdSet
 from src.exceptions import ResponseError
+from tests.unit.mocks.async_client import mock_async_client, run_with_client
 
 # TODO: All tests should be rewritten to use an explicit service call matcher
 # where applicable. This ensures that the precisely correct call has been made.
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    workspace._ws_auth_cache.clear()
+    workspace._ws_id_sets.clear()
+    workspace._ws_info_cache.clear()
+    workspace._ws_info_refresher.clear()
+    workspace._ws_info_sync.update({'origin': None, 'after': None, 'synced_at': None})
+    workspace._ws_auth_refresher.clear()
+    yield
+
+
 def service_call_matcher(method, params):
     def match(request_body):
         try:
@@ -34,27 +52,6 @@ def service_call_matcher(method, params):
     return match
 
 
-mock_ws_ids_with_auth = {
-    "version": "1.1",
-    "result": [
-        {
-            "workspaces": [1, 2, 3],
-            "pub": [10, 11]
-        }
-    ]
-}
-
-mock_ws_ids_with_auth_only_public = {
-    "version": "1.1",
-    "result": [
-        {
-            "workspaces": [],
-            "pub": [10, 11]
-        }
-    ]
-}
-
-
 mock_ws_ids_with_auth_only_private = {
     "version": "1.1",
     "result": [
@@ -137,69 +134,93 @@ mock_obj_info = {
 }
 
 
-@responses.activate
-def test_ws_auth_valid():
-    # Mock the workspace call
+def _add_public_ids():
+    """Mock the anonymous lookup of the public workspace set."""
     responses.add(responses.POST,
                   config['workspace_url'],
-                  headers={'Authorization': 'valid_token'},
                   match=[
                       service_call_matcher(
                           'Workspace.list_workspace_ids',
                           {
                               'perm': 'r',
-                              'onlyGlobal': 0,
+                              'onlyGlobal': 1,
                               'excludeGlobal': 0
                           }
                       )
                   ],
-                  json=mock_ws_ids_with_auth,
+                  json=mock_ws_ids_without_auth,
                   status=200)
-    result = ws_auth('valid_token')
-    assert result == [1, 2, 3, 10, 11]
 
 
-@responses.activate
-def test_ws_auth_valid_public():
+def _add_private_ids(**kwargs):
+    """Mock the per-user lookup of the private workspaces."""
     responses.add(responses.POST,
                   config['workspace_url'],
-                  headers={'Authorization': 'valid_token'},
                   match=[
                       service_call_matcher(
                           'Workspace.list_workspace_ids',
                           {
                               'perm': 'r',
-                              'onlyGlobal': 1,
-                              'excludeGlobal': 0
+                              'onlyGlobal': 0,
+                              'excludeGlobal': 1
                           }
                       )
                   ],
-                  json=mock_ws_ids_with_auth_only_public,
-                  status=200)
+                  **kwargs)
+
+
+@responses.activate
+def test_ws_auth_valid():
+    # The public set is fetched anonymously, and only the private
+    # workspaces are fetched with the user's token
+    _add_public_ids()
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
+    result = ws_auth('valid_token')
+    assert list(result) == [1, 2, 3, 10, 11]
+    assert len(responses.calls) == 2
+    assert 'Authorization' not in responses.calls[0].request.headers
+    assert responses.calls[1].request.headers['Authorization'] == 'valid_token'
+
+
+@responses.activate
+def test_ws_auth_valid_public():
+    _add_public_ids()
     result = ws_auth('valid_token', only_public=True)
-    assert result == [10, 11]
+    assert list(result) == [10, 11]
+    # The public set is shared by every user
+    assert list(ws_auth('other_token', only_public=True)) == [10, 11]
+    assert list(ws_auth(None)) == [10, 11]
+    assert len(responses.calls) == 1
 
 
 @responses.activate
 def test_ws_auth_valid_private():
     # Mock the workspace call
-    responses.add(responses.POST,
-                  config['workspace_url'],
-                  headers={'Authorization': 'valid_token'},
-                  match=[
-                      service_call_matcher(
-                          'Workspace.list_workspace_ids',
-                          {
-                              'perm': 'r',
-                              'onlyGlobal': 0,
-                              'excludeGlobal': 1
-                          }
-                      )
-                  ],
-                  json=mock_ws_ids_with_auth_only_private,
-                  status=200)
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
     result = ws_auth('valid_token', only_private=True)
-    assert result == [1, 2, 3]
+    assert list(result) == [1, 2, 3]
+    assert len(responses.calls) == 1
+    # Versions the ACL document for the set
+    assert result.fetched_at is not None
+
+
+@responses.activate
+def test_ws_auth_merges_shared_workspaces():
+    # A public workspace the user also has permissions on is only listed once
+    _add_public_ids()
+    _add_private_ids(json={'version': '1.1', 'result': [{'workspaces': [1, 10], 'pub': []}]}, status=200)
+    assert list(ws_auth('valid_token')) == [1, 10, 11]
+
+
+@responses.activate
+def test_ws_auth_merged_set_reused():
+    _add_public_ids()
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
+    # The merged set, and the filter clause serialized from it, are reused
+    assert ws_auth('valid_token') is ws_auth('valid_token')
+    # Entries are cached in their compact encoded form
+    cached = workspace._ws_auth_cache.get(workspace._ws_auth_key('valid_token'))
+    assert WorkspaceIdSet.decode(cached['ws_ids']) == WorkspaceIdSet([1, 2, 3])
 
 
 def test_ws_auth_error_private_and_public():
@@ -217,22 +238,140 @@ def test_ws_auth_blank():
                   json=mock_ws_ids_without_auth,
                   status=200)
     result = ws_auth(None)
-    assert result == [10, 11]
+    assert list(result) == [10, 11]
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_ws_auth_blank_private():
+    # Anonymous users have no private workspaces
+    assert list(ws_auth(None, only_private=True)) == []
+    assert len(responses.calls) == 0
 
 
 @responses.activate
 def test_ws_auth_invalid():
     # Mock the workspace daily
-    responses.add(responses.POST,
-                  config['workspace_url'],
-                  headers={'Authorization': 'invalid_token'},
-                  status=401)
+    _add_public_ids()
+    _add_private_ids(status=401)
     with pytest.raises(ResponseError) as ctx:
         ws_auth('invalid_token')
     err = ctx.value
     assert err.jsonrpc_code == -32001
 
 
+@responses.activate
+def test_ws_auth_cached():
+    _add_public_ids()
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
+    assert list(ws_auth('valid_token')) == [1, 2, 3, 10, 11]
+    assert list(ws_auth('valid_token')) == [1, 2, 3, 10, 11]
+    assert len(responses.calls) == 2
+    # The private entry is shared between access flags, but not between tokens
+    assert list(ws_auth('valid_token', only_private=True)) == [1, 2, 3]
+    assert len(responses.calls) == 2
+    ws_auth('other_token')
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_ws_auth_stale_served_and_refreshed():
+    _add_public_ids()
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
+    key = workspace._ws_auth_key('valid_token')
+    stale = time.time() - config['ws_auth_cache_ttl'] - 1
+    workspace._ws_auth_cache.set(key, {'ws_ids': WorkspaceIdSet([1]).encode(), 'fetched_at': stale})
+    fresh = time.time()
+    workspace._ws_auth_cache.set(workspace._PUBLIC_KEY, {'ws_ids': WorkspaceIdSet([10]).encode(), 'fetched_at': fresh})
+    with patch.object(workspace._ws_auth_refresher, 'refresh') as refresh:
+        assert list(ws_auth('valid_token')) == [1, 10]
+        refresh.assert_called_once_with(key)
+    assert len(responses.calls) == 0
+    # The refresh function registered for the user re-fetches the entry
+    (_, refresh_fn) = workspace._ws_auth_refresher._tracked[key]
+    refresh_fn()
+    assert list(ws_auth('valid_token')) == [1, 2, 3, 10]
+    assert not workspace._ws_auth_needs_refresh(key)
+
+
+@responses.activate
+def test_ws_auth_public_refreshed():
+    _add_public_ids()
+    stale = time.time() - config['ws_auth_cache_ttl'] - 1
+    workspace._ws_auth_cache.set(workspace._PUBLIC_KEY, {'ws_ids': WorkspaceIdSet([10]).encode(), 'fetched_at': stale})
+    with patch.object(workspace._ws_auth_refresher, 'refresh') as refresh:
+        assert list(ws_auth(None, only_public=True)) == [10]
+        refresh.assert_called_once_with(workspace._PUBLIC_KEY)
+    (_, refresh_fn) = workspace._ws_auth_refresher._tracked[workspace._PUBLIC_KEY]
+    refresh_fn()
+    assert list(ws_auth(None, only_public=True)) == [10, 11]
+    assert 'Authorization' not in responses.calls[0].request.headers
+
+
+@responses.activate
+def test_ws_auth_parts():
+    _add_public_ids()
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
+    fingerprint = workspace._ws_auth_key('valid_token')[0]
+    parts = workspace.ws_auth_parts('valid_token')
+    assert [(name, list(ws_ids)) for (name, ws_ids) in parts] == [('public', [10, 11]), (fingerprint, [1, 2, 3])]
+    assert [name for (name, _) in workspace.ws_auth_parts('valid_token', only_private=True)] == [fingerprint]
+    assert [name for (name, _) in workspace.ws_auth_parts(None)] == ['public']
+
+
+@responses.activate
+def test_ws_auth_refresh_listener():
+    _add_private_ids(json=mock_ws_ids_with_auth_only_private, status=200)
+    refreshed = []
+    with patch.object(workspace, '_refresh_listeners', []):
+        workspace.add_refresh_listener(lambda name, ws_ids: refreshed.append((name, list(ws_ids))))
+        ws_auth('valid_token', only_private=True)
+        assert refreshed == []
+        key = workspace._ws_auth_key('valid_token')
+        (_, refresh_fn) = workspace._ws_auth_refresher._tracked[key]
+        refresh_fn()
+    assert refreshed == [(key[0], [1, 2, 3])]
+
+
+@responses.activate
+def test_ws_auth_invalid_cached():
+    _add_public_ids()
+    _add_private_ids(json={'version': '1.1', 'error': {'message': 'INVALID TOKEN'}}, status=500)
+    for _ in range(2):
+        with pytest.raises(ResponseError) as ctx:
+            ws_auth('invalid_token')
+        assert ctx.value.jsonrpc_code == -32001
+        assert ctx.value.message == 'INVALID TOKEN'
+    assert len(responses.calls) == 2
+
+
+@pytest.mark.parametrize('resp', [
+    {'body': '<html>Bad Gateway</html>', 'status': 502},
+    {'json': {'version': '1.1', 'error': {'message': 'Database is down'}}, 'status': 500},
+])
+@responses.activate
+def test_ws_auth_outage_not_cached(resp):
+    """A failing workspace is not mistaken for a rejected token"""
+    _add_public_ids()
+    _add_private_ids(**resp)
+    for _ in range(2):
+        with pytest.raises(ResponseError) as ctx:
+            ws_auth('valid_token')
+        assert ctx.value.jsonrpc_code == -32001
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_ws_auth_anonymous_error_not_cached():
+    responses.add(responses.POST,
+                  config['workspace_url'],
+                  status=500)
+    for _ in range(2):
+        with pytest.raises(ResponseError):
+            ws_auth(None)
+    assert len(responses.calls) == 2
+
+
 @responses.activate
 def test_get_workspace_info_valid():
     responses.add(responses.POST,
@@ -279,3 +418,141 @@ def test_get_workspace_info_invalid2():
     err = ctx.value
     assert err.jsonrpc_code == -32001
     assert len(err.message) > 0
+
+
+def _ws_info(workspace_id, user_perm='n', global_perm='r', save_date='2020-06-06T03:49:55+0000', max_objid=1):
+    return [workspace_id, 'ws', 'owner', save_date, max_objid, user_perm, global_perm, 'unlocked', {}]
+
+
+def _set_private_ids(auth_token, ws_ids):
+    key = workspace._ws_auth_key(auth_token)
+    workspace._ws_auth_cache.set(key, {'ws_ids': WorkspaceIdSet(ws_ids).encode(), 'fetched_at': time.time()})
+
+
+@responses.activate
+def test_get_workspace_info_cached_public():
+    responses.add(responses.POST,
+                  config['workspace_url'],
+                  json=mock_ws_info,
+                  status=200)
+    assert get_workspace_info(1, None) == mock_ws_info['result'][0]
+    assert get_workspace_info(1, None) == mock_ws_info['result'][0]
+    # Users without permissions of their own on the workspace share the public entry
+    _set_private_ids('token', [2])
+    assert get_workspace_info(1, 'token') == mock_ws_info['result'][0]
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_get_workspace_info_cached_per_user():
+    responses.add(responses.POST,
+                  config['workspace_url'],
+                  json={'version': '1.1', 'result': [_ws_info(1, user_perm='a')]},
+                  status=200)
+    _set_private_ids('token', [1])
+    assert get_workspace_info(1, 'token')[5] == 'a'
+    assert get_workspace_info(1, 'token')[5] == 'a'
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.headers['Authorization'] == 'token'
+    _set_private_ids('other_token', [1])
+    get_workspace_info(1, 'other_token')
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_get_workspace_info_expired():
+    responses.add(responses.POST,
+                  config['workspace_url'],
+                  json=mock_ws_info,
+                  status=200)
+    checked_at = time.time() - config['ws_info_cache_ttl'] - 1
+    workspace._ws_info_cache.set((1, 'public'), {'info': _ws_info(1, max_objid=0), 'checked_at': checked_at})
+    assert get_workspace_info(1, None) == mock_ws_info['result'][0]
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_get_workspace_info_sync():
+    responses.add(responses.POST,
+                  config['workspace_url'],
+                  json={'version': '1.1', 'result': [[_ws_info(1, max_objid=2), _ws_info(3)]]},
+                  status=200)
+    checked_at = time.time() - 10
+    workspace._ws_info_cache.set((1, 'public'), {'info': _ws_info(1), 'checked_at': checked_at})
+    workspace._ws_info_cache.set((2, 'public'), {'info': _ws_info(2), 'checked_at': checked_at})
+    assert workspace._ws_info_sync_due()
+    workspace._sync_public_ws_infos()
+    assert not workspace._ws_info_sync_due()
+    rpc = json.loads(responses.calls[0].request.body)
+    assert rpc['method'] == 'Workspace.list_workspace_info'
+    after_epoch = rpc['params'][0]['after_epoch']
+    assert after_epoch < (time.time() - config['ws_info_cache_ttl']) * 1000
+    assert 'Authorization' not in responses.calls[0].request.headers
+    # Changed entries are replaced; others are left alone, and uncached workspaces are not added
+    assert get_workspace_info(1, None)[4] == 2
+    assert workspace._ws_info_cache.peek((3, 'public')) is MISSING
+    # Unchanged entries stay valid past the TTL while syncs succeed
+    later = time.time() + config['ws_info_cache_ttl'] - 5
+    with patch('time.time', return_value=later):
+        assert get_workspace_info(2, None) == _ws_info(2)
+        workspace._sync_public_ws_infos()
+    assert len(responses.calls) == 2
+    # The next sync only asks for changes since the previous one
+    assert json.loads(responses.calls[1].request.body)['params'][0]['after_epoch'] > after_epoch
+
+
+def _json_callback(status, body):
+    def callback(request):
+        return (status, {'Content-Type': 'application/json'}, json.dumps(body))
+    return callback
+
+
+def _ws_ids_callback(request):
+    rpc = json.loads(request.body)
+    if rpc['params'][0]['onlyGlobal']:
+        body = mock_ws_ids_without_auth
+    else:
+        body = mock_ws_ids_with_auth_only_private
+    return (200, {'Content-Type': 'application/json'}, json.dumps(body))
+
+
+def test_ws_auth_async_valid():
+    client = mock_async_client(_ws_ids_callback)
+    with patch('src.utils.workspace.get_async_client', return_value=client):
+        result = run_with_client(client, ws_auth_async('valid_token'))
+    assert list(result) == [1, 2, 3, 10, 11]
+    assert len(client.calls) == 2
+    assert 'Authorization' not in client.calls[0].headers
+    assert json.loads(client.calls[0].body)['params'] == [{'perm': 'r', 'onlyGlobal': 1, 'excludeGlobal': 0}]
+    assert client.calls[1].headers['Authorization'] == 'valid_token'
+    rpc = json.loads(client.calls[1].body)
+    assert rpc['method'] == 'Workspace.list_workspace_ids'
+    assert rpc['params'] == [{'perm': 'r', 'onlyGlobal': 0, 'excludeGlobal': 1}]
+    # The sync and async versions share the cache
+    assert list(ws_auth('valid_token')) == [1, 2, 3, 10, 11]
+
+
+def test_ws_auth_async_invalid():
+    client = mock_async_client(lambda request: (401, {}, ''))
+    with patch('src.utils.workspace.get_async_client', return_value=client):
+        with pytest.raises(ResponseError) as ctx:
+            run_with_client(client, ws_auth_async('invalid_token'))
+    assert ctx.value.jsonrpc_code == -32001
+
+
+def test_get_workspace_info_async_valid():
+    client = mock_async_client(_json_callback(200, mock_ws_info))
+    with patch('src.utils.workspace.get_async_client', return_value=client):
+        result = run_with_client(client, get_workspace_info_async(1, None))
+    assert result == mock_ws_info['result'][0]
+    assert 'Authorization' not in client.calls[0].headers
+
+
+def test_select_ws_auth_parts():
+    parts = [('public', WorkspaceIdSet([1])), ('abc', WorkspaceIdSet([2]))]
+    assert select_ws_auth_parts(parts) == parts
+    assert select_ws_auth_parts(parts, only_public=True) == parts[:1]
+    assert select_ws_auth_parts(parts, only_private=True) == parts[1:]
+    assert list(merge_ws_auth_parts(parts)) == [1, 2]
+    with pytest.raises(Exception):
+        select_ws_auth_parts(parts, only_public=True, only_private=True)
@@ -0,0 +1,66 @@
+import json
+import sys
+
+from src.utils.ws_id_set import WorkspaceIdSet
+
+
+def test_sorted_and_unique():
+    ws_ids = WorkspaceIdSet([10, 3, 1, 3])
+    assert list(ws_ids) == [1, 3, 10]
+    assert ws_ids.to_list() == [1, 3, 10]
+    assert len(ws_ids) == 3
+    assert 3 in ws_ids
+    assert 4 not in ws_ids
+    assert 11 not in ws_ids
+
+
+def test_of():
+    ws_ids = WorkspaceIdSet([1])
+    assert WorkspaceIdSet.of(ws_ids) is ws_ids
+    assert WorkspaceIdSet.of([2, 1]) == WorkspaceIdSet([1, 2])
+
+
+def test_union():
+    private = WorkspaceIdSet([1, 10])
+    public = WorkspaceIdSet([10, 11])
+    assert private.union(public) == WorkspaceIdSet([1, 10, 11])
+    # Nothing to merge
+    empty = WorkspaceIdSet()
+    assert private.union(empty) is private
+    assert empty.union(public) is public
+
+
+def test_intersection():
+    ws_ids = WorkspaceIdSet([1, 2, 3])
+    assert ws_ids.intersection([3, 4, 1]) == WorkspaceIdSet([1, 3])
+    assert len(ws_ids.intersection([5])) == 0
+
+
+def test_encode_decode():
+    for ids in ([], [5], [1, 2, 200], [1, 300, 70000], [1, 2 ** 33], [1, 2, 2 ** 40]):
+        ws_ids = WorkspaceIdSet(ids)
+        encoded = ws_ids.encode()
+        # Stored in the JSON-based shared caches
+        assert json.loads(json.dumps(encoded)) == encoded
+        decoded = WorkspaceIdSet.decode(encoded)
+        assert decoded == ws_ids
+        assert decoded.encode() == encoded
+
+
+def test_terms_json():
+    ws_ids = WorkspaceIdSet([2, 1])
+    terms = ws_ids.terms_json('access_group')
+    assert json.loads(terms) == {'terms': {'access_group': [1, 2]}}
+    # Serialized once per set
+    assert ws_ids.terms_json('access_group') is terms
+
+
+def test_compact():
+    ids = list(range(100000, 110000))
+    assert sys.getsizeof(WorkspaceIdSet(ids)) < sys.getsizeof(ids) + sum(sys.getsizeof(i) for i in ids) / 3
+    # Dense IDs take one byte each
+    assert len(WorkspaceIdSet(ids).encode()) < len(json.dumps(ids)) / 4
+
+
+def test_serial_unique():
+    assert WorkspaceIdSet([1]).serial != WorkspaceIdSet([1]).serial